@@ -1,11 +1,13 @@
 """
 This is a fun python script where you can enter your cards and it can help you learn
-your pot odds. Built off the monte carlo algorithms in `abstraction.py` to calculate values of hands.
+your pot odds. The equities are computed by `equity.py`: exact on the flop, turn and river, and
+stratified over 10000 runouts pre-flop. The equity distributions use the Monte-Carlo algorithms in `abstraction.py`.
 """
 import sys
 sys.path.append('./src')
 
-from abstraction import calculate_equity, calculate_equity_distribution, plot_equity_hist
+from abstraction import calculate_equity_distribution, plot_equity_hist
+import equity as equity_engine
 import fast_evaluator
 import argparse
 import random
@@ -36,7 +38,7 @@ if __name__ == "__main__":
 				player_cards = input("Input your cards (ex: Ac 7h): ")
 				player_cards = player_cards.split(" ")
 
-			equity = calculate_equity(player_cards, [], n=10000) # We want this to be really accurate
+			equity = equity_engine.equity(player_cards, [], n_runouts=10000, tie_value=1.0) # We want this to be really accurate
 			print("Pre-Flop Equity: {:.2f}%".format(equity * 100))
 			community_cards = input("Flop Cards: ")
 			community_cards = community_cards.split(" ")
@@ -51,7 +53,7 @@ if __name__ == "__main__":
 
 			# equity_hist = calculate_equity_distribution(player_cards, community_cards)
 			# plot_equity_hist(equity_hist)
-			equity = calculate_equity(player_cards, community_cards, n=10000) # We want this to be really accurate
+			equity = equity_engine.equity(player_cards, community_cards, mode="exact", tie_value=1.0)
 			print("Flop Equity: {:.2f}%".format(equity * 100))
 
 			turn_card = input("Turn Card: ")
@@ -59,7 +61,7 @@ if __name__ == "__main__":
 				continue
 			else:
 				community_cards.append(turn_card)
-			equity = calculate_equity(player_cards, community_cards, n=10000) # We want this to be really accurate
+			equity = equity_engine.equity(player_cards, community_cards, mode="exact", tie_value=1.0)
 			print("Turn Equity: {:.2f}%".format(equity * 100))
 
 			river_card = input("River Card: ")
@@ -67,7 +69,7 @@ if __name__ == "__main__":
 				continue
 			else:
 				community_cards.append(river_card)
-			equity = calculate_equity(player_cards, community_cards, n=10000) # We want this to be really accurate
+			equity = equity_engine.equity(player_cards, community_cards, mode="exact", tie_value=1.0)
 			print("River Equity: {:.2f}%".format(equity * 100))
 
 			print("\n")
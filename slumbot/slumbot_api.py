@@ -61,10 +61,10 @@ from postflop_holdem import PostflopHoldemInfoSet, PostflopHoldemHistory
 
 
 from abstraction import (
-    calculate_equity,
     calculate_equity_distribution,
     plot_equity_hist,
 )
+import equity as equity_engine
 
 host = "slumbot.com"
 
@@ -340,7 +340,8 @@ def ComputeStrategy(hole_cards, board, action, strategy=STRATEGY):
         else:  # opponent has bet, so simply call
             incr = "c"
     elif strategy == 2:
-        equity = calculate_equity(hole_cards, board, n=5000)
+        # Ties count as wins, as they did with `abstraction.calculate_equity`
+        equity = equity_engine.equity(hole_cards, board, tie_value=1.0)
         if a["last_bettor"] == -1:
             if equity >= 0.5:
                 incr = "b1000"
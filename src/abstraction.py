@@ -16,26 +16,30 @@ an equity distribution rather than a scalar value. This idea was taken from this
 This kind of abstraction is used by all superhuman Poker AIs.
 
 We can cluster hands using K-Means to cluster hands of similar distance. The distance metric used is Earth Mover's
-Distance, which is taken from the Python Optiaml Transport Library.
+Distance, see `emd_kmeans.py`.
 
 How do I find the optimal number of clusters?
 """
 
 from typing import List
 import fast_evaluator
+import equity as equity_engine
 from phevaluator import evaluate_cards
 import random
 import matplotlib.pyplot as plt
 import time
 import numpy as np
 import os
+import json
 from utils import get_filenames
 import joblib
 from joblib import Parallel, delayed
 from tqdm import tqdm
 from fast_evaluator import phEvaluatorSetup
+from hand_isomorphism import get_indexer, street_of
+from functools import lru_cache
 import argparse
-from sklearn.cluster import KMeans
+from emd_kmeans import EMDKMeans
 
 USE_KMEANS = True  # use kmeans if you want to cluster by equity distribution (more refined, but less accurate)
 NUM_FLOP_CLUSTERS = 10
@@ -44,6 +48,11 @@ NUM_RIVER_CLUSTERS = 10
 
 NUM_BINS = 10
 
+CLUSTER_TABLE_DIRECTORY = "../kmeans_data/tables"  # See `cluster_tables.py`
+kmeans_filenames = {}
+cluster_tables = {}
+cluster_tables_loaded = False  # The tables are loaded by the first call to `predict_cluster`
+
 
 def load_kmeans_classifiers():
     global kmeans_flop, kmeans_turn
@@ -51,10 +60,12 @@ def load_kmeans_classifiers():
     filename = sorted(get_filenames(f"../kmeans_data/kmeans/flop"))[-1]
     print("Loading KMeans Flop Classifier", filename)
     kmeans_flop = joblib.load(f"../kmeans_data/kmeans/flop/{filename}")
+    kmeans_filenames["flop"] = filename
 
     filename = sorted(get_filenames(f"../kmeans_data/kmeans/turn"))[-1]
     print("Loading KMeans Turn Classifier", filename)
     kmeans_turn = joblib.load(f"../kmeans_data/kmeans/turn/{filename}")
+    kmeans_filenames["turn"] = filename
 
     assert len(kmeans_flop.cluster_centers_) == NUM_FLOP_CLUSTERS
     assert len(kmeans_turn.cluster_centers_) == NUM_TURN_CLUSTERS
@@ -75,6 +86,44 @@ if USE_KMEANS:
         clustering = True
 
 
+def street_clusters(street):
+    if street == "flop":
+        return NUM_FLOP_CLUSTERS
+    elif street == "turn":
+        return NUM_TURN_CLUSTERS
+    return NUM_RIVER_CLUSTERS
+
+
+def street_source(street):
+    """The classifier of the clusters of `street`: the file of its KMeans classifier, or "equity" for equity buckets."""
+    if USE_KMEANS and street != "river":
+        return kmeans_filenames.get(street)
+    return "equity"
+
+
+def load_cluster_tables(directory=None):
+    """
+    Memory-maps the cluster tables of `cluster_tables.py` that were computed for the current abstraction (same number
+    of classes, of clusters, and same classifier), so that `predict_cluster` reads the cluster of these streets.
+    Called by the first `predict_cluster`, so importing this module does not touch the tables.
+    """
+    global cluster_tables_loaded
+    cluster_tables_loaded = True
+    cluster_tables.clear()
+    for street in ["flop", "turn", "river"]:
+        path = os.path.join(directory or CLUSTER_TABLE_DIRECTORY, street)
+        if not os.path.exists(os.path.join(path, "manifest.json")):
+            continue
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        expected = (get_indexer(street).size(), street_clusters(street), street_source(street))
+        if (manifest["size"], manifest["n_clusters"], manifest["source"]) != expected:
+            print(f"Ignoring the {street} cluster table, computed for another abstraction")
+            continue
+        cluster_tables[street] = np.load(os.path.join(path, "clusters.npy"), mmap_mode="r")
+    return cluster_tables
+
+
 def evaluate_winner(board, player_hand, opponent_hand):
     p1_score = evaluate_cards(*(board + player_hand))
     p2_score = evaluate_cards(*(board + opponent_hand))
@@ -86,6 +135,14 @@ def evaluate_winner(board, player_hand, opponent_hand):
         return 0
 
 
+def evaluate_winners(boards, player_hands, opponent_hands):
+    """`evaluate_winner` of every deal, with `fast_evaluator.evaluate_batch`."""
+    boards = fast_evaluator.card_ids(boards)
+    p1_scores = fast_evaluator.evaluate_batch(np.concatenate((boards, fast_evaluator.card_ids(player_hands)), axis=1))
+    p2_scores = fast_evaluator.evaluate_batch(np.concatenate((boards, fast_evaluator.card_ids(opponent_hands)), axis=1))
+    return np.sign(p2_scores - p1_scores)
+
+
 # ----- Load the pre-generated dataset -----
 def load_dataset(batch=0):
     global boards, player_hands, opponent_hands
@@ -181,10 +238,7 @@ def generate_dataset(num_samples=50000, batch=0, save=True):
         delayed(predict_cluster)(cards) for cards in tqdm(opp_river_cards)
     )
 
-    winners = Parallel(n_jobs=-1)(
-        delayed(evaluate_winner)(board, player_hand, opponent_hand)
-        for board, player_hand, opponent_hand in tqdm(zip(boards, player_hands, opponent_hands))
-    )
+    winners = evaluate_winners(boards, player_hands, opponent_hands)
 
     if save:
         print("saving datasets")
@@ -202,6 +256,59 @@ def generate_dataset(num_samples=50000, batch=0, save=True):
         np.save(f"dataset/opp_river_clusters_{batch}.npy", opp_river_clusters)
 
 
+# ----- Public boards, for public chance sampling (see `public_chance_cfr.py`) -----
+def get_board_hands(board):
+    """All the 1081 hands that do not use a card of the 5 card board, in a fixed order."""
+    deck = sorted(card for card in fast_evaluator.Deck() if card not in board)
+    return [[deck[i], deck[j]] for i in range(len(deck)) for j in range(i + 1, len(deck))]
+
+
+def cluster_board_hand(board, hand):
+    """Flop, turn and river clusters of `hand` on `board`."""
+    return [
+        predict_cluster(hand + board[:3]),
+        predict_cluster(hand + board[:4]),
+        predict_cluster(hand + board),
+    ]
+
+
+def generate_public_dataset(num_boards=100, batch=0, save=True):
+    """
+    Pre-generates the boards for public chance sampling, with the clusters of every hand on every board, so
+    training never calls `predict_cluster`.
+
+    public_hands[b][h] = h-th hand of board b
+    public_clusters[b][k][h] = cluster of hand h on board b, on the flop (k = 0), turn (k = 1) and river (k = 2)
+    public_scores[b][h] = score of hand h on board b, lower is better
+    """
+    global public_boards, public_hands, public_clusters, public_scores
+
+    public_boards, _, _ = phEvaluatorSetup(num_boards)
+    public_hands = [get_board_hands(board) for board in public_boards]
+    public_clusters = []
+    public_scores = []
+    for board, hands in zip(public_boards, tqdm(public_hands)):
+        results = np.array(Parallel(n_jobs=-1)(delayed(cluster_board_hand)(board, hand) for hand in hands))
+        public_clusters.append(results.T)
+        public_scores.append(fast_evaluator.evaluate_batch(fast_evaluator.card_ids([board + hand for hand in hands])))
+
+    if save:
+        print("saving public datasets")
+        np.save(f"dataset/public_boards_{batch}.npy", public_boards)
+        np.save(f"dataset/public_hands_{batch}.npy", public_hands)
+        np.save(f"dataset/public_clusters_{batch}.npy", public_clusters)
+        np.save(f"dataset/public_scores_{batch}.npy", public_scores)
+
+
+def load_public_dataset(batch=0):
+    global public_boards, public_hands, public_clusters, public_scores
+
+    public_boards = np.load(f"dataset/public_boards_{batch}.npy").tolist()
+    public_hands = np.load(f"dataset/public_hands_{batch}.npy").tolist()
+    public_clusters = np.load(f"dataset/public_clusters_{batch}.npy")
+    public_scores = np.load(f"dataset/public_scores_{batch}.npy")
+
+
 # Preflop Abstraction with 169 buckets (lossless abstraction)
 def get_preflop_cluster_id(two_cards_string):  # Lossless abstraction for pre-flop, 169 clusters
     # cards input ex: Ak2h or ['Ak', '2h']
@@ -284,31 +391,103 @@ def get_preflop_cluster_id(two_cards_string):  # Lossless abstraction for pre-fl
     return cluster_id
 
 
+# ----- Pre-flop all-in equity table, see `preflop_holdem.equity_table` -----
+PREFLOP_EQUITY_FILE = "dataset/preflop_equity.npy"
+
+
+def get_preflop_cluster_hands():
+    """
+    Returns a dict of pre-flop cluster id -> the starting hands of the cluster (6 per pocket pair, 12 per unsuited
+    hand, 4 per suited hand, 1326 in total).
+    """
+    deck = fast_evaluator.Deck()
+    cluster_hands = {}
+    for i in range(len(deck)):
+        for j in range(i + 1, len(deck)):
+            hand = [deck[i], deck[j]]
+            cluster_hands.setdefault(get_preflop_cluster_id(hand), []).append(hand)
+    return cluster_hands
+
+
+def calculate_preflop_matchup_equity(cluster_id, opponent_cluster_id, n=2000, cluster_hands=None):
+    """
+    All-in equity (wins + half of the ties) of a hand of `cluster_id` against a hand of `opponent_cluster_id`.
+
+    The two hands are drawn uniformly among the pairs of hands of the two clusters that do not share a card, so
+    card removal is taken into account (ex: AKs blocks AA), then the board is drawn among the 48 remaining cards.
+    """
+    if cluster_hands is None:
+        cluster_hands = get_preflop_cluster_hands()
+    matchups = [
+        (hand, opponent_hand)
+        for hand in cluster_hands[cluster_id]
+        for opponent_hand in cluster_hands[opponent_cluster_id]
+        if not set(hand) & set(opponent_hand)
+    ]
+    full_deck = fast_evaluator.Deck()
+
+    boards, hands, opponent_hands = [], [], []
+    for _ in range(n):
+        hand, opponent_hand = random.choice(matchups)
+        deck = [card for card in full_deck if card not in hand and card not in opponent_hand]
+        boards.append(random.sample(deck, 5))
+        hands.append(hand)
+        opponent_hands.append(opponent_hand)
+
+    winners = evaluate_winners(boards, hands, opponent_hands)
+    return float(np.mean((winners + 1) / 2))
+
+
+def generate_preflop_equity_table(n=2000, save=True):
+    """
+    Returns the 169 x 169 table of `calculate_preflop_matchup_equity`, indexed by cluster id - 1. Only the upper
+    triangle is estimated, the lower triangle is 1 - its transpose, so the table is exactly zero-sum.
+
+    An exact enumeration of the boards is too slow in Python (~1.7M boards per matchup), so each matchup is estimated
+    with `n` boards, once, and saved. The standard error is at most 0.5 / sqrt(n).
+    """
+    cluster_hands = get_preflop_cluster_hands()
+    pairs = [(i, j) for i in range(1, 170) for j in range(i, 170)]
+    equities = Parallel(n_jobs=-1)(
+        delayed(calculate_preflop_matchup_equity)(i, j, n, cluster_hands) for i, j in tqdm(pairs)
+    )
+
+    equity_table = np.zeros((169, 169))
+    for (i, j), equity in zip(pairs, equities):
+        equity_table[i - 1, j - 1] = equity
+        equity_table[j - 1, i - 1] = 1 - equity
+    for i in range(169):  # Same cluster: both players have the same expected value
+        equity_table[i, i] = 0.5
+
+    if save:
+        np.save(PREFLOP_EQUITY_FILE, equity_table)
+    return equity_table
+
+
+def load_preflop_equity_table():
+    return np.load(PREFLOP_EQUITY_FILE)
+
+
 def calculate_equity(player_cards: List[str], community_cards=[], n=2000, timer=False):
+    """
+    Equity of `player_cards` against a random hand, with the engine of `equity.py`: exact from the flop on (its 1081
+    turn and river pairs take about 0.3s), and stratified over max(DEFAULT_RUNOUTS, n / 4) runouts pre-flop. Every
+    runout scores all the ~1000 opponent hands, so the pre-flop error (about 0.008 for n=2000) is no larger than the
+    one of the n Monte-Carlo showdowns it replaces. Ties count as wins, as they always have for the abstractions.
+    """
     if timer:
         start_time = time.time()
-    wins = 0
-    deck = fast_evaluator.Deck(excluded_cards=player_cards + community_cards)
 
-    for _ in range(n):
-        random.shuffle(deck)
-        opponent_cards = deck[:2]  # To avoid creating redundant copies
-        player_score = evaluate_cards(
-            *(player_cards + community_cards + deck[2 : 2 + (5 - len(community_cards))])
-        )
-        opponent_score = evaluate_cards(
-            *(opponent_cards + community_cards + deck[2 : 2 + (5 - len(community_cards))])
-        )
-        if player_score < opponent_score:
-            wins += 1
-        elif player_score == opponent_score:
-            wins += 1
-            # wins += 0.5
+    if community_cards:
+        result = equity_engine.equity(player_cards, community_cards, "exact", tie_value=1.0)
+    else:
+        n_runouts = max(equity_engine.DEFAULT_RUNOUTS, n // 4)
+        result = equity_engine.equity(player_cards, community_cards, "stratified", n_runouts, tie_value=1.0)
 
     if timer:
         print("Time it takes to call function: {}s".format(time.time() - start_time))
 
-    return wins / n
+    return result
 
 
 def calculate_equity_distribution(
@@ -456,16 +635,81 @@ def generate_postflop_equity_distributions(
         # Store the list of hands, so you can associate a particular distribution with a particular hand
 
 
-def predict_cluster_kmeans(kmeans_classifier, cards, n=200):
+def distribution_clusters(kmeans_classifier, hands):
+    """
+    KMeans cluster of every row of `hands` (card ids, hole cards first, on the flop or turn), from its exact equity
+    distribution over every next card (see `equity.equity_distributions`). The tables of `cluster_tables.py` are
+    computed with it too.
+    """
+    return kmeans_classifier.predict(equity_engine.equity_distributions(hands, NUM_BINS, tie_value=1.0))
+
+
+def refit_kmeans_classifier(stage, chunk_size=100, save=True):
+    """
+    Refits the latest KMeans classifier of `stage` ("flop" or "turn") on the exact equity distributions of the hands it
+    was fitted on. The classifiers fitted on the distributions of `calculate_equity_distribution`, from sampled next
+    cards, do not match the exact distributions of `distribution_clusters`. The fit starts from the old centroids, so
+    cluster k stays close to the old cluster k, but about half of the hands change cluster: the datasets and strategies
+    computed with the old clusters have to be generated again (see `generate_dataset`).
+    """
+    filename = sorted(get_filenames(f"../kmeans_data/kmeans/{stage}"))[-1]
+    old_kmeans = joblib.load(f"../kmeans_data/kmeans/{stage}/{filename}")
+    name = filename[len("kmeans_") : -len(".joblib")]
+    cards = np.load(f"../kmeans_data/cards/{stage}/{name}.npy")
+    hands = fast_evaluator.card_ids([hand.split() for hand in cards])
+
+    chunks = Parallel(n_jobs=-1)(
+        delayed(equity_engine.equity_distributions)(hands[start : start + chunk_size], NUM_BINS, tie_value=1.0)
+        for start in tqdm(range(0, len(hands), chunk_size))
+    )
+    equity_distributions = np.concatenate(chunks)
+    kmeans = EMDKMeans(len(old_kmeans.cluster_centers_), init=old_kmeans.cluster_centers_, n_jobs=-1)
+    kmeans.fit(equity_distributions)
+    old_clusters = old_kmeans.predict(np.load(f"../kmeans_data/distributions/{stage}/{name}.npy"))
+    print(f"{stage}: {np.mean(kmeans.labels_ == old_clusters):.1%} of the hands kept their cluster")
+
+    if save:
+        name = f"{int(time.time())}_samples={len(hands)}_bins={NUM_BINS}_exact"
+        np.save(f"../kmeans_data/distributions/{stage}/{name}.npy", equity_distributions)
+        np.save(f"../kmeans_data/cards/{stage}/{name}.npy", cards)
+        np.save(f"../kmeans_data/centroids/{stage}/centroids_{name}.npy", kmeans.cluster_centers_)
+        joblib.dump(kmeans, f"../kmeans_data/kmeans/{stage}/kmeans_{name}.joblib")
+    return kmeans
+
+
+def predict_cluster_kmeans(kmeans_classifier, cards):
     """cards is a list of cards"""
     assert type(cards) == list
-    equity_distribution = calculate_equity_distribution(cards[:2], cards[2:], n=n)
-    y = kmeans_classifier.predict([equity_distribution])
+    y = distribution_clusters(kmeans_classifier, fast_evaluator.card_ids([cards]))
     assert len(y) == 1
     return y[0]
 
 
 def predict_cluster(cards):
+    """
+    Cluster of `cards` (hole cards + board) on the flop, turn or river. The suits do not change the cluster, so it is
+    computed once per suit-isomorphism class (see `hand_isomorphism.py`), on the canonical hand of the class. It is
+    read from the table of the street when it was precomputed (see `load_cluster_tables`).
+    """
+    assert type(cards) == list
+    if len(cards) not in [5, 6, 7]:
+        raise ValueError("Invalid number of cards: ", len(cards))
+    street = street_of(cards)
+    index = get_indexer(street).index(cards)
+    if not cluster_tables_loaded:
+        load_cluster_tables()
+    if street in cluster_tables:
+        return int(cluster_tables[street][index])
+    return predict_class_cluster(street, index)
+
+
+@lru_cache(maxsize=2**20)
+def predict_class_cluster(street, index):
+    """Cluster of the canonical hand of class `index` of `street`."""
+    return predict_hand_cluster(get_indexer(street).unindex(index))
+
+
+def predict_hand_cluster(cards):
     assert type(cards) == list
 
     if USE_KMEANS:
@@ -488,11 +732,19 @@ def predict_cluster(cards):
             raise ValueError("Invalid number of cards: ", len(cards))
 
 
-def predict_cluster_fast(cards, n=2000, total_clusters=10):
+def equity_buckets(hands, total_clusters=10):
+    """
+    Equity bucket of every row of `hands` (card ids, hole cards first, on the flop, turn or river), from the exact
+    equity with ties counted as wins. The tables of `cluster_tables.py` are computed with it too, so a hand gets the
+    same cluster whether it is read from a table or computed.
+    """
+    equities = equity_engine.exact_equities(hands, tie_value=1.0)
+    return np.minimum(total_clusters - 1, (equities * total_clusters).astype(np.int64))
+
+
+def predict_cluster_fast(cards, total_clusters=10):
     assert type(cards) == list
-    equity = calculate_equity(cards[:2], cards[2:], n=n)
-    cluster = min(total_clusters - 1, int(equity * total_clusters))
-    return cluster
+    return int(equity_buckets(fast_evaluator.card_ids([cards]), total_clusters)[0])
 
 
 if __name__ == "__main__":
@@ -531,11 +783,21 @@ if __name__ == "__main__":
         dest="stage",
         help="Select the stage of the game that you would like to abstract (flop, turn, river).",
     )
+    parser.add_argument(
+        "--refit",
+        action="store_true",
+        dest="refit",
+        default=False,
+        help="Refit the latest flop and turn classifiers on exact equity distributions, see refit_kmeans_classifier.",
+    )
     # Hyperparamtesrs
     args = parser.parse_args()
 
-    generate = args.generate  # Generate histogram distributions to cluster on
-    clustering = True  # Cluster these histogram distributions
+    generate = args.generate and not args.refit  # Generate histogram distributions to cluster on
+    clustering = not args.refit  # Cluster these histogram distributions
+    if args.refit:
+        for stage in ["flop", "turn"]:
+            refit_kmeans_classifier(stage)
 
     stage = args.stage
     n_samples = int(args.n_samples)
@@ -550,10 +812,12 @@ if __name__ == "__main__":
             filename = sorted(get_filenames(f"../kmeans_data/distributions/{stage}"))[-1]
             equity_distributions = np.load(f"../kmeans_data/distributions/{stage}/{filename}")
             if not os.path.exists(f"../kmeans_data/centroids/{stage}/centroids_{filename}"):
+                # Mini-batches past a few hundred thousand distributions
+                batch_size = 4096 if len(equity_distributions) > 200_000 else None
                 if stage == "flop":
-                    kmeans = KMeans(NUM_FLOP_CLUSTERS)
+                    kmeans = EMDKMeans(NUM_FLOP_CLUSTERS, batch_size=batch_size, n_jobs=-1)
                 elif stage == "turn":
-                    kmeans = KMeans(NUM_TURN_CLUSTERS)
+                    kmeans = EMDKMeans(NUM_TURN_CLUSTERS, batch_size=batch_size, n_jobs=-1)
 
                 kmeans.fit(equity_distributions)  # Perform Clustering
                 centroids = kmeans.cluster_centers_
@@ -2,10 +2,10 @@ import random
 import pyttsx3
 import numpy as np
 from player import Player
-from abstraction import calculate_equity
+import equity as equity_engine
 from preflop_holdem import PreflopHoldemHistory, PreflopHoldemInfoSet
 from postflop_holdem import PostflopHoldemHistory, PostflopHoldemInfoSet
-import joblib
+from strategy_export import load_strategy
 import copy
 
 
@@ -157,7 +157,8 @@ class EquityAIPlayer(AIPlayer):
         isDealer,
         checkAllowed,
     ):
-        equity = calculate_equity(card_str, community_cards)
+        # Ties count as wins, as they did with `abstraction.calculate_equity`
+        equity = equity_engine.equity(card_str, community_cards, tie_value=1.0)
         # fold, check / call, raise
         np_strategy = np.abs(np.array([1.0 - (equity + equity / 2.0), equity, equity / 2.0]))
         np_strategy = np_strategy / np.sum(np_strategy)  # normalize
@@ -206,11 +207,20 @@ class EquityAIPlayer(AIPlayer):
 
 
 class CFRAIPlayer(AIPlayer):
-    def __init__(self, balance) -> None:
+    def __init__(
+        self,
+        balance,
+        preflop_strategy="../src/preflop_infoSets_batch_19.joblib",
+        postflop_strategy="../src/postflop_infoSets_batch_19.joblib",
+    ) -> None:
+        """
+        preflop_strategy, postflop_strategy: files of `CFR.export_infoSets`, or compact `.npz` files of
+                `strategy_export.export_average_strategy`
+        """
         super().__init__(balance)
 
-        self.preflop_infosets = joblib.load("../src/preflop_infoSets_batch_19.joblib")
-        self.postflop_infosets = joblib.load("../src/postflop_infoSets_batch_19.joblib")
+        self.preflop_infosets = load_strategy(preflop_strategy)
+        self.postflop_infosets = load_strategy(postflop_strategy)
 
     def place_bet(self, observed_env):
         card_str = [str(card) for card in self.hand]
@@ -26,8 +26,9 @@ Strategy is stored at the infoset level.
 # TODO: use NumPy lookup instead of dictionary lookup for drastic speed improvement https://stackoverflow.com/questions/36652533/looking-up-large-sets-of-keys-dictionary-vs-numpy-array
 
 
-from typing import NewType, Dict, List
+from typing import NewType, Dict, List, Set
 from tqdm import tqdm
+import random
 import time
 import joblib
 import numpy as np
@@ -76,13 +77,33 @@ class History:
 
     def __add__(self, action: Action):
         """
-        This should always be something like:
+        Returns a new history with `action` appended. The attributes of this history are copied over (shallow copy),
+        then `advance` updates the derived state (acting player, pot size, infoset key prefix, ...) in O(1), instead
+        of recomputing it from the whole list of actions.
 
-                new_history = HoldemHistory(self.history + [action])
-                return new_history
+        Because the copy is shallow, the derived state must be immutable (ints, tuples) or shared by the whole deal.
+        """
+        new_history = object.__new__(type(self))
+        new_history.__dict__.update(self.__dict__)
+        new_history.history = self.history + [action]
+        new_history.advance(action)
+        return new_history
 
+    def advance(self, action: Action):
         """
-        raise NotImplementedError()
+        Updates the derived state, once `action` has been appended to `self.history`. Nothing to update by default.
+        """
+        pass
+
+    def replay(self, history: List[Action]):
+        """
+        Sets `self.history` to `history`, going through `advance` for every action so that the derived state matches.
+        Used by the constructors of the games, since histories can also be built from a list (ex: in `aiplayer.py`).
+        """
+        self.history = []
+        for action in history:
+            self.history.append(action)
+            self.advance(action)
 
     def get_infoSet_key(self) -> List[Action]:
         assert not self.is_chance()  # chance history should not be infosets
@@ -90,6 +111,16 @@ class History:
 
         raise NotImplementedError()
 
+    def get_infoSet_id(self):
+        """
+        Id used by `CFR.get_infoSet` to find the infoset of this history, without building and hashing its string key
+        (the string key is only built the first time an infoset is seen, for exports and debugging).
+
+        Either a non-negative integer, for games that can compute a dense id by arithmetic (ex: a compiled betting
+        tree), or a tuple. The default is the tuple of `get_infoSet_key`.
+        """
+        return tuple(self.get_infoSet_key())
+
     def __repr__(self) -> str:
         return str(self.history)
 
@@ -100,6 +131,9 @@ class InfoSet:
 
     """
 
+    # Default for the infosets pickled before `last_update` existed, which `DiscountedCFR` reads
+    last_update = 0
+
     def __init__(self, infoSet_key: List[Action], actions: List[Action], player: Player):
         self.infoSet = infoSet_key
         self.__actions = actions
@@ -108,6 +142,7 @@ class InfoSet:
         self.regret = {a: 0 for a in self.actions()}
         self.strategy = {a: 0 for a in self.actions()}
         self.cumulative_strategy = {a: 0 for a in self.actions()}
+        self.last_update = 0  # Iteration up to which the regrets are discounted, see `DiscountedCFR`
         self.get_strategy()
         assert 1.0 - sum(self.strategy.values()) < 1e-6
 
@@ -153,6 +188,480 @@ class InfoSet:
         else:
             return {a: 1 / len(self.actions()) for a in self.actions()}
 
+    # The methods below are what the CFR traversals use. Values are passed as lists ordered like `actions()`,
+    # so the same traversal code runs on both this dict backend and the `ArrayInfoSet` backend.
+    def strategy_vector(self) -> List[float]:
+        return [self.strategy[a] for a in self.actions()]
+
+    def regret_vector(self) -> List[float]:
+        return [self.regret[a] for a in self.actions()]
+
+    def add_regret(self, regret: List[float]):
+        for a, r in zip(self.actions(), regret):
+            self.regret[a] += r
+
+    def add_cumulative_strategy(self, weight: float):
+        # Must be called before `get_strategy()`, since it uses the strategy that was just played
+        for a in self.actions():
+            self.cumulative_strategy[a] += weight * self.strategy[a]
+
+    def scale_regret(self, positive: float, negative: float):
+        """Multiplies the positive regrets by `positive` and the negative regrets by `negative`."""
+        for a, r in self.regret.items():
+            self.regret[a] = r * (positive if r > 0 else negative)
+
+
+class ArrayInfoSet:
+    """
+    A lightweight view of a single infoset inside an `ArrayInfoSetStore`. It exposes the same API as `InfoSet`,
+    but the regrets and strategies live in the contiguous arrays of the store, at
+    `[start:end]`, where `start` is the action offset of the infoset.
+
+    These views are cheap to create, so the store does not keep them around. Do not hold on to the slices of
+    the store arrays, since they are reallocated when the store grows.
+    """
+
+    __slots__ = ("_store", "_id", "_start", "_end")
+
+    def __init__(self, store, infoSet_id: int):
+        self._store = store
+        self._id = infoSet_id
+        self._start = int(store.offsets[infoSet_id])
+        self._end = int(store.offsets[infoSet_id + 1])
+
+    @property
+    def infoSet(self) -> str:
+        return self._store.infoSet_keys[self._id]
+
+    def __repr__(self) -> str:
+        return str(self.infoSet)
+
+    def actions(self) -> List[Action]:
+        return self._store.action_sets[self._id]
+
+    def player(self) -> Player:
+        return int(self._store.players[self._id])
+
+    # Read-only dict views, so that the debugging / exporting code written for `InfoSet` keeps working
+    @property
+    def regret(self) -> Dict[Action, float]:
+        return dict(zip(self.actions(), self.regret_vector()))
+
+    @property
+    def strategy(self) -> Dict[Action, float]:
+        return dict(zip(self.actions(), self.strategy_vector()))
+
+    @property
+    def cumulative_strategy(self) -> Dict[Action, float]:
+        return dict(zip(self.actions(), self._store.cumulative_strategy[self._start : self._end].tolist()))
+
+    def to_dict(self):
+        return {
+            "infoset": self.infoSet,
+            "regret": self.regret,
+            "cumulative_strategy": self.cumulative_strategy,
+        }
+
+    def strategy_vector(self) -> List[float]:
+        # .tolist() is deliberate, arithmetic on Python floats is much faster than on NumPy scalars
+        return self._store.strategy[self._start : self._end].tolist()
+
+    def regret_vector(self) -> List[float]:
+        return self._store.regret[self._start : self._end].tolist()
+
+    def add_regret(self, regret: List[float]):
+        self._store.regret[self._start : self._end] += regret
+
+    def add_cumulative_strategy(self, weight: float):
+        store = self._store
+        store.cumulative_strategy[self._start : self._end] += weight * store.strategy[self._start : self._end]
+
+    def scale_regret(self, positive: float, negative: float):
+        regret = self._store.regret[self._start : self._end]
+        regret *= np.where(regret > 0, positive, negative)
+
+    @property
+    def last_update(self) -> int:
+        return int(self._store.last_update[self._id])
+
+    @last_update.setter
+    def last_update(self, t: int):
+        self._store.last_update[self._id] = t
+
+    def get_strategy(self):
+        """
+        Updates the current strategy based on the current regret, using regret matching
+        """
+        regret = [max(r, 0) for r in self.regret_vector()]
+        regret_sum = sum(regret)
+
+        if regret_sum > 0:
+            self._store.strategy[self._start : self._end] = [r / regret_sum for r in regret]
+        else:
+            self._store.strategy[self._start : self._end] = 1 / (self._end - self._start)
+
+    def get_average_strategy(self):
+        cumulative_strategy = self._store.cumulative_strategy[self._start : self._end].tolist()
+        strategy_sum = sum(cumulative_strategy)
+
+        if strategy_sum > 0:
+            return {a: s / strategy_sum for a, s in zip(self.actions(), cumulative_strategy)}
+        else:
+            return {a: 1 / len(self.actions()) for a in self.actions()}
+
+
+class ArrayInfoSetStore:
+    """
+    Stores the infosets in contiguous NumPy arrays instead of a `Dict[str, InfoSet]`.
+
+    Every infoset gets an integer id (in order of creation) and an action offset. The regrets, current strategy and
+    cumulative strategy of infoset `id` are at `[offsets[id]:offsets[id + 1]]` of the corresponding arrays.
+    This costs a few bytes per action, instead of the hundreds of bytes of the three dicts of an `InfoSet`.
+
+    The store behaves like a read-only dict of infoset key -> `ArrayInfoSet`, so that code written against
+    `CFR.infoSets` (exporting, `aiplayer.CFRAIPlayer`, the tracker) works with both backends.
+    """
+
+    def __init__(self, dtype=np.float64, capacity: int = 1024):
+        self.dtype = np.dtype(dtype)
+        self.ids: Dict[str, int] = {}
+        self.infoSet_keys: List[str] = []
+        self.action_sets: List[List[Action]] = []
+        self._interned_actions: Dict[tuple, List[Action]] = {}  # infosets with the same actions share one list
+
+        self.n_infoSets = 0
+        self.n_actions = 0
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.players = np.zeros(capacity, dtype=np.int8)
+        self.last_update = np.zeros(capacity, dtype=np.int32)
+        self.dirty = np.zeros(capacity, dtype=bool)  # Infosets visited since the last checkpoint, see `checkpoint.py`
+        # Index of the ids of `History.get_infoSet_id`: a table for integer ids (-1 if not seen yet), a dict for tuples
+        self.id_rows = np.full(0, -1, dtype=np.int32)
+        self.tuple_rows: Dict[tuple, int] = {}
+        self.regret = np.zeros(4 * capacity, dtype=self.dtype)
+        self.strategy = np.zeros(4 * capacity, dtype=self.dtype)
+        self.cumulative_strategy = np.zeros(4 * capacity, dtype=self.dtype)
+
+    def _grow(self, n_actions: int):
+        if self.n_infoSets >= len(self.players):
+            extra = max(len(self.players), 1024)
+            self.offsets = np.concatenate((self.offsets, np.zeros(extra, dtype=np.int64)))
+            self.players = np.concatenate((self.players, np.zeros(extra, dtype=np.int8)))
+            self.last_update = np.concatenate((self.last_update, np.zeros(extra, dtype=np.int32)))
+            self.dirty = np.concatenate((self.dirty, np.zeros(extra, dtype=bool)))
+
+        if self.n_actions + n_actions > len(self.regret):
+            extra = max(len(self.regret), n_actions)
+            self.regret = np.concatenate((self.regret, np.zeros(extra, dtype=self.dtype)))
+            self.strategy = np.concatenate((self.strategy, np.zeros(extra, dtype=self.dtype)))
+            self.cumulative_strategy = np.concatenate(
+                (self.cumulative_strategy, np.zeros(extra, dtype=self.dtype))
+            )
+
+    def get_infoSet(self, infoSet_key: str, actions: List[Action], player: Player) -> ArrayInfoSet:
+        infoSet_id = self.ids.get(infoSet_key)
+        if infoSet_id is None:
+            infoSet_id = self.add_infoSet(infoSet_key, actions, player)
+        self.dirty[infoSet_id] = True
+        return ArrayInfoSet(self, infoSet_id)
+
+    def find(self, infoSet_id) -> int:
+        """Row of the id of `History.get_infoSet_id`, or -1 if it has not been indexed yet."""
+        if isinstance(infoSet_id, tuple):
+            return self.tuple_rows.get(infoSet_id, -1)
+        if infoSet_id < len(self.id_rows):
+            return int(self.id_rows[infoSet_id])
+        return -1
+
+    def find_rows(self, infoSet_ids: np.ndarray) -> np.ndarray:
+        """Vectorized `find`, for an array of integer ids."""
+        rows = np.full(len(infoSet_ids), -1, dtype=np.int64)
+        indexed = infoSet_ids < len(self.id_rows)
+        rows[indexed] = self.id_rows[infoSet_ids[indexed]]
+        return rows
+
+    def index(self, infoSet_id, row: int):
+        if isinstance(infoSet_id, tuple):
+            self.tuple_rows[infoSet_id] = row
+            return
+        if infoSet_id >= len(self.id_rows):
+            id_rows = np.full(max(2 * len(self.id_rows), infoSet_id + 1, 1024), -1, dtype=np.int32)
+            id_rows[: len(self.id_rows)] = self.id_rows
+            self.id_rows = id_rows
+        self.id_rows[infoSet_id] = row
+
+    def get_indexed_infoSet(self, infoSet_id, history: History) -> ArrayInfoSet:
+        """Same as `get_infoSet`, but finds the infoset by `History.get_infoSet_id`."""
+        row = self.find(infoSet_id)
+        if row < 0:
+            infoSet_key = "".join(history.get_infoSet_key())
+            row = self.ids.get(infoSet_key)
+            if row is None:
+                row = self.add_infoSet(infoSet_key, history.actions(), history.player())
+            self.index(infoSet_id, row)
+        self.dirty[row] = True
+        return ArrayInfoSet(self, row)
+
+    def add_infoSet(self, infoSet_key: str, actions: List[Action], player: Player) -> int:
+        assert infoSet_key not in self.ids
+        n = len(actions)
+        self._grow(n)
+
+        infoSet_id = self.n_infoSets
+        start = self.n_actions
+        self.offsets[infoSet_id + 1] = start + n
+        self.players[infoSet_id] = player
+        self.dirty[infoSet_id] = True
+        self.strategy[start : start + n] = 1 / n
+        self._add_key(infoSet_key, infoSet_id, actions)
+
+        self.n_infoSets += 1
+        self.n_actions += n
+        return infoSet_id
+
+    def _add_key(self, infoSet_key: str, infoSet_id: int, actions: List[Action]):
+        """Indexes the key and actions of a new infoset, see `memmap_store.py` for an index on disk."""
+        actions = self._interned_actions.setdefault(tuple(actions), list(actions))
+        self.ids[infoSet_key] = infoSet_id
+        self.infoSet_keys.append(infoSet_key)
+        self.action_sets.append(actions)
+
+    def empty(self) -> "ArrayInfoSetStore":
+        """A new empty store with the same settings, ex: to load a checkpoint into."""
+        return ArrayInfoSetStore(dtype=self.dtype)
+
+    def flush(self):
+        """Nothing to do for arrays in memory, see `memmap_store.MemmapInfoSetStore.flush`."""
+
+    def close(self):
+        """Nothing to release for arrays in memory, see `memmap_store.MemmapInfoSetStore.close`."""
+
+    def nbytes(self) -> int:
+        """Size of the arrays in use, without the key index."""
+        n, m = self.n_infoSets, self.n_actions
+        return (
+            self.offsets[: n + 1].nbytes
+            + self.players[:n].nbytes
+            + self.last_update[:n].nbytes
+            + self.regret[:m].nbytes
+            + self.strategy[:m].nbytes
+            + self.cumulative_strategy[:m].nbytes
+        )
+
+    def to_infoSets(self, create_infoSet) -> Dict[str, InfoSet]:
+        """Converts the store back to the dict backend, ex: to check results for parity."""
+        infoSets = {}
+        for key, infoSet_id in self.ids.items():
+            infoSet = ArrayInfoSet(self, infoSet_id)
+            dict_infoSet = create_infoSet(key, infoSet.actions(), infoSet.player())
+            dict_infoSet.regret = infoSet.regret
+            dict_infoSet.strategy = infoSet.strategy
+            dict_infoSet.cumulative_strategy = infoSet.cumulative_strategy
+            dict_infoSet.last_update = infoSet.last_update
+            infoSets[key] = dict_infoSet
+        return infoSets
+
+    # ----- Read-only dict interface -----
+    def __getitem__(self, infoSet_key: str) -> ArrayInfoSet:
+        return ArrayInfoSet(self, self.ids[infoSet_key])
+
+    def __contains__(self, infoSet_key) -> bool:
+        return infoSet_key in self.ids
+
+    def __len__(self) -> int:
+        return self.n_infoSets
+
+    def __iter__(self):
+        return iter(self.infoSet_keys)
+
+    def keys(self):
+        return list(self.infoSet_keys)
+
+    def values(self):
+        return [ArrayInfoSet(self, i) for i in range(self.n_infoSets)]
+
+    def items(self):
+        return [(key, ArrayInfoSet(self, i)) for i, key in enumerate(self.infoSet_keys)]
+
+    def __getstate__(self):
+        # Trim the unused capacity so exported files stay small
+        state = self.__dict__.copy()
+        n, m = self.n_infoSets, self.n_actions
+        state["offsets"] = self.offsets[: n + 1].copy()
+        state["players"] = self.players[:n].copy()
+        state["last_update"] = self.last_update[:n].copy()
+        state["dirty"] = self.dirty[:n].copy()
+        # The id index is rebuilt as the infosets are visited
+        state["id_rows"] = np.full(0, -1, dtype=np.int32)
+        state["tuple_rows"] = {}
+        for name in ["regret", "strategy", "cumulative_strategy"]:
+            state[name] = getattr(self, name)[:m].copy()
+        return state
+
+
+
+class RegretPolicy:
+    """
+    How regrets and the average strategy are updated. The traversals of `CFR` call `update_regret` and
+    `update_cumulative_strategy` instead of updating the infoset directly, so the update rule can be swapped.
+
+    This base class is the vanilla CFR rule: un-discounted regrets and a uniformly weighted average strategy.
+
+    `t` is the iteration number, starting at 1.
+
+    Discounting is applied lazily. Discounts that do not depend on the sign of the regret are a global scale factor,
+    so instead of multiplying every stored value by d_t at the end of iteration t (an O(#infosets) pass), we weight
+    the values added at iteration t by 1 / (d_1 * ... * d_{t-1}). This only changes the stored values by a constant
+    factor, which cancels out in regret matching and when normalizing the average strategy.
+    """
+
+    def regret_weight(self, t: int) -> float:
+        return 1.0
+
+    def strategy_weight(self, t: int) -> float:
+        return 1.0
+
+    def update_regret(self, infoSet: InfoSet, regret: List[float], t: int):
+        weight = self.regret_weight(t)
+        infoSet.add_regret(regret if weight == 1.0 else [weight * r for r in regret])
+
+    def update_cumulative_strategy(self, infoSet: InfoSet, weight: float, t: int):
+        infoSet.add_cumulative_strategy(self.strategy_weight(t) * weight)
+
+    def update_regret_table(self, regret: np.ndarray, delta: np.ndarray, t: int):
+        """
+        Vectorized `update_regret`, for solvers that store the regrets of many infosets as the rows of
+        one array and update all of them at every iteration. `regret` is updated in place.
+        """
+        regret += self.regret_weight(t) * delta
+
+    def update_regret_rows(self, store: ArrayInfoSetStore, rows: np.ndarray, index: np.ndarray, delta: np.ndarray, t: int):
+        """
+        Vectorized `update_regret`, for the infosets `rows` of an `ArrayInfoSetStore` (see `batched_cfr.py`).
+        `index[k]` are the positions of the actions of `rows[k]` in the arrays of the store, `delta[k]` their regrets.
+        """
+        store.regret[index] += self.regret_weight(t) * delta
+
+
+class CFRPlus(RegretPolicy):
+    """
+    CFR+ (Tammelin 2014): regrets are floored at zero after every update (regret matching+),
+    and the average strategy is weighted linearly by t.
+    """
+
+    def strategy_weight(self, t: int) -> float:
+        return t
+
+    def update_regret(self, infoSet: InfoSet, regret: List[float], t: int):
+        infoSet.add_regret(regret)
+        infoSet.scale_regret(1.0, 0.0)
+
+    def update_regret_table(self, regret: np.ndarray, delta: np.ndarray, t: int):
+        regret += delta
+        np.maximum(regret, 0.0, out=regret)
+
+    def update_regret_rows(self, store: ArrayInfoSetStore, rows: np.ndarray, index: np.ndarray, delta: np.ndarray, t: int):
+        store.regret[index] = np.maximum(store.regret[index] + delta, 0.0)
+
+
+class LinearCFR(RegretPolicy):
+    """
+    Linear CFR (Brown & Sandholm 2019): iteration t is weighted by t, for both the regrets and the average strategy.
+    This is the same as discounting everything by t / (t + 1) at the end of every iteration.
+    """
+
+    def regret_weight(self, t: int) -> float:
+        return t
+
+    def strategy_weight(self, t: int) -> float:
+        return t
+
+
+class DiscountedCFR(RegretPolicy):
+    """
+    Discounted CFR (Brown & Sandholm 2019). At the end of iteration t, positive regrets are multiplied by
+    t^alpha / (t^alpha + 1), negative regrets by t^beta / (t^beta + 1), and the average strategy by (t / (t + 1))^gamma.
+
+    The average strategy discount is a global scale factor, so we weight iteration t by t^gamma instead.
+
+    The regret discount depends on the sign, so it is applied per infoset. Between two visits, the regrets of an infoset
+    do not change, hence neither does their sign. So when an infoset is visited, we catch up on all the discounts it
+    missed since its last update, using prefix sums of the log-discounts. An infoset that is never visited is never
+    touched.
+    """
+
+    def __init__(self, alpha: float = 1.5, beta: float = 0.0, gamma: float = 2.0):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        # _log_discounts[k] = sum of log(discount) over iterations 1..k
+        self._log_positive_discounts = [0.0]
+        self._log_negative_discounts = [0.0]
+        self._log_discount_arrays = None  # NumPy copies of the two lists, for `update_regret_rows`
+
+    def _extend_log_discounts(self, t: int):
+        if t >= len(self._log_positive_discounts):
+            self._log_discount_arrays = None
+        for k in range(len(self._log_positive_discounts), t + 1):
+            self._log_positive_discounts.append(
+                self._log_positive_discounts[-1] + np.log(k**self.alpha / (k**self.alpha + 1))
+            )
+            self._log_negative_discounts.append(
+                self._log_negative_discounts[-1] + np.log(k**self.beta / (k**self.beta + 1))
+            )
+
+    def discount_regret(self, infoSet: InfoSet, t: int):
+        """Applies the discounts of iterations last_update, ..., t - 1."""
+        s = infoSet.last_update
+        if 0 < s < t:
+            self._extend_log_discounts(t - 1)
+            positive = np.exp(self._log_positive_discounts[t - 1] - self._log_positive_discounts[s - 1])
+            negative = np.exp(self._log_negative_discounts[t - 1] - self._log_negative_discounts[s - 1])
+            infoSet.scale_regret(positive, negative)
+        infoSet.last_update = t
+
+    def strategy_weight(self, t: int) -> float:
+        return t**self.gamma
+
+    def update_regret(self, infoSet: InfoSet, regret: List[float], t: int):
+        self.discount_regret(infoSet, t)
+        infoSet.add_regret(regret)
+
+    def update_regret_table(self, regret: np.ndarray, delta: np.ndarray, t: int):
+        # Every row is updated at every iteration, so there is nothing to catch up on: discount eagerly.
+        if t > 1:
+            positive = (t - 1) ** self.alpha / ((t - 1) ** self.alpha + 1)
+            negative = (t - 1) ** self.beta / ((t - 1) ** self.beta + 1)
+            regret *= np.where(regret > 0, positive, negative)
+        regret += delta
+
+    def update_regret_rows(self, store: ArrayInfoSetStore, rows: np.ndarray, index: np.ndarray, delta: np.ndarray, t: int):
+        # Same catch-up as `discount_regret`, for all the rows at once
+        last_update = store.last_update[rows]
+        regret = store.regret[index]
+        if t > 1 and np.any((last_update > 0) & (last_update < t)):
+            self._extend_log_discounts(t - 1)
+            if self._log_discount_arrays is None:
+                self._log_discount_arrays = (
+                    np.array(self._log_positive_discounts),
+                    np.array(self._log_negative_discounts),
+                )
+            log_positive, log_negative = self._log_discount_arrays
+            start = np.clip(last_update, 1, t) - 1
+            positive = np.where(last_update > 0, np.exp(log_positive[t - 1] - log_positive[start]), 1.0)
+            negative = np.where(last_update > 0, np.exp(log_negative[t - 1] - log_negative[start]), 1.0)
+            regret *= np.where(regret > 0, positive[:, None], negative[:, None])
+        store.regret[index] = regret + delta
+        store.last_update[rows] = t
+
+
+REGRET_POLICIES = {
+    "vanilla": RegretPolicy,
+    "cfr+": CFRPlus,
+    "linear": LinearCFR,
+    "dcfr": DiscountedCFR,
+}
+
 
 class CFR:
     def __init__(
@@ -161,17 +670,96 @@ class CFR:
         create_history,
         n_players: int = 2,
         iterations: int = 1000000,
+        backend: str = "dict",
+        dtype=np.float64,
+        epsilon: float = 0.6,
+        policy="vanilla",
+        prune_threshold: float = None,
+        prune_warmup: int = 200,
+        full_traversal_interval: int = 20,
+        track_exploitability: bool = False,
+        spill_directory: str = None,
+        resident_limit_mb: float = None,
     ):
+        """
+        backend: how the infosets are stored.
+                - "dict": `Dict[str, InfoSet]`, with infosets created by `create_infoSet`
+                - "array": `ArrayInfoSetStore`, contiguous NumPy arrays of `dtype` (float64 or float32). Much
+                  smaller in memory, use this for the hold'em abstractions. `create_infoSet` is not used.
+        epsilon: exploration probability of outcome-sampling MCCFR, see `outcome_sampling_cfr`.
+        policy: how regrets and the average strategy are updated. Either a `RegretPolicy`, or one of
+                "vanilla", "cfr+", "linear", "dcfr" (`DiscountedCFR` with the default alpha/beta/gamma)
+        prune_threshold: regret-based pruning. When set, the traversing player does not explore the actions it never
+                plays whose regret is below this threshold (in the units of the stored regrets, so it depends on the
+                policy). Like `research/leduc/monte.py`, this is turned off for the first `prune_warmup` iterations,
+                and every `full_traversal_interval` iterations we do a full traversal, so that the regrets of pruned
+                actions can still become positive again. Only for "vanilla", "vanilla_speedup" and "external".
+                When pruning is on, the full-width traversals also skip the histories that neither player can reach.
+                This is exact, so it ignores the warmup and the full traversals.
+        spill_directory: with the "array" backend, keep the arrays and the key index of the infosets in files of
+                this directory, so that the store can be larger than RAM. With `resident_limit_mb`, the infosets that
+                were not used recently are released from memory at every `track`. See `memmap_store.py`.
+        track_exploitability: compute the exploitability of the average strategy every `tracker_interval`
+                iterations, into `tracker.exploitability`. See `exploitability`.
+        """
+        assert backend in ["dict", "array"]
         self.n_players = n_players
         self.iterations = iterations
         self.tracker_interval = int(iterations / 10)
-        self.infoSets: Dict[str, InfoSet] = {}
+        self.backend = backend
+        if backend == "array" and spill_directory is not None:
+            from memmap_store import MemmapInfoSetStore
+
+            self.infoSets = MemmapInfoSetStore(spill_directory, dtype=dtype, resident_limit_mb=resident_limit_mb)
+        elif backend == "array":
+            self.infoSets = ArrayInfoSetStore(dtype=dtype)
+        else:
+            self.infoSets: Dict[str, InfoSet] = {}
+            self.infoSet_index = {}  # `History.get_infoSet_id` -> infoset of `infoSets`
         self.create_infoSet = create_infoSet
         self.create_history = create_history
-
+        self.epsilon = epsilon
+        self.policy = REGRET_POLICIES[policy]() if isinstance(policy, str) else policy
+        self.iteration = 0  # Number of iterations done, across all calls to `solve`
+
+        self.prune_threshold = prune_threshold
+        self.prune_warmup = prune_warmup
+        self.full_traversal_interval = full_traversal_interval
+        self.prune = False  # Whether regret-based pruning is on for the current iteration
+        # Decision nodes traversed, and subtrees skipped (by regret-based pruning, or because no player can reach them)
+        self.nodes_visited = 0
+        self.nodes_pruned = 0
+
+        self.track_exploitability = track_exploitability
         self.tracker = InfoSetTracker()
+        self.telemetry = None  # see `solve`
+        self.profiler = None  # see `solve`, the workers of `parallel_cfr.py` send their timers back to it
+
+    def pruned_actions(self, infoSet: InfoSet, strategy: List[float]) -> Set[int]:
+        """
+        Indices of the actions skipped by regret-based pruning: never played, and with a regret below the threshold.
+        A set, since the traversals test every action against it.
+        """
+        if not self.prune:
+            return set()
+        regret = infoSet.regret_vector()
+        return {idx for idx, (s, r) in enumerate(zip(strategy, regret)) if s == 0 and r < self.prune_threshold}
+
+    def pruned_fraction(self) -> float:
+        """Fraction of the nodes that were skipped instead of traversed, see `nodes_pruned`."""
+        total = self.nodes_visited + self.nodes_pruned
+        return self.nodes_pruned / total if total > 0 else 0.0
 
     def get_infoSet(self, history: History) -> InfoSet:
+        infoSet_id = history.get_infoSet_id()
+        if self.backend == "array":
+            return self.infoSets.get_indexed_infoSet(infoSet_id, history)
+
+        infoSet = self.infoSet_index.get(infoSet_id)
+        if infoSet is not None:
+            return infoSet
+
+        # First visit of this id, the string key is only used for exports and debugging
         infoSet_key = history.get_infoSet_key()
         actions = history.actions()
         player = history.player()
@@ -183,7 +771,9 @@ class CFR:
         if infoSet_key_str not in self.infoSets:
             self.infoSets[infoSet_key_str] = self.create_infoSet(infoSet_key, actions, player)
 
-        return self.infoSets[infoSet_key_str]
+        infoSet = self.infoSets[infoSet_key_str]
+        self.infoSet_index[infoSet_id] = infoSet
+        return infoSet
 
     def vanilla_cfr(
         self, history: History, i: Player, t: int, pi_0: float, pi_1: float, debug=False
@@ -203,30 +793,42 @@ class CFR:
             return self.vanilla_cfr(
                 history + a, i, t, pi_0, pi_1, debug=debug
             )  # Since it is a chance outcome, the player does not change .. TODO: Check logic for this
+        elif self.prune_threshold is not None and pi_0 == 0 and pi_1 == 0:
+            # All the updates below this history would be multiplied by 0
+            self.nodes_pruned += 1
+            return 0
 
+        self.nodes_visited += 1
         infoSet = self.get_infoSet(history)
         assert infoSet.player() == history.player()
 
+        strategy = infoSet.strategy_vector()
+        pruned = self.pruned_actions(infoSet, strategy) if history.player() == i else set()
         v = 0
-        va = {}
-
-        for a in infoSet.actions():
-            if history.player() == 0:
-                va[a] = self.vanilla_cfr(
-                    history + a, i, t, infoSet.strategy[a] * pi_0, pi_1, debug=debug
+        va = [0] * len(strategy)
+
+        for idx, a in enumerate(infoSet.actions()):
+            if idx in pruned:
+                self.nodes_pruned += 1
+                continue
+            elif history.player() == 0:
+                va[idx] = self.vanilla_cfr(
+                    history + a, i, t, strategy[idx] * pi_0, pi_1, debug=debug
                 )
             else:
-                va[a] = self.vanilla_cfr(
-                    history + a, i, t, pi_0, infoSet.strategy[a] * pi_1, debug=debug
+                va[idx] = self.vanilla_cfr(
+                    history + a, i, t, pi_0, strategy[idx] * pi_1, debug=debug
                 )
 
-            v += infoSet.strategy[a] * va[a]
+            v += strategy[idx] * va[idx]
+
+        for idx in pruned:  # A pruned action is never played, so it does not change v. Leave its regret as is.
+            va[idx] = v
 
         if history.player() == i:
-            for a in infoSet.actions():
-                infoSet.regret[a] += (pi_1 if i == 0 else pi_0) * (va[a] - v)
-                # Update cumulative strategy values, this will be used to calculate the average strategy at the end
-                infoSet.cumulative_strategy[a] += (pi_0 if i == 0 else pi_1) * infoSet.strategy[a]
+            self.policy.update_regret(infoSet, [(pi_1 if i == 0 else pi_0) * (va_a - v) for va_a in va], t)
+            # Update cumulative strategy values, this will be used to calculate the average strategy at the end
+            self.policy.update_cumulative_strategy(infoSet, pi_0 if i == 0 else pi_1, t)
 
             # Update regret matching values
             infoSet.get_strategy()
@@ -239,57 +841,59 @@ class CFR:
 
     def vanilla_cfr_speedup(self, history: History, t: int, pi_0: float, pi_1: float, debug=False):
         """
-        We double the speed by updating both player values simultaneously, since this is a zero-sum game.
-
-        The trick here to speedup is by assuming by whatever the opponent gains is
-        the opposite of what we gain. Zero-sum game. However, need to make sure we always return the correct utility.
-
-        NOTE: For some reason, doesn't work super well, the strategies are not converging as well as they should.
+        We double the speed by updating both players in a single traversal, instead of one traversal per player.
 
+        Returns the utility vector [u_0, u_1] of the history, so each node can compute the counterfactual values
+        of the player acting at that node. The regrets of the acting player are weighted by the reach probability
+        of the opponent, and the cumulative strategy by their own reach probability, exactly like `vanilla_cfr`.
+        The only difference with `vanilla_cfr` is that both players are updated using the strategies of the
+        previous iteration (simultaneous updates) instead of alternating updates.
         """
-        raise NotImplementedError()  # bad implementation, does not provide Nash equilibrium solution
         # Return payoff for terminal states
-        # ['3d7c', '4cQd', '/', '7sKd9c', 'bMIN', 'f']
         if history.is_terminal():
             if debug:
                 print(
-                    f"utility returned: {history.terminal_utility((len(history.get_last_game_stage())) % 2)}, history: {history.history}"
+                    f"history: {history.history} utilities: {[history.terminal_utility(0), history.terminal_utility(1)]}"
                 )
-            return history.terminal_utility(
-                (len(history.get_last_game_stage()) + 1) % 2
-            )  # overfit solution for holdem
+            return [history.terminal_utility(0), history.terminal_utility(1)]
         elif history.is_chance():
-            a = (
-                history.sample_chance_outcome()
-            )  # $\sigma_c$ is simply the $f_c$ function I believe...
-            return self.vanilla_cfr_speedup(
-                history + a, t, pi_0, pi_1, debug=debug
-            )  # Since it is a chance outcome, the player does not change .. TODO: Check logic for this
-
+            a = history.sample_chance_outcome()
+            return self.vanilla_cfr_speedup(history + a, t, pi_0, pi_1, debug=debug)
+        elif self.prune_threshold is not None and pi_0 == 0 and pi_1 == 0:
+            # All the updates below this history would be multiplied by 0
+            self.nodes_pruned += 1
+            return [0, 0]
+
+        self.nodes_visited += 1
         infoSet = self.get_infoSet(history)
-        assert infoSet.player() == history.player()
-
-        v = 0
-        va = {}
-
-        for a in infoSet.actions():
-            if history.player() == 0:
-                va[a] = -self.vanilla_cfr_speedup(
-                    history + a, t, infoSet.strategy[a] * pi_0, pi_1, debug=debug
-                )
+        player = history.player()
+        assert infoSet.player() == player
+
+        strategy = infoSet.strategy_vector()
+        pruned = self.pruned_actions(infoSet, strategy)
+        v = [0, 0]
+        va = []
+
+        for idx, a in enumerate(infoSet.actions()):
+            if idx in pruned:
+                self.nodes_pruned += 1
+                va.append(None)
+                continue
+            elif player == 0:
+                va_a = self.vanilla_cfr_speedup(history + a, t, strategy[idx] * pi_0, pi_1, debug=debug)
             else:
-                va[a] = -self.vanilla_cfr_speedup(
-                    history + a, t, pi_0, infoSet.strategy[a] * pi_1, debug=debug
-                )
+                va_a = self.vanilla_cfr_speedup(history + a, t, pi_0, strategy[idx] * pi_1, debug=debug)
 
-            v += infoSet.strategy[a] * va[a]
+            va.append(va_a)
+            v[0] += strategy[idx] * va_a[0]
+            v[1] += strategy[idx] * va_a[1]
 
-        for a in infoSet.actions():
-            infoSet.regret[a] += (pi_1 if history.player() == 0 else pi_0) * (va[a] - v)
-            # Update cumulative strategy values, this will be used to calculate the average strategy at the end
-            infoSet.cumulative_strategy[a] += (
-                pi_0 if history.player() == 0 else pi_1
-            ) * infoSet.strategy[a]
+        va = [v if va_a is None else va_a for va_a in va]  # Leave the regrets of pruned actions as is
+        self.policy.update_regret(
+            infoSet, [(pi_1 if player == 0 else pi_0) * (va_a[player] - v[player]) for va_a in va], t
+        )
+        # Update cumulative strategy values, this will be used to calculate the average strategy at the end
+        self.policy.update_cumulative_strategy(infoSet, pi_0 if player == 0 else pi_1, t)
 
         # Update regret matching values
         infoSet.get_strategy()
@@ -298,7 +902,6 @@ class CFR:
             print("infoset", infoSet.to_dict())
             print("va", va)
             print("strategy", infoSet.strategy)
-            time.sleep(0.1)
 
         return v
 
@@ -326,86 +929,365 @@ class CFR:
         infoSet = self.get_infoSet(history)
         assert infoSet.player() == history.player()
 
+        strategy = infoSet.strategy_vector()
         v = 0
-        va = {}
+        va = [0] * len(strategy)
 
-        for a in infoSet.actions():
+        for idx, a in enumerate(infoSet.actions()):
             if history.player() == 0:
-                va[a] = self.vanilla_cfr_manim(
-                    history + a, i, t, infoSet.strategy[a] * pi_0, pi_1, histories
+                va[idx] = self.vanilla_cfr_manim(
+                    history + a, i, t, strategy[idx] * pi_0, pi_1, histories
                 )
             else:
-                va[a] = self.vanilla_cfr_manim(
-                    history + a, i, t, pi_0, infoSet.strategy[a] * pi_1, histories
+                va[idx] = self.vanilla_cfr_manim(
+                    history + a, i, t, pi_0, strategy[idx] * pi_1, histories
                 )
 
-            v += infoSet.strategy[a] * va[a]
+            v += strategy[idx] * va[idx]
 
         if history.player() == i:
-            for a in infoSet.actions():
-                infoSet.regret[a] += (pi_1 if i == 0 else pi_0) * (va[a] - v)
-                # Update cumulative strategy values, this will be used to calculate the average strategy at the end
-                infoSet.cumulative_strategy[a] += (pi_0 if i == 0 else pi_1) * infoSet.strategy[a]
+            self.policy.update_regret(infoSet, [(pi_1 if i == 0 else pi_0) * (va_a - v) for va_a in va], t)
+            # Update cumulative strategy values, this will be used to calculate the average strategy at the end
+            self.policy.update_cumulative_strategy(infoSet, pi_0 if i == 0 else pi_1, t)
 
             # Update regret matching values
             infoSet.get_strategy()
 
         return v
 
-    def mccfr(
-        self, history: History, i: Player, t: int, pi_0: float, pi_1: float, debug=False
-    ):  # Works for two players
-        raise NotImplementedError()
+    def mccfr(self, history: History, i: Player, t: int, debug=False):  # Works for two players
+        """
+        External-sampling Monte Carlo CFR (Lanctot et al. 2009).
+
+        Chance outcomes and the opponent's actions are sampled (once per node), and only the actions of the traversing
+        player `i` are all explored. The cost of an iteration is therefore divided by the branching factor of the
+        opponent's nodes. Since the sampling probabilities of the opponent and chance cancel out with their reach
+        probabilities, the sampled counterfactual values are used as is, without any reach probability.
+
+        The average strategy is updated at the opponent's nodes, using the opponent's current strategy
+        ("simple averaging"), since that is where the strategy is being sampled.
+        """
+        if history.is_terminal():
+            if debug:
+                print(f"history: {history.history} utility: {history.terminal_utility(i)}, player: {i}")
+            return history.terminal_utility(i)
+        elif history.is_chance():
+            a = history.sample_chance_outcome()
+            return self.mccfr(history + a, i, t, debug=debug)
+
+        self.nodes_visited += 1
+        infoSet = self.get_infoSet(history)
+        assert infoSet.player() == history.player()
+
+        strategy = infoSet.strategy_vector()
+        actions = infoSet.actions()
+
+        if history.player() == i:
+            pruned = self.pruned_actions(infoSet, strategy)
+            self.nodes_pruned += len(pruned)
+            va = [None if idx in pruned else self.mccfr(history + a, i, t, debug=debug) for idx, a in enumerate(actions)]
+            v = sum(s * va_a for s, va_a in zip(strategy, va) if va_a is not None)
+            va = [v if va_a is None else va_a for va_a in va]  # Leave the regrets of pruned actions as is
+
+            self.policy.update_regret(infoSet, [va_a - v for va_a in va], t)
+            infoSet.get_strategy()
+
+            if debug:
+                print("infoset", infoSet.to_dict())
+                print("strategy", infoSet.strategy)
+
+            return v
+
+        else:
+            self.policy.update_cumulative_strategy(infoSet, 1, t)
+            a = random.choices(actions, weights=strategy)[0]
+            return self.mccfr(history + a, i, t, debug=debug)
+
+    def outcome_sampling_cfr(
+        self, history: History, i: Player, t: int, pi_i: float, pi_o: float, s: float, debug=False
+    ):
+        """
+        Outcome-sampling Monte Carlo CFR (Lanctot et al. 2009). A single trajectory is sampled per iteration, so the cost
+        of an iteration is O(depth) instead of O(tree). This is what we want for real-time solving, where we run
+        as many cheap iterations as possible in a fixed time budget.
+
+        The traversing player `i` samples from an epsilon-exploration strategy (`self.epsilon` uniform + the rest
+        following the current strategy), so that every action keeps getting sampled. The opponent and chance follow
+        their strategy.
+
+        pi_i, pi_o: reach probabilities of the traversing player and the opponent
+        s: probability of sampling the current history. Chance is left out of pi_o and s, since it cancels out
+
+        returns (sampled utility / probability of sampling the terminal history, tail reach probability pi(h, z))
+        """
+        if history.is_terminal():
+            if debug:
+                print(f"history: {history.history} utility: {history.terminal_utility(i)}, player: {i}")
+            return history.terminal_utility(i) / s, 1.0
+        elif history.is_chance():
+            a = history.sample_chance_outcome()
+            return self.outcome_sampling_cfr(history + a, i, t, pi_i, pi_o, s, debug=debug)
+
+        infoSet = self.get_infoSet(history)
+        assert infoSet.player() == history.player()
+
+        strategy = infoSet.strategy_vector()
+        actions = infoSet.actions()
+        n = len(actions)
+
+        if history.player() == i:
+            sampling_strategy = [self.epsilon / n + (1 - self.epsilon) * p for p in strategy]
+        else:
+            sampling_strategy = strategy
+        idx = random.choices(range(n), weights=sampling_strategy)[0]
+        p = strategy[idx]
+        q = sampling_strategy[idx]
+
+        if history.player() == i:
+            u, tail = self.outcome_sampling_cfr(
+                history + actions[idx], i, t, p * pi_i, pi_o, q * s, debug=debug
+            )
+            # Importance-weighted regrets: W * (pi(ha, z) - pi(h, z)) for the sampled action, -W * pi(h, z) for the others
+            W = u * pi_o
+            self.policy.update_regret(infoSet, [W * tail * ((b == idx) - p) for b in range(n)], t)
+            # Stochastically-weighted averaging, pi_i / s is an unbiased estimate of pi_i
+            self.policy.update_cumulative_strategy(infoSet, pi_i / s, t)
+            infoSet.get_strategy()
+
+            if debug:
+                print("infoset", infoSet.to_dict())
+                print("strategy", infoSet.strategy)
+        else:
+            u, tail = self.outcome_sampling_cfr(
+                history + actions[idx], i, t, pi_i, p * pi_o, q * s, debug=debug
+            )
+
+        return u, p * tail
+
+    def iterate(self, method: str, t: int, T: int, debug=False):
+        """
+        Runs the CFR traversals of `method` on the sampled deal `t`, at iteration `T`. See `solve` for the methods.
+        Returns the values of both players.
+        """
+        self.prune = (
+            self.prune_threshold is not None and T > self.prune_warmup and T % self.full_traversal_interval != 0
+        )
+        util_0 = 0
+        util_1 = 0
+        if method == "vanilla":  # vanilla
+            for player in range(
+                self.n_players
+            ):  # This is the slower way, we can speed by updating both players
+                if player == 0:
+                    util_0 += self.vanilla_cfr(
+                        self.create_history(t), player, T, 1, 1, debug=debug
+                    )
+                else:
+                    util_1 += self.vanilla_cfr(
+                        self.create_history(t), player, T, 1, 1, debug=debug
+                    )
+
+        elif method == "external":  # external-sampling MCCFR
+            for player in range(self.n_players):
+                if player == 0:
+                    util_0 += self.mccfr(self.create_history(t), player, T, debug=debug)
+                else:
+                    util_1 += self.mccfr(self.create_history(t), player, T, debug=debug)
+
+        elif method == "outcome":  # outcome-sampling MCCFR
+            for player in range(self.n_players):
+                u, _ = self.outcome_sampling_cfr(self.create_history(t), player, T, 1, 1, 1, debug=debug)
+                if player == 0:
+                    util_0 += u
+                else:
+                    util_1 += u
+
+        elif method == "vanilla_speedup":  # both players in a single traversal
+            u = self.vanilla_cfr_speedup(self.create_history(t), T, 1, 1, debug=debug)
+            util_0 += u[0]
+            util_1 += u[1]
+
+        else:
+            raise ValueError(f"Unknown CFR method {method}")
+
+        return util_0, util_1
+
+    def solve(
+        self,
+        method="vanilla",
+        debug=False,
+        n_workers: int = 1,
+        round_size: int = 1000,
+        checkpointer=None,
+        resume: bool = False,
+        batch_size: int = 10000,
+        telemetry=None,
+        profile=False,
+    ):
+        """
+        method:
+                - "vanilla": full-width CFR, one traversal of the sampled deal per player
+                - "vanilla_speedup": full-width CFR, both players updated in a single traversal
+                - "external": external-sampling MCCFR, see `mccfr`
+                - "outcome": outcome-sampling MCCFR, see `outcome_sampling_cfr`
+                - "batched": "vanilla_speedup" on `batch_size` deals at once, with NumPy. Only for the post-flop
+                  game with `create_compiled_history` and the "array" backend, see `batched_cfr.py`.
+                - "public_chance": public chance sampling, one board and all the hands of both players per iteration.
+                  Same requirements as "batched", see `public_chance_cfr.py`.
+        n_workers: number of processes to split the sampled deals across. Only for the "array" backend,
+                see `parallel_cfr.parallel_solve`.
+        round_size: number of sampled deals per worker between two merges, when n_workers > 1.
+        checkpointer: a `checkpoint.Checkpointer`, to save the training state periodically and at the end.
+        resume: continue from the latest checkpoint of `checkpointer`, if it is more recent than this CFR. This
+                restores the infosets, the iteration counter and the random generators, and skips the sampled deals
+                that were already trained on, so the result is the same as without interruption.
+        batch_size: number of sampled deals per traversal, when method is "batched".
+        telemetry: a `telemetry.Telemetry`, to record the training metrics every `tracker_interval` iterations
+                instead of printing the infosets.
+        profile: True (or the environment variable `CFR_PROFILE=1`) to time the hot paths of the traversals and write a
+                report at the end, or a `profiling.Profiler` with custom settings. See `profiling.py`.
+        """
+        import profiling
+
+        args = (method, debug, n_workers, round_size, checkpointer, resume, batch_size, telemetry)
+        if not profiling.profiling_requested(profile):
+            return self._solve(*args)
+
+        profiler = profile if isinstance(profile, profiling.Profiler) else profiling.Profiler()
+        profiler.attach(self)
+        self.profiler = profiler
+        try:
+            return self._solve(*args)
+        finally:
+            self.profiler = None
+            profiler.detach()
+            profiler.write_report(self)
+
+    def _solve(self, method, debug, n_workers, round_size, checkpointer, resume, batch_size, telemetry):
+        self.telemetry = telemetry
+        if telemetry is not None:
+            telemetry.start(self)
+
+        start = 0
+        if resume and checkpointer is not None:
+            manifest = checkpointer.latest()
+            if manifest is not None and manifest["iteration"] > self.iteration:
+                start = checkpointer.load(self)
+                if start >= self.iterations:  # The checkpoint was written at the end of a call to `solve`
+                    start = 0
+
+        if method == "batched":
+            import batched_cfr
+
+            return batched_cfr.batched_solve(self, batch_size, debug=debug, start=start, checkpointer=checkpointer)
+
+        if method == "public_chance":
+            import public_chance_cfr
+
+            return public_chance_cfr.public_chance_solve(self, debug=debug, start=start, checkpointer=checkpointer)
+
+        if n_workers > 1:
+            import parallel_cfr
+
+            return parallel_cfr.parallel_solve(
+                self, method, n_workers, round_size, debug=debug, start=start, checkpointer=checkpointer
+            )
 
-    def solve(self, method="vanilla", debug=False):
         util_0 = 0
         util_1 = 0
         if method == "manim":
             histories = []
 
-        for t in tqdm(range(self.iterations), desc="CFR Training Loop"):
-            if method == "vanilla":  # vanilla
-                for player in range(
-                    self.n_players
-                ):  # This is the slower way, we can speed by updating both players
-                    if player == 0:
-                        util_0 += self.vanilla_cfr(
-                            self.create_history(t), player, t, 1, 1, debug=debug
-                        )
-                    else:
-                        util_1 += self.vanilla_cfr(
-                            self.create_history(t), player, t, 1, 1, debug=debug
-                        )
-
-            elif method == "vanilla_speedup":
-                util_0 += self.vanilla_cfr_speedup(self.create_history(t), t, 1, 1, debug=debug)
-
-            elif method == "manim" and t < 10:
-                for player in range(self.n_players):
-                    if player == 0:
-                        util_0 += self.vanilla_cfr_manim(
-                            self.create_history(t), player, t, 1, 1, histories
-                        )
-                    else:
-                        util_1 += self.vanilla_cfr_manim(
-                            self.create_history(t), player, t, 1, 1, histories
-                        )
-
-                print(histories)
+        for t in tqdm(range(start, self.iterations), desc="CFR Training Loop"):
+            # `t` indexes the sampled deal of this batch, `T` counts the iterations across batches for the regret policy
+            self.iteration += 1
+            T = self.iteration
+
+            if method == "manim":
+                if t < 10:
+                    for player in range(self.n_players):
+                        if player == 0:
+                            util_0 += self.vanilla_cfr_manim(
+                                self.create_history(t), player, T, 1, 1, histories
+                            )
+                        else:
+                            util_1 += self.vanilla_cfr_manim(
+                                self.create_history(t), player, T, 1, 1, histories
+                            )
+
+                    print(histories)
+            else:
+                u_0, u_1 = self.iterate(method, t, T, debug=debug)
+                util_0 += u_0
+                util_1 += u_1
 
             if (t + 1) % self.tracker_interval == 0:
-                print("Average game value player 0: ", util_0 / t)
-                print("Average game value player 1: ", util_1 / t)
-                if len(self.infoSets) < 100000:
-                    self.tracker(self.infoSets)
-                    self.tracker.pprint()
+                # Averages over the iterations of this call, the only ones in util_0 and util_1 after a resume
+                self.track(util_0 / (t + 1 - start), util_1 / (t + 1 - start))
+
+            if checkpointer is not None and checkpointer.due(self.iteration):
+                checkpointer.save(self, t + 1)
+
+        if checkpointer is not None:
+            checkpointer.save(self, self.iterations)
 
         if method == "manim":
             return histories
 
+    def track(self, game_value_0: float, game_value_1: float):
+        if self.backend == "array":
+            self.infoSets.flush()
+        if self.track_exploitability:
+            self.tracker.exploitability[self.iteration] = self.exploitability()
+        if self.telemetry is not None:
+            self.telemetry.record(self, game_value_0, game_value_1)
+            return
+
+        print("Average game value player 0: ", game_value_0)
+        print("Average game value player 1: ", game_value_1)
+        if self.nodes_pruned > 0:
+            print(f"Pruned {100 * self.pruned_fraction():.1f}% of the nodes")
+        if self.track_exploitability:
+            print("Exploitability of the average strategy: ", self.tracker.exploitability[self.iteration])
+        if len(self.infoSets) < 100000:
+            self.tracker(self.infoSets)
+            self.tracker.pprint()
+
+    def mean_positive_regret(self) -> float:
+        """Mean of max(regret, 0) over all the actions of all the infosets. It goes to 0 as CFR converges."""
+        if self.backend == "array":
+            regret = self.infoSets.regret[: self.infoSets.n_actions]
+            return float(np.maximum(regret, 0).mean()) if len(regret) > 0 else 0.0
+        regret = [max(r, 0) for infoSet in self.infoSets.values() for r in infoSet.regret.values()]
+        return sum(regret) / len(regret) if regret else 0.0
+
     def export_infoSets(self, filename="infoSets.joblib"):
+        """
+        Both backends are exported as they are, since `ArrayInfoSetStore` can be indexed like the dict of infosets.
+        Use `ArrayInfoSetStore.to_infoSets` to convert to the dict backend.
+        """
         joblib.dump(self.infoSets, filename)
 
+    def find_average_strategy(self, infoSet_id, infoSet_key: List[Action], actions: List[Action]) -> List[float]:
+        """
+        Average strategy of an infoset, ordered like `actions`. Unlike `get_infoSet`, this does not create the
+        infosets that were never visited: their strategy is uniform.
+        """
+        if self.backend == "array":
+            row = self.infoSets.find(infoSet_id)
+            if row < 0:
+                row = self.infoSets.ids.get("".join(infoSet_key), -1)
+            infoSet = ArrayInfoSet(self.infoSets, row) if row >= 0 else None
+        else:
+            infoSet = self.infoSet_index.get(infoSet_id)
+            if infoSet is None:
+                infoSet = self.infoSets.get("".join(infoSet_key))
+
+        if infoSet is None:
+            return [1 / len(actions)] * len(actions)
+        average_strategy = infoSet.get_average_strategy()
+        return [average_strategy[a] for a in actions]
+
     def get_expected_value(
         self, history: History, player: Player, player_strategy=None, opp_strategy=None
     ):
@@ -413,32 +1295,38 @@ class CFR:
         We can compute the expected values of two strategies. If none, then we will
         play both according to the nash equilibrium strategies we computed.
 
+        player_strategy / opp_strategy: a fixed strategy, as a list of probabilities ordered like `history.actions()`,
+        played at every infoset of the player / of its opponent. Chance outcomes are uniform over `history.actions()`.
+
         However, Getting the expected value this way is not feasible for super large games such as
         no-limit texas hold'em, which is why we can compute an approximate EV (see function below).
 
-        This is also known as the expected payoff, or utility function of a strategy profile $u_i(\sigma)$
+        This is also known as the expected payoff, or utility function of a strategy profile $u_i(\\sigma)$
         """
         # the counterfactual value is simply the averaged utilities possible
         if history.is_terminal():
             return history.terminal_utility(player)
+        elif history.is_chance():
+            outcomes = history.actions()
+            return sum(
+                self.get_expected_value(history + a, player, player_strategy, opp_strategy) for a in outcomes
+            ) / len(outcomes)
         else:
-            infoSet = self.get_infoSet(history)
-
-            if history.player() == player:
-                if player_strategy is not None:
-                    average_strategy = player_strategy
-                else:
-                    average_strategy = infoSet.get_average_strategy()
+            actions = history.actions()
+            if history.player() == player and player_strategy is not None:
+                average_strategy = player_strategy
+            elif history.player() != player and opp_strategy is not None:
+                average_strategy = opp_strategy
             else:
-                if opp_strategy is not None:
-                    average_strategy = opp_strategy
-                else:
-                    average_strategy = infoSet.get_average_strategy()
+                average_strategy = self.find_average_strategy(
+                    history.get_infoSet_id(), history.get_infoSet_key(), actions
+                )
 
             ev = 0
-            for idx, a in enumerate(infoSet.actions()):
-                value = self.get_expected_value(history + a, player, player_strategy, opp_strategy)
-                ev += average_strategy[idx] * value
+            for idx, a in enumerate(actions):
+                if average_strategy[idx] > 0:
+                    value = self.get_expected_value(history + a, player, player_strategy, opp_strategy)
+                    ev += average_strategy[idx] * value
 
             return ev
 
@@ -457,67 +1345,83 @@ class CFR:
 
             return ev
 
-    def get_best_response(self, history: History, player: Player, player_strategy=None):
+    def get_best_response(self, history: History, player: Player, opp_strategy=None):
         """
-        TODO: This only works when the action space is constant throughout. We need something more customized.
-
-        A best response is deterministic. It is a strategy profile that chooses the action that maximizes
-        its expected value.
-
-        If player_strategy is provided, it will be computed from the player's strategy profile.
-
-        Else, calculate the best response from the nash equilibrium.
+        Best response of `player` to the average strategy of its opponent (or to `opp_strategy`, a fixed strategy
+        ordered like `history.actions()`, played at every infoset of the opponent).
 
-        Cannot be a terminal history.
+        A best response is deterministic: at every infoset, it plays the action that maximizes its expected value,
+        summed over all the histories of the infoset, weighted by the probability that the opponent and chance reach
+        them. So we first collect the histories of every infoset of `player` with these weights, then choose the
+        actions from the deepest infosets up, with memoization. Chance outcomes are uniform over `history.actions()`.
 
-        returns the action index with the lowest EV (This is what the opponent should play).
-        We do this by playing all actions with equal probability.
+        This walks the whole game tree, so it is only for small games like Kuhn poker. For the hold'em abstractions,
+        see `best_response.py`.
 
-
-        returns (action_idx, action_ev)
+        returns (best response value, {infoset key: best action})
         """
-        assert not history.is_terminal()
-        assert history.player() == player  # it should be the player's turn
-
-        infoSet = self.get_infoSet(history)
-
-        ev = []
-        if player_strategy:
-            average_strategy = player_strategy
-        else:
-            average_strategy = (
-                infoSet.get_average_strategy()
-            )  # Use the strategy computed if no strategy provided
-
-        # Find the action that is a best response (gives the lowest EV) to player i's strategy profile
-
-        """
-		The algorithm is the following:
-		1. For each action that the opponent can play after our decision, we see what happens if our opponent sticks to that strategy.
-		Whatever action our opponent chooses that minimizes our expected value is the one.
-		"""
-        sample_a = infoSet.actions()[0]
-        sample_opp_history = (
-            history + sample_a
-        )  # TODO: This does not work for Hold'EM? Because some actions, like folding or calling, end the current game stage, and then it's our turn again
-        sample_opp_infoSet = self.get_infoSet(sample_opp_history)
-        opp_actions = sample_opp_infoSet.actions()
-        for opp_idx, opp_action in enumerate(opp_actions):
-            # Create deterministic opponent strategy
-            opp_strategy = np.zeros(len(opp_actions))
-            opp_strategy[opp_idx] = 1.0
-            ev_opp_action = 0
-            for idx, a in enumerate(infoSet.actions()):
-                value = self.get_expected_value(
-                    history + a, player, average_strategy, opp_strategy=opp_strategy
+        infoSet_histories = {}  # infoset id -> [(history, reach of the opponent and chance)]
+
+        def collect(history: History, reach: float):
+            if history.is_terminal() or reach == 0:
+                return
+            actions = history.actions()
+            if history.is_chance():
+                for a in actions:
+                    collect(history + a, reach / len(actions))
+            elif history.player() == player:
+                infoSet_histories.setdefault(history.get_infoSet_id(), []).append((history, reach))
+                for a in actions:
+                    collect(history + a, reach)
+            else:
+                strategy = opp_strategy or self.find_average_strategy(
+                    history.get_infoSet_id(), history.get_infoSet_key(), actions
                 )
-                ev_opp_action += average_strategy[idx] * value
-                print(ev_opp_action)
+                for a, probability in zip(actions, strategy):
+                    collect(history + a, reach * probability)
+
+        best_actions = {}  # infoset id -> best action
+
+        def best_action(history: History):
+            infoSet_id = history.get_infoSet_id()
+            if infoSet_id not in best_actions:
+                action_values = {
+                    a: sum(reach * value(h + a) for h, reach in infoSet_histories[infoSet_id])
+                    for a in history.actions()
+                }
+                best_actions[infoSet_id] = max(action_values, key=action_values.get)
+            return best_actions[infoSet_id]
+
+        def value(history: History):
+            if history.is_terminal():
+                return history.terminal_utility(player)
+            actions = history.actions()
+            if history.is_chance():
+                return sum(value(history + a) for a in actions) / len(actions)
+            if history.player() == player:
+                return value(history + best_action(history))
+            strategy = opp_strategy or self.find_average_strategy(
+                history.get_infoSet_id(), history.get_infoSet_key(), actions
+            )
+            return sum(probability * value(history + a) for a, probability in zip(actions, strategy) if probability > 0)
+
+        collect(history, 1.0)
+        br_value = value(history)
+        # The infosets that the best response never reaches also get an action
+        return br_value, {
+            "".join(histories[0][0].get_infoSet_key()): best_action(histories[0][0])
+            for histories in infoSet_histories.values()
+        }
 
-            ev.append(ev_opp_action)
+    def exploitability(self, n_samples: int = None) -> float:
+        """
+        Exploitability of the average strategy: (BR_0 + BR_1) / 2, where BR_i is the value of the best response of
+        player i to the average strategy of its opponent. It is 0 for a Nash equilibrium of a zero-sum game.
 
-        br_action = np.argmin(ev)
-        return br_action, min(ev)
+        The games that are too large for `get_best_response` override this, see `best_response.py`. The ones that are
+        evaluated on a dataset of deals only use `n_samples` random deals of it when it is set, for a cheaper estimate.
+        """
+        return sum(self.get_best_response(self.create_history(0), i)[0] for i in range(self.n_players)) / 2
 
 
 class InfoSetTracker:
@@ -527,7 +1431,7 @@ class InfoSetTracker:
 
     def __init__(self):
         self.tracker_hist = []
-        self.exploitability: Dict[int:float] = {}  # A dictionary of exploitability for index
+        self.exploitability: Dict[int, float] = {}  # iteration -> exploitability, see `CFR.track_exploitability`
         # tracker.set_histogram(f'strategy.*')
         # tracker.set_histogram(f'average_strategy.*')
         # tracker.set_histogram(f'regret.*')
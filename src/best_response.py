@@ -0,0 +1,247 @@
+"""
+Exact best responses and exploitability of the abstract pre-flop and post-flop games, see `CFR.exploitability`.
+
+In both games, the betting tree is the same for every deal: only the buckets (clusters) of the players and the
+result of the showdown change. So the chance outcomes are a list of weighted deals:
+- post-flop: the samples of the loaded dataset, with weight 1 / N (`get_batched_dataset`)
+- pre-flop: every pair of the 169 clusters, weighted by the number of pairs of hands that do not share a card, when
+  `preflop_holdem.equity_table` is set. Else, the samples of the loaded dataset.
+
+The best response of player i to the average strategy of its opponent walks the betting tree once, with a vector of
+the reach probability of the opponent (times the weight of the deal) over the deals:
+- At a node of the opponent, the average strategies of its buckets are gathered and multiply the reach. The deals
+  that the opponent stops reaching are dropped.
+- At a node of player i, the values of every action are summed per bucket of player i with `np.bincount`, and the
+  best action of each bucket is played by all the deals of the bucket.
+- At a terminal node, the value of a deal is its utility times the reach of the opponent.
+This is exact for the abstract game, and costs a few vector operations per node of the betting tree.
+
+The exploitability is (BR_0 + BR_1) / 2, where BR_i is the value of the best response of player i. It is 0 for a
+Nash equilibrium, and in chips otherwise.
+"""
+
+from functools import lru_cache
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from base import CFR
+import abstraction
+import preflop_holdem
+from preflop_holdem import PreflopHoldemHistory
+
+
+def average_strategies(store, rows: np.ndarray, n_actions: int) -> np.ndarray:
+    """
+    Average strategies of `rows` of an `ArrayInfoSetStore`, uniform for the rows that are missing (-1) or that were
+    never reached, like `ArrayInfoSet.get_average_strategy`.
+    """
+    strategy = np.full((len(rows), n_actions), 1 / n_actions)
+    found = np.flatnonzero(rows >= 0)
+    if len(found) > 0:
+        index = store.offsets[rows[found]][:, None] + np.arange(n_actions)
+        cumulative = store.cumulative_strategy[index].astype(np.float64)
+        total = cumulative.sum(axis=1, keepdims=True)
+        strategy[found] = np.divide(cumulative, total, out=strategy[found], where=total > 0)
+    return strategy
+
+
+class BestResponse:
+    """
+    tree: the betting tree, with the attributes of `CompiledPostflopTree` (players, terminal, folded, fold_utilities,
+            pot_sizes, streets, actions, children)
+    buckets: buckets[i][street - 1] is the bucket of player i on `street` for every deal
+    showdown: expected result of the showdown for player 0 for every deal, between -1 (loses) and 1 (wins)
+    weights: probability of every deal
+    strategy: (node, buckets) -> average strategies of the acting player at `node` with these buckets, one row each
+    """
+
+    def __init__(
+        self,
+        tree,
+        buckets: List[List[np.ndarray]],
+        showdown: np.ndarray,
+        weights: np.ndarray,
+        strategy: Callable[[int, np.ndarray], np.ndarray],
+    ):
+        self.tree = tree
+        self.buckets = buckets
+        self.showdown = np.asarray(showdown, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.strategy = strategy
+        self.best_actions: Dict[int, tuple] = {}  # node -> (buckets, index of the best action of each bucket)
+
+    def value(self, i: int) -> float:
+        """Expected value of the best response of player i."""
+        deals = np.flatnonzero(self.weights > 0)
+        return float(self.traverse(0, i, deals, self.weights[deals]).sum())
+
+    def traverse(self, node: int, i: int, deals: np.ndarray, reach: np.ndarray) -> np.ndarray:
+        """
+        Returns the counterfactual values of player i for every deal of `deals`, where `reach` is the reach of the
+        opponent times the probability of the deal.
+        """
+        tree = self.tree
+        if tree.terminal[node]:
+            if tree.folded[node]:
+                utility = tree.fold_utilities[node] * reach
+            else:
+                utility = tree.pot_sizes[node] / 2 * self.showdown[deals] * reach
+            return utility if i == 0 else -utility
+
+        player = tree.players[node]
+        actions = tree.actions[node]
+        present, position = np.unique(self.buckets[player][tree.streets[node] - 1][deals], return_inverse=True)
+        position = position.ravel()
+
+        if player != i:
+            strategy = self.strategy(node, present)[position]
+            values = np.zeros(len(deals))
+            for a, action in enumerate(actions):
+                child_reach = reach * strategy[:, a]
+                reached = child_reach > 0
+                if reached.all():
+                    values += self.traverse(tree.children[node][action], i, deals, child_reach)
+                elif reached.any():
+                    values[reached] += self.traverse(
+                        tree.children[node][action], i, deals[reached], child_reach[reached]
+                    )
+            return values
+
+        action_values = np.stack(
+            [self.traverse(tree.children[node][action], i, deals, reach) for action in actions], axis=1
+        )
+        bucket_values = np.stack(
+            [np.bincount(position, weights=action_values[:, a], minlength=len(present)) for a in range(len(actions))],
+            axis=1,
+        )
+        best = bucket_values.argmax(axis=1)
+        self.best_actions[node] = (present, best)
+        return action_values[np.arange(len(deals)), best[position]]
+
+    def exploitability(self) -> float:
+        return (self.value(0) + self.value(1)) / 2
+
+
+def sample_deals(n_deals: int, n_samples: int = None, seed: int = 0) -> np.ndarray:
+    """
+    `n_samples` random deals among `n_deals`, or None (all of them) if `n_samples` is None or too large. The generator
+    is separate from the ones of training, so that estimating the exploitability does not change the training.
+    """
+    if n_samples is None or n_samples >= n_deals:
+        return None
+    return np.sort(np.random.default_rng(seed).choice(n_deals, n_samples, replace=False))
+
+
+# ---------- Post-flop ----------
+def postflop_best_response(cfr: CFR, samples: np.ndarray = None) -> BestResponse:
+    """
+    Best response on the loaded post-flop dataset, with `create_compiled_history` and the "array" backend.
+
+    samples: indices of the deals to use, ex: a random subset, for a cheaper estimate. All of them by default.
+    """
+    assert cfr.backend == "array", "The post-flop best response needs the array backend"
+    root = cfr.create_history(0)
+    assert hasattr(root, "get_batched_dataset"), "The post-flop best response needs `create_compiled_history`"
+    tree = root.tree
+    codes, winners = root.get_batched_dataset()
+    if samples is not None:
+        codes = [[street_codes[samples] for street_codes in player_codes] for player_codes in codes]
+        winners = winners[samples]
+
+    def strategy(node: int, node_codes: np.ndarray) -> np.ndarray:
+        rows = cfr.infoSets.find_rows(tree.infoSet_offsets[node] + node_codes)
+        return average_strategies(cfr.infoSets, rows, len(tree.actions[node]))
+
+    return BestResponse(tree, codes, winners, np.full(len(winners), 1 / len(winners)), strategy)
+
+
+# ---------- Pre-flop ----------
+class PreflopBettingTree:
+    """
+    The betting tree of `PreflopHoldemHistory`, with the attributes of `CompiledPostflopTree` that `BestResponse`
+    uses. There is a single street, and `betting[node]` is the betting part of the infoset keys of the node.
+    """
+
+    # Only used to walk the betting, which does not depend on the cards
+    HANDS = ["AhAd", "KhKd"]
+    BOARD = "2c3c4c5c7s"
+
+    def __init__(self):
+        self.players, self.terminal, self.folded = [], [], []
+        self.fold_utilities, self.pot_sizes, self.streets = [], [], []
+        self.actions, self.children, self.betting = [], [], []
+        self._build(PreflopHoldemHistory(list(self.HANDS)))
+
+    def _build(self, history: PreflopHoldemHistory) -> int:
+        node = len(self.players)
+        terminal = history.is_chance()  # The betting is over, the rest are chance outcomes
+        if terminal:
+            history = history + "/" + self.BOARD
+        self.players.append(-1 if terminal else history.player())
+        self.terminal.append(terminal)
+        self.folded.append(terminal and history.fold_pot is not None)
+        self.fold_utilities.append(history.terminal_utility(0) if self.folded[node] else 0)
+        self.pot_sizes.append(history.pot[0])
+        self.streets.append(1)
+        self.betting.append(history.betting)
+        self.actions.append([] if terminal else history.actions())
+        self.children.append({})
+        for action in self.actions[node]:
+            self.children[node][action] = self._build(history + action)
+        return node
+
+
+@lru_cache(maxsize=1)
+def get_preflop_matchup_weights() -> np.ndarray:
+    """
+    169 x 169 probabilities of the pairs of pre-flop clusters (cluster id - 1), from the number of pairs of hands of
+    the two clusters that do not share a card.
+    """
+    hands = [hand for cluster_hands in abstraction.get_preflop_cluster_hands().values() for hand in cluster_hands]
+    clusters = np.array([abstraction.get_preflop_cluster_id(hand) - 1 for hand in hands])
+    cards = sorted({card for hand in hands for card in hand})
+    holds = np.zeros((len(hands), len(cards)))
+    for h, hand in enumerate(hands):
+        holds[h, [cards.index(card) for card in hand]] = 1
+    compatible = (holds @ holds.T) == 0
+    one_hot = np.eye(169)[clusters]
+    weights = one_hot.T @ compatible @ one_hot
+    return weights / weights.sum()
+
+
+def preflop_best_response(cfr: CFR, samples: np.ndarray = None) -> BestResponse:
+    """
+    Best response in the pre-flop game, over all the pairs of clusters with `preflop_holdem.equity_table`, else over
+    the loaded dataset.
+
+    samples: indices of the deals of the dataset to use, when there is no equity table. All of them by default.
+    """
+    tree = PreflopBettingTree()
+    if preflop_holdem.equity_table is not None:
+        pairs = np.indices((169, 169)).reshape(2, -1)
+        clusters = pairs + 1
+        showdown = 2 * np.asarray(preflop_holdem.equity_table, dtype=np.float64)[pairs[0], pairs[1]] - 1
+        weights = get_preflop_matchup_weights()[pairs[0], pairs[1]]
+    else:
+        clusters = np.array(
+            [
+                [abstraction.get_preflop_cluster_id(hand) for hand in preflop_holdem.player_hands],
+                [abstraction.get_preflop_cluster_id(hand) for hand in preflop_holdem.opponent_hands],
+            ]
+        )
+        showdown = np.asarray(preflop_holdem.winners, dtype=np.float64)
+        if samples is not None:
+            clusters, showdown = clusters[:, samples], showdown[samples]
+        weights = np.full(len(showdown), 1 / len(showdown))
+
+    def strategy(node: int, node_clusters: np.ndarray) -> np.ndarray:
+        actions = tree.actions[node]
+        return np.array(
+            [
+                cfr.find_average_strategy((str(cluster),) + tree.betting[node], [str(cluster), *tree.betting[node]], actions)
+                for cluster in node_clusters
+            ]
+        )
+
+    return BestResponse(tree, [[clusters[0]], [clusters[1]]], showdown, weights, strategy)
@@ -0,0 +1,253 @@
+"""
+Resumable checkpoints of the CFR training state, see `CFR.solve(checkpointer=..., resume=True)`.
+
+A checkpoint is a folder with:
+- `manifest.json`: the iteration counter, the position in the current batch of sampled deals, the state of the
+  `random` and `np.random` generators, and the list of segments to load, in order.
+- `segment_*.npz`: columnar tables of infosets (keys, action sets, players, regrets, strategies, cumulative
+  strategies, last updates). Each segment only has the infosets that were updated since the previous checkpoint
+  (the "dirty" infosets of the `ArrayInfoSetStore`), so writing a checkpoint does not stall training on large tables.
+  When a segment has the same infoset as a previous one, the later one wins.
+
+A segment is written to a temporary file and moved in place with `os.replace`, then the manifest is replaced the same
+way. The manifest is only replaced once its segments are on disk, so a crash while checkpointing leaves the previous
+checkpoint intact. When the segments add up to more than `compact_ratio` times the number of infosets, the next
+checkpoint is a full one, and the older segments are deleted.
+
+The dict backend is meant for small games, so it does not track dirty infosets and always writes full checkpoints.
+"""
+
+import json
+import os
+import random
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from base import ArrayInfoSetStore
+
+MANIFEST = "manifest.json"
+
+
+def _write_atomic(path: str, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _action_slices(offsets: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Indices in the action arrays of the infosets `ids`, concatenated."""
+    starts = offsets[ids]
+    lengths = offsets[ids + 1] - starts
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths - starts, lengths)
+
+
+class Checkpointer:
+    def __init__(
+        self,
+        directory: str,
+        every_iterations: Optional[int] = None,
+        every_seconds: Optional[float] = None,
+        compact_ratio: float = 2.0,
+    ):
+        """
+        A checkpoint is written every `every_iterations` iterations or `every_seconds` seconds, whichever comes first,
+        and at the end of every call to `CFR.solve`.
+        """
+        self.directory = directory
+        self.every_iterations = every_iterations
+        self.every_seconds = every_seconds
+        self.compact_ratio = compact_ratio
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = self.latest()
+        self.last_iteration = manifest["iteration"] if manifest else 0
+        self.last_time = time.time()
+
+    def latest(self) -> Optional[dict]:
+        """The manifest of the latest checkpoint, or None if there is none."""
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def due(self, iteration: int) -> bool:
+        if self.every_iterations is not None and iteration - self.last_iteration >= self.every_iterations:
+            return True
+        return self.every_seconds is not None and time.time() - self.last_time >= self.every_seconds
+
+    # ----- Saving -----
+    def save(self, cfr, sample: int):
+        """
+        sample: the next sampled deal to train on in the current call to `solve`
+        """
+        manifest = self.latest()
+        segments: List[str] = manifest["segments"] if manifest else []
+        rows = manifest["rows"] if manifest else 0
+
+        infoSets = cfr.infoSets
+        if isinstance(infoSets, ArrayInfoSetStore):
+            full = rows + infoSets.n_infoSets > self.compact_ratio * max(infoSets.n_infoSets, 1)
+            if full:
+                ids = np.arange(infoSets.n_infoSets)
+            else:
+                ids = np.flatnonzero(infoSets.dirty[: infoSets.n_infoSets])
+            columns = self._store_columns(infoSets, ids)
+        else:
+            full = True
+            columns = self._dict_columns(infoSets)
+
+        if full:
+            segments, rows = [], 0
+        segment = f"segment_{cfr.iteration:012d}_{len(segments):04d}.npz"
+        _write_atomic(os.path.join(self.directory, segment), lambda f: np.savez(f, **columns))
+        segments.append(segment)
+        rows += len(columns["players"])
+
+        manifest = {
+            "iteration": cfr.iteration,
+            "sample": sample,
+            "n_infoSets": len(infoSets),
+            "segments": segments,
+            "rows": rows,
+            "random_state": random.getstate(),
+            "numpy_random_state": [
+                value.tolist() if isinstance(value, np.ndarray) else value for value in np.random.get_state()
+            ],
+        }
+        _write_atomic(
+            os.path.join(self.directory, MANIFEST), lambda f: f.write(json.dumps(manifest).encode("utf-8"))
+        )
+
+        # The new manifest is on disk, the segments it does not use can go
+        for filename in os.listdir(self.directory):
+            if filename.startswith("segment_") and filename not in segments:
+                os.remove(os.path.join(self.directory, filename))
+
+        if isinstance(infoSets, ArrayInfoSetStore):
+            infoSets.dirty[:] = False
+        self.last_iteration = cfr.iteration
+        self.last_time = time.time()
+
+    @staticmethod
+    def _columns(keys, action_sets, set_ids, players, last_update, regret, strategy, cumulative_strategy):
+        return {
+            "keys": np.frombuffer("\n".join(keys).encode("utf-8"), dtype=np.uint8),
+            "action_sets": np.array(json.dumps(action_sets)),
+            "action_set_ids": np.asarray(set_ids, dtype=np.int32),
+            "players": np.asarray(players, dtype=np.int8),
+            "last_update": np.asarray(last_update, dtype=np.int32),
+            "regret": np.asarray(regret),
+            "strategy": np.asarray(strategy),
+            "cumulative_strategy": np.asarray(cumulative_strategy),
+        }
+
+    def _store_columns(self, store: ArrayInfoSetStore, ids: np.ndarray) -> dict:
+        action_sets, set_ids, interned = [], [], {}
+        for infoSet_id in ids:
+            actions = store.action_sets[infoSet_id]
+            if id(actions) not in interned:  # The action sets of the store are interned
+                interned[id(actions)] = len(action_sets)
+                action_sets.append(actions)
+            set_ids.append(interned[id(actions)])
+
+        slices = _action_slices(store.offsets, ids)
+        return self._columns(
+            [store.infoSet_keys[infoSet_id] for infoSet_id in ids],
+            action_sets,
+            set_ids,
+            store.players[ids],
+            store.last_update[ids],
+            store.regret[slices],
+            store.strategy[slices],
+            store.cumulative_strategy[slices],
+        )
+
+    def _dict_columns(self, infoSets: dict) -> dict:
+        action_sets, set_ids, interned = [], [], {}
+        regret, strategy, cumulative_strategy = [], [], []
+        for infoSet in infoSets.values():
+            actions = tuple(infoSet.actions())
+            if actions not in interned:
+                interned[actions] = len(action_sets)
+                action_sets.append(list(actions))
+            set_ids.append(interned[actions])
+            regret += infoSet.regret_vector()
+            strategy += infoSet.strategy_vector()
+            cumulative_strategy += [infoSet.cumulative_strategy[a] for a in actions]
+
+        return self._columns(
+            list(infoSets.keys()),
+            action_sets,
+            set_ids,
+            [infoSet.player() for infoSet in infoSets.values()],
+            [infoSet.last_update for infoSet in infoSets.values()],
+            np.array(regret, dtype=np.float64),
+            np.array(strategy, dtype=np.float64),
+            np.array(cumulative_strategy, dtype=np.float64),
+        )
+
+    # ----- Loading -----
+    def load(self, cfr) -> Optional[int]:
+        """
+        Restores the infosets, the iteration counter and the random generators of `cfr` from the latest checkpoint.
+        Returns the next sampled deal to train on in the current call to `solve`, or None if there is no checkpoint.
+        """
+        manifest = self.latest()
+        if manifest is None:
+            return None
+
+        if isinstance(cfr.infoSets, ArrayInfoSetStore):
+            replaced = cfr.infoSets
+            cfr.infoSets = replaced.empty()
+            replaced.close()
+        else:
+            cfr.infoSets = {}
+            cfr.infoSet_index = {}
+        for segment in manifest["segments"]:
+            with np.load(os.path.join(self.directory, segment)) as columns:
+                self._load_segment(cfr, {name: columns[name] for name in columns.files})
+
+        cfr.iteration = manifest["iteration"]
+        version, state, gauss = manifest["random_state"]
+        random.setstate((version, tuple(state), gauss))
+        name, keys, pos, has_gauss, cached_gaussian = manifest["numpy_random_state"]
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+        if isinstance(cfr.infoSets, ArrayInfoSetStore):
+            cfr.infoSets.dirty[:] = False
+        self.last_iteration = cfr.iteration
+        self.last_time = time.time()
+        return manifest["sample"]
+
+    def _load_segment(self, cfr, columns: dict):
+        keys = columns["keys"].tobytes().decode("utf-8").split("\n") if len(columns["keys"]) else []
+        action_sets = json.loads(str(columns["action_sets"]))
+        start = 0
+        for key, set_id, player, last_update in zip(
+            keys, columns["action_set_ids"], columns["players"], columns["last_update"]
+        ):
+            actions = action_sets[set_id]
+            end = start + len(actions)
+            if isinstance(cfr.infoSets, ArrayInfoSetStore):
+                store = cfr.infoSets
+                infoSet_id = store.ids.get(key)
+                if infoSet_id is None:
+                    infoSet_id = store.add_infoSet(key, actions, int(player))
+                infoSet_start = store.offsets[infoSet_id]
+                for name in ["regret", "strategy", "cumulative_strategy"]:
+                    getattr(store, name)[infoSet_start : infoSet_start + len(actions)] = columns[name][start:end]
+                store.last_update[infoSet_id] = last_update
+            else:
+                infoSet = cfr.create_infoSet(key, actions, int(player))
+                for name in ["regret", "strategy", "cumulative_strategy"]:
+                    setattr(infoSet, name, dict(zip(actions, columns[name][start:end].tolist())))
+                infoSet.last_update = int(last_update)
+                cfr.infoSets[key] = infoSet
+            start = end
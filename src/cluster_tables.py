@@ -0,0 +1,135 @@
+"""
+Offline tables of the cluster of every canonical flop, turn and river hand, so that `abstraction.predict_cluster` is
+a lookup instead of an equity computation (about 0.15s per flop hand, 6ms per turn hand).
+
+The hands are indexed with `hand_isomorphism.py`: the table of a street has one entry per suit-isomorphism class, at
+the index of the class. The job is split in shards of `shard_size` consecutive indices, computed by `n_jobs`
+processes. Every shard is written to its own file once it is complete (to a temporary file that is then renamed),
+so a job that is stopped can be started again, and only computes the shards that are missing. When all the shards
+are there, they are assembled into one array (uint8, or uint16 past 256 clusters) and the manifest is written.
+
+Layout, in `directory` (`abstraction.CLUSTER_TABLE_DIRECTORY` by default):
+    {street}/shards/{start}_{end}.npy
+    {street}/clusters.npy
+    {street}/manifest.json: street, size, n_clusters, shard_size and source, the classifier the clusters come from
+            (the file of the KMeans classifier, or "equity" for the equity buckets)
+
+`abstraction.load_cluster_tables` memory-maps the tables whose manifest matches the current abstraction.
+
+The clusters are the ones of `abstraction.predict_hand_cluster`, computed with the same functions: the equity bucket
+of `abstraction.equity_buckets` on the river, and the KMeans cluster of `abstraction.distribution_clusters` on the flop
+and turn (or the equity bucket without KMeans). Cost of a full
+table with the vectorized evaluator, in CPU time: about 5 hours for the river (123,156,254 classes), 25 hours for
+the turn (13,960,050) and 50 hours for the flop (1,286,792).
+
+Usage: python cluster_tables.py --street river --n_jobs -1
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Optional
+
+import numpy as np
+from joblib import Parallel, delayed
+from tqdm import tqdm
+
+import abstraction
+from hand_isomorphism import get_indexer
+
+STREETS = ["flop", "turn", "river"]
+DEFAULT_SHARD_SIZE = 100_000
+
+
+def table_dtype(n_clusters: int):
+    return np.uint8 if n_clusters <= 256 else np.uint16
+
+
+def compute_clusters(street: str, hands: np.ndarray) -> np.ndarray:
+    """Clusters of a batch of hands of `street`, as card ids (hole cards first), like `predict_hand_cluster`."""
+    if abstraction.street_source(street) != "equity":
+        kmeans = abstraction.kmeans_flop if street == "flop" else abstraction.kmeans_turn
+        return abstraction.distribution_clusters(kmeans, hands)
+
+    return abstraction.equity_buckets(hands, abstraction.street_clusters(street))
+
+
+def compute_shard(street: str, start: int, end: int, shards_directory: str, batch_size: int = 1024) -> str:
+    """Computes the clusters of the classes `start` to `end` (excluded) of `street`, and saves them."""
+    indexer = get_indexer(street)
+    clusters = np.empty(end - start, dtype=table_dtype(abstraction.street_clusters(street)))
+    for batch_start in range(start, end, batch_size):
+        indices = np.arange(batch_start, min(end, batch_start + batch_size))
+        clusters[indices - start] = compute_clusters(street, indexer.unindex(indices))
+
+    path = os.path.join(shards_directory, f"{start}_{end}.npy")
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, clusters)
+    os.replace(path + ".tmp", path)  # Atomic, so a shard file is always complete
+    return path
+
+
+def build_table(
+    street: str,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    n_jobs: int = -1,
+    directory: Optional[str] = None,
+    n_classes: Optional[int] = None,
+) -> str:
+    """
+    Computes the shards of `street` that are missing, then assembles the table. Returns the path of the table.
+
+    n_classes: only the first `n_classes` classes (for tests), the whole street by default
+    """
+    assert street in STREETS
+    directory = os.path.join(directory or abstraction.CLUSTER_TABLE_DIRECTORY, street)
+    shards_directory = os.path.join(directory, "shards")
+    os.makedirs(shards_directory, exist_ok=True)
+
+    size = get_indexer(street).size() if n_classes is None else n_classes
+    shards = [(start, min(size, start + shard_size)) for start in range(0, size, shard_size)]
+    missing = [
+        (start, end) for start, end in shards if not os.path.exists(os.path.join(shards_directory, f"{start}_{end}.npy"))
+    ]
+    print(f"{street}: {size} classes, {len(shards) - len(missing)}/{len(shards)} shards already computed")
+
+    start_time = time.time()
+    Parallel(n_jobs=n_jobs)(
+        delayed(compute_shard)(street, start, end, shards_directory) for start, end in tqdm(missing)
+    )
+    print(f"Computed {len(missing)} shards in {time.time() - start_time:.1f}s")
+
+    n_clusters = abstraction.street_clusters(street)
+    table = np.lib.format.open_memmap(
+        os.path.join(directory, "clusters.npy.tmp"), mode="w+", dtype=table_dtype(n_clusters), shape=(size,)
+    )
+    for start, end in shards:
+        table[start:end] = np.load(os.path.join(shards_directory, f"{start}_{end}.npy"))
+    table.flush()
+    del table
+    path = os.path.join(directory, "clusters.npy")
+    os.replace(path + ".tmp", path)
+
+    manifest = {
+        "street": street,
+        "size": size,
+        "n_clusters": n_clusters,
+        "shard_size": shard_size,
+        "source": abstraction.street_source(street),
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the cluster of every canonical postflop hand.")
+    parser.add_argument("--street", choices=STREETS + ["all"], default="all")
+    parser.add_argument("--shard_size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--n_jobs", type=int, default=-1)
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+
+    for street in STREETS if args.street == "all" else [args.street]:
+        print("Table saved to", build_table(street, args.shard_size, args.n_jobs, args.directory))
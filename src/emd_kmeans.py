@@ -0,0 +1,210 @@
+"""
+K-Means on 1-D histograms (the equity distributions of `abstraction.py`) with the Earth Mover's Distance.
+
+With bins of the same width on a line, the EMD has a closed form: it is the L1 distance between the cumulative
+distributions (CDFs), in units of bins, so the distances between N histograms and K centroids are one vectorized
+operation on the (N, bins) array of CDFs, computed by chunks of `CHUNK_SIZE` histograms. The assignment of a large
+dataset is split between `n_jobs` processes.
+
+`EMDKMeans` has the interface of `sklearn.cluster.KMeans` that the abstraction uses (`fit`, `predict`,
+`cluster_centers_`, `labels_`, `inertia_`), so its classifiers are saved and loaded the same way:
+- The centroids are seeded with k-means++, on a sample of `init_size` histograms, or start from `init`.
+- Without `batch_size`, the centroids are fitted with Lloyd iterations on the whole dataset. With `batch_size`, every
+  step moves the centroids of a random batch towards its histograms, with a learning rate of 1 / (number of
+  histograms the centroid has seen), like `sklearn.cluster.MiniBatchKMeans`, for millions of histograms.
+- A centroid is the mean of its histograms, as in the potential-aware abstraction paper. It is still a distribution,
+  and its CDF is the mean of their CDFs.
+- Everything random comes from `random_state`, so the same data and seed give the same clusters, whatever `n_jobs`.
+
+`inertia_` is the sum of the EMDs of the histograms to their centroid.
+"""
+
+from typing import Optional
+
+import numpy as np
+from joblib import Parallel, delayed
+
+CHUNK_SIZE = 1024
+
+
+def to_cdfs(histograms) -> np.ndarray:
+    """(N, bins) cumulative distributions of (N, bins) histograms, normalized to sum to 1."""
+    histograms = np.asarray(histograms, dtype=np.float64)
+    cdfs = np.cumsum(histograms, axis=1)
+    return cdfs / cdfs[:, -1:]
+
+
+def emd(histogram_a, histogram_b) -> float:
+    """Earth Mover's Distance between two histograms, in units of bins."""
+    return float(np.abs(to_cdfs([histogram_a]) - to_cdfs([histogram_b])).sum())
+
+
+def emd_distances(cdfs: np.ndarray, centroid_cdfs: np.ndarray) -> np.ndarray:
+    """(N, K) EMDs between N and K histograms, given as CDFs (see `to_cdfs`)."""
+    distances = np.zeros((len(cdfs), len(centroid_cdfs)))
+    for start in range(0, len(cdfs), CHUNK_SIZE):
+        chunk, chunk_distances = cdfs[start : start + CHUNK_SIZE], distances[start : start + CHUNK_SIZE]
+        # One bin at a time: (chunk, K) arrays, faster than a (chunk, K, bins) array
+        for b in range(cdfs.shape[1]):
+            chunk_distances += np.abs(chunk[:, b, None] - centroid_cdfs[None, :, b])
+    return distances
+
+
+def _cluster_sums(cdfs: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    return np.stack([np.bincount(labels, weights=cdfs[:, b], minlength=n_clusters) for b in range(cdfs.shape[1])], 1)
+
+
+def _assign_chunk(cdfs: np.ndarray, centroid_cdfs: np.ndarray):
+    distances = emd_distances(cdfs, centroid_cdfs)
+    labels = distances.argmin(axis=1)
+    return labels, distances[np.arange(len(cdfs)), labels]
+
+
+def assign(cdfs: np.ndarray, centroid_cdfs: np.ndarray, n_jobs: int = 1):
+    """Closest centroid of every histogram and its EMD, with `n_jobs` processes for the large datasets."""
+    if n_jobs == 1 or len(cdfs) <= CHUNK_SIZE:
+        return _assign_chunk(cdfs, centroid_cdfs)
+    chunk_size = max(CHUNK_SIZE, -(-len(cdfs) // (16 * abs(n_jobs))))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_assign_chunk)(cdfs[start : start + chunk_size], centroid_cdfs)
+        for start in range(0, len(cdfs), chunk_size)
+    )
+    return np.concatenate([labels for labels, _ in results]), np.concatenate([distances for _, distances in results])
+
+
+class EMDKMeans:
+    def __init__(
+        self,
+        n_clusters: int = 8,
+        max_iter: int = 100,
+        tol: float = 1e-4,
+        batch_size: Optional[int] = None,
+        init_size: Optional[int] = None,
+        max_no_improvement: int = 10,
+        n_jobs: int = 1,
+        random_state: int = 0,
+        verbose: bool = False,
+        init: Optional[np.ndarray] = None,
+    ):
+        """
+        max_iter: Lloyd iterations, or passes over the data with `batch_size`
+        tol: stop the Lloyd iterations when no centroid moves by more than `tol` (EMD)
+        batch_size: histograms per mini-batch step, None for Lloyd iterations on the whole dataset
+        init_size: histograms sampled for the k-means++ seeding, all of them by default (max(10 * n_clusters,
+                3 * batch_size) with `batch_size`)
+        max_no_improvement: with `batch_size`, stop after this many steps without a lower mean EMD on the batches
+        n_jobs: processes for the assignment of the whole dataset, as in `joblib.Parallel`
+        init: (n_clusters, bins) histograms to start from instead of k-means++, like an array `init` of
+                `sklearn.cluster.KMeans`. The cluster k of the fit is then the one that started from init[k].
+        """
+        self.n_clusters = n_clusters
+        self.max_iter = max_iter
+        self.tol = tol
+        self.batch_size = batch_size
+        self.init_size = init_size
+        self.max_no_improvement = max_no_improvement
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+        self.init = init
+
+    def _init_centroids(self, cdfs: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """k-means++: every new centroid is a histogram drawn with a probability proportional to its squared EMD to
+        the closest centroid so far."""
+        init_size = self.init_size
+        if init_size is None and self.batch_size is not None:
+            init_size = max(10 * self.n_clusters, 3 * self.batch_size)
+        if init_size is not None and init_size < len(cdfs):
+            cdfs = cdfs[rng.choice(len(cdfs), init_size, replace=False)]
+
+        centroids = [cdfs[rng.integers(len(cdfs))]]
+        closest = emd_distances(cdfs, centroids[0][None])[:, 0]
+        for _ in range(1, self.n_clusters):
+            weights = closest**2
+            if weights.sum() == 0:  # Fewer distinct histograms than clusters
+                index = rng.integers(len(cdfs))
+            else:
+                index = rng.choice(len(cdfs), p=weights / weights.sum())
+            centroids.append(cdfs[index])
+            closest = np.minimum(closest, emd_distances(cdfs, cdfs[index][None])[:, 0])
+        return np.array(centroids)
+
+    def _lloyd(self, cdfs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        for iteration in range(self.max_iter):
+            labels, distances = assign(cdfs, centroids, self.n_jobs)
+            counts = np.bincount(labels, minlength=self.n_clusters)
+            sums = _cluster_sums(cdfs, labels, self.n_clusters)
+            new_centroids = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids)
+            # An empty cluster restarts from the histograms that are the furthest from their centroid
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                new_centroids[empty] = cdfs[np.argsort(distances)[::-1][: len(empty)]]
+
+            shift = np.abs(new_centroids - centroids).sum(axis=1).max()
+            centroids = new_centroids
+            if self.verbose:
+                print(f"Iteration {iteration}: inertia {distances.sum():.2f}, largest centroid shift {shift:.2e}")
+            if shift <= self.tol:
+                break
+        self.n_iter_ = iteration + 1
+        return centroids
+
+    def _mini_batch(self, cdfs: np.ndarray, centroids: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        counts = np.zeros(self.n_clusters)
+        n_steps = self.max_iter * -(-len(cdfs) // self.batch_size)
+        # The batches are noisy, so the centroids never stop moving. Like `MiniBatchKMeans`, stop when a moving average
+        # of the mean EMD of the batches has not improved for `max_no_improvement` steps.
+        alpha = min(1.0, 2 * self.batch_size / (len(cdfs) + 1))
+        average, best_average, steps_without_improvement = None, np.inf, 0
+        for step in range(n_steps):
+            batch = cdfs[rng.integers(len(cdfs), size=self.batch_size)]
+            labels, distances = _assign_chunk(batch, centroids)
+            batch_counts = np.bincount(labels, minlength=self.n_clusters)
+            sums = _cluster_sums(batch, labels, self.n_clusters)
+            # Every centroid stays the mean of all the histograms it was assigned
+            counts += batch_counts
+            seen = batch_counts > 0
+            centroids[seen] += (sums[seen] - batch_counts[seen, None] * centroids[seen]) / counts[seen, None]
+
+            average = distances.mean() if average is None else (1 - alpha) * average + alpha * distances.mean()
+            if average < best_average:
+                best_average, steps_without_improvement = average, 0
+            else:
+                steps_without_improvement += 1
+            if self.verbose:
+                print(f"Step {step}: mean batch EMD {distances.mean():.4f}, moving average {average:.4f}")
+            if steps_without_improvement >= self.max_no_improvement:
+                break
+        self.n_iter_ = step + 1
+        return centroids
+
+    def fit(self, X, y=None) -> "EMDKMeans":
+        """X: (N, bins) histograms"""
+        cdfs = to_cdfs(X)
+        assert len(cdfs) >= self.n_clusters
+        rng = np.random.default_rng(self.random_state)
+        if self.init is not None:
+            assert len(self.init) == self.n_clusters
+            centroids = to_cdfs(self.init)
+        else:
+            centroids = self._init_centroids(cdfs, rng)
+        if self.batch_size is None:
+            centroids = self._lloyd(cdfs, centroids)
+        else:
+            centroids = self._mini_batch(cdfs, centroids, rng)
+
+        self.centroid_cdfs_ = centroids
+        self.cluster_centers_ = np.diff(centroids, axis=1, prepend=0)
+        self.labels_, distances = assign(cdfs, centroids, self.n_jobs)
+        self.inertia_ = float(distances.sum())
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        return assign(to_cdfs(X), self.centroid_cdfs_, self.n_jobs)[0]
+
+    def fit_predict(self, X, y=None) -> np.ndarray:
+        return self.fit(X).labels_
+
+    def transform(self, X) -> np.ndarray:
+        """(N, n_clusters) EMDs of the histograms to the centroids."""
+        return emd_distances(to_cdfs(X), self.centroid_cdfs_)
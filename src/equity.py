@@ -0,0 +1,184 @@
+"""
+Exact and stratified equity of two hole cards against a random opponent hand, see `equity`.
+
+The cards are integer ids, `rank * 4 + suit` like `phevaluator` (see `fast_evaluator.card_ids`). For a complete
+board (a runout), all the opponent hands that are left (990 pairs of the 45 remaining cards) are ranked with the
+player's hand by `fast_evaluator.evaluate_batch`, for up to `RUNOUTS_PER_BATCH` runouts at a time (`river_equities`).
+
+Before the river, the equity is the average over the runouts (the cards left to come):
+- "exact" enumerates all the runouts: 46 rivers on the turn, 1081 turn and river pairs on the flop (about 0.3s) and
+  2,118,760 boards pre-flop (about 6 minutes, only for offline tables).
+- "stratified" samples `n_runouts` runouts, spread evenly over the next card: every next card is a stratum, and gets
+  n_runouts / (number of cards left) runouts, whose other cards are drawn at random. The generator is seeded, so the
+  same cards always give the same equity. The suits are relabeled first (see `canonical_suits`), so the hands
+  that only differ by a permutation of the suits (ex: AhAd and AsAc) also get the same equity.
+- "auto" (default) is exact when there are at most `n_runouts` runouts (the river, and the turn with the default
+  `n_runouts`), and stratified otherwise.
+"""
+
+import math
+from itertools import combinations, islice
+from typing import List, Tuple
+
+import numpy as np
+
+from fast_evaluator import card_ids, evaluate_batch
+
+DEFAULT_RUNOUTS = 100
+RUNOUTS_PER_BATCH = 1024
+
+
+def canonical_suits(player: np.ndarray, board: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Relabels the suits in their order of first appearance in the sorted hole cards, then the sorted board. The equity
+    does not change, and isomorphic hole cards sample the same runouts.
+    """
+    player, board = np.sort(player), np.sort(board)
+    order = list(dict.fromkeys((np.concatenate([player, board]) % 4).tolist()))
+    order += [suit for suit in range(4) if suit not in order]
+    relabel = np.empty(4, dtype=np.int64)
+    relabel[order] = np.arange(4)
+    return player // 4 * 4 + relabel[player % 4], board // 4 * 4 + relabel[board % 4]
+
+
+# Every pair of cards, and the bit mask of its cards
+ALL_PAIRS = np.array(list(combinations(range(52), 2)), dtype=np.uint8)
+ALL_PAIR_MASKS = (np.int64(1) << ALL_PAIRS[:, 0].astype(np.int64)) | (np.int64(1) << ALL_PAIRS[:, 1].astype(np.int64))
+
+
+def river_equities(players: np.ndarray, boards: np.ndarray, tie_value: float = 0.5) -> np.ndarray:
+    """
+    Exact equity of every row of `players` (N, 2) on the complete board of the same row of `boards` (N, 5), against
+    the 990 opponent hands of the cards that are left, ranked with `evaluate_batch` for `RUNOUTS_PER_BATCH` rows at a
+    time.
+    """
+    players, boards = np.asarray(players, dtype=np.uint8), np.asarray(boards, dtype=np.uint8)
+    result = np.empty(len(players))
+    for start in range(0, len(players), RUNOUTS_PER_BATCH):
+        player, board = players[start : start + RUNOUTS_PER_BATCH], boards[start : start + RUNOUTS_PER_BATCH]
+        n = len(player)
+        masks = (np.int64(1) << np.concatenate([player, board], axis=1).astype(np.int64)).sum(axis=1)
+        rows, opponents = np.nonzero((masks[:, None] & ALL_PAIR_MASKS[None, :]) == 0)
+
+        hands = np.empty((n + len(rows), 7), dtype=np.uint8)
+        hands[:n, :5] = board
+        hands[:n, 5:] = player
+        hands[n:, :5] = board[rows]
+        hands[n:, 5:] = ALL_PAIRS[opponents]
+        ranks = evaluate_batch(hands)
+
+        player_ranks, opponent_ranks = ranks[:n], ranks[n:]
+        wins = np.bincount(rows, weights=opponent_ranks > player_ranks[rows], minlength=n)
+        ties = np.bincount(rows, weights=opponent_ranks == player_ranks[rows], minlength=n)
+        result[start : start + n] = (wins + tie_value * ties) / (len(rows) // n)
+    return result
+
+
+def next_card_equities(hands: np.ndarray, tie_value: float = 0.5) -> np.ndarray:
+    """
+    Exact equity after every possible next card, for every row of `hands`: hole cards + flop (N, 5), or hole cards +
+    turn (N, 6). Returns (N, 47) turn equities, each over all its rivers, or (N, 46) river equities.
+    """
+    hands = np.asarray(hands, dtype=np.uint8)
+    n, n_cards = hands.shape
+    assert n_cards in [5, 6]
+    left = np.ones((n, 52), dtype=bool)
+    left[np.arange(n)[:, None], hands] = False
+    deck = np.nonzero(left)[1].reshape(n, 52 - n_cards).astype(np.uint8)
+
+    if n_cards == 6:
+        boards = np.concatenate([np.repeat(hands[:, 2:], 46, axis=0), deck.reshape(-1, 1)], axis=1)
+        return river_equities(np.repeat(hands[:, :2], 46, axis=0), boards, tie_value).reshape(n, 46)
+
+    # Flop: every pair of turn and river once, then the turn equity is the mean over the pairs with the turn card
+    first, second = np.triu_indices(47, 1)
+    boards = np.concatenate(
+        [np.repeat(hands[:, 2:], len(first), axis=0), deck[:, first].reshape(-1, 1), deck[:, second].reshape(-1, 1)],
+        axis=1,
+    )
+    pair_equities = river_equities(np.repeat(hands[:, :2], len(first), axis=0), boards, tie_value).reshape(n, -1)
+    incidence = np.zeros((len(first), 47))
+    incidence[np.arange(len(first)), first] = 1
+    incidence[np.arange(len(first)), second] = 1
+    return pair_equities @ incidence / 46
+
+
+def exact_equities(hands: np.ndarray, tie_value: float = 0.5) -> np.ndarray:
+    """Exact equity of every row of `hands`: hole cards + flop (N, 5), turn (N, 6) or river (N, 7)."""
+    hands = np.asarray(hands, dtype=np.uint8)
+    if hands.shape[1] == 7:
+        return river_equities(hands[:, :2], hands[:, 2:], tie_value)
+    # On the flop, every turn equity is the mean over the same number of rivers, so this is the mean over the runouts
+    return next_card_equities(hands, tie_value).mean(axis=1)
+
+
+def equity_distributions(hands: np.ndarray, bins: int, tie_value: float = 0.5) -> np.ndarray:
+    """
+    Exact equity distributions of the rows of `hands` (see `next_card_equities`): the histogram of the equity over
+    the next card, like `abstraction.calculate_equity_distribution` with every next card instead of samples.
+    """
+    equities = next_card_equities(hands, tie_value)
+    bin_ids = np.minimum((equities * bins).astype(np.int64), bins - 1)
+    histograms = np.zeros((len(equities), bins))
+    np.add.at(histograms, (np.arange(len(equities))[:, None], bin_ids), 1)
+    return histograms / equities.shape[1]
+
+
+def exact_runouts(deck: np.ndarray, n_cards: int):
+    """All the runouts of `n_cards` cards of `deck`, with equal weights."""
+    weight = 1 / math.comb(len(deck), n_cards)
+    for runout in combinations(deck.tolist(), n_cards):
+        yield list(runout), weight
+
+
+def stratified_runouts(deck: np.ndarray, n_cards: int, n_runouts: int, rng: np.random.Generator):
+    """
+    `n_runouts` runouts of `n_cards` cards of `deck`, stratified by their first card. The strata have the same size, so
+    every stratum that is sampled gets the same weight, shared by its runouts.
+    """
+    counts = np.full(len(deck), n_runouts // len(deck))
+    counts[rng.choice(len(deck), n_runouts % len(deck), replace=False)] += 1
+    n_strata = np.count_nonzero(counts)
+    for first in np.flatnonzero(counts):
+        rest = np.delete(deck, first)
+        for _ in range(counts[first]):
+            others = rng.choice(rest, n_cards - 1, replace=False).tolist()
+            yield [int(deck[first])] + others, 1 / (n_strata * counts[first])
+
+
+def equity(
+    player_cards: List[str],
+    community_cards: List[str] = [],
+    mode: str = "auto",
+    n_runouts: int = DEFAULT_RUNOUTS,
+    seed: int = 0,
+    tie_value: float = 0.5,
+) -> float:
+    """
+    Probability that `player_cards` win against a random opponent hand, given the `community_cards` (0, 3, 4 or 5).
+
+    mode: "exact", "stratified" or "auto", see the module
+    n_runouts: number of runouts that "stratified" samples
+    tie_value: value of a tie, 0.5 for the usual equity
+    """
+    assert mode in ["auto", "exact", "stratified"]
+    assert len(player_cards) == 2 and len(community_cards) in [0, 3, 4, 5]
+    player, board = canonical_suits(
+        card_ids(player_cards).astype(np.int64), card_ids(community_cards).astype(np.int64)
+    )
+    deck = np.setdiff1d(np.arange(52), np.concatenate([player, board]))
+    n_cards = 5 - len(board)
+
+    if n_cards == 0 or mode == "exact" or (mode == "auto" and math.comb(len(deck), n_cards) <= n_runouts):
+        runouts = exact_runouts(deck, n_cards)
+    else:
+        runouts = stratified_runouts(deck, n_cards, n_runouts, np.random.default_rng(seed))
+
+    total = 0.0
+    while True:
+        batch = list(islice(runouts, RUNOUTS_PER_BATCH))
+        if not batch:
+            return total
+        boards = np.array([list(board) + runout for runout, _ in batch], dtype=np.uint8)
+        equities = river_equities(np.tile(player, (len(batch), 1)), boards, tie_value)
+        total += float(np.dot([weight for _, weight in batch], equities))
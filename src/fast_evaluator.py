@@ -51,3 +51,99 @@ def get_player_score(player_cards, board=[]):
     assert len(board) <= 5
     # Returns a score using the phevaluator library
     return evaluate_cards(*(player_cards + board))
+
+
+# ----- Vectorized evaluation of batches of 7-card hands -----
+"""
+`evaluate_batch` ranks an (N, 7) array of card ids with the same ranks as `phevaluator` (1 = royal flush, ...,
+7462 = 7-5-4-3-2 high card), with a few NumPy operations on the whole batch instead of a Python call per hand:
+- A hand with 5 or more cards of a suit can only be a flush or a straight flush, whose rank only depends on the
+  ranks of the cards of that suit: `flush_ranks[13-bit mask of those ranks]`. The suits are counted in the 4-bit
+  nibbles of the sum of 16^suit over the cards.
+- Else, the rank only depends on the multiset of the 7 ranks, whose key is the sum of 5^rank over the cards (the
+  counts of the ranks in base 5). Its low 7 digits (ranks 2 to 8) and high 6 digits (ranks 9 to A) are mapped to
+  dense indices by `low_index` and `high_index`, and `noflush_ranks[low, high]` is the rank of the multiset.
+The tables (10MB) are computed once with `phevaluator`, saved in `TABLE_DIRECTORY` and memory-mapped.
+"""
+import os
+from functools import lru_cache
+from itertools import combinations_with_replacement
+
+TABLE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluator_tables")
+TABLE_NAMES = ["flush_ranks", "low_index", "high_index", "noflush_ranks"]
+RANKS = "23456789TJQKA"
+SUITS = "cdhs"
+CARD_IDS = {rank + suit: 4 * r + s for r, rank in enumerate(RANKS) for s, suit in enumerate(SUITS)}
+RANK_KEYS = 5 ** (np.arange(52, dtype=np.int64) // 4)  # 5^rank of every card id
+SUIT_KEYS = np.int64(1) << (4 * (np.arange(52, dtype=np.int64) % 4))  # 16^suit of every card id
+LOW_DIGITS = 5**7
+
+
+def card_ids(cards) -> np.ndarray:
+    """Card ids (`rank * 4 + suit`, like `phevaluator`) of a list, or nested lists, of cards like "Ah"."""
+    cards = np.asarray(cards)
+    return np.fromiter((CARD_IDS[card] for card in cards.ravel()), dtype=np.uint8, count=cards.size).reshape(
+        cards.shape
+    )
+
+
+def generate_rank_tables(directory=TABLE_DIRECTORY):
+    flush_ranks = np.zeros(2**13, dtype=np.int16)
+    for mask in range(2**13):
+        ranks = [rank for rank in range(13) if mask >> rank & 1]
+        if 5 <= len(ranks) <= 7:
+            flush_ranks[mask] = evaluate_cards(*[4 * rank for rank in ranks])  # All clubs
+
+    keys, ranks_of_keys = [], []
+    for ranks in combinations_with_replacement(range(13), 7):
+        if max(ranks.count(rank) for rank in set(ranks)) > 4:
+            continue
+        # Consecutive suits: the cards of a rank have different suits, and no suit has more than 2 cards
+        keys.append(int(RANK_KEYS[4 * np.array(ranks)].sum()))
+        ranks_of_keys.append(evaluate_cards(*[4 * rank + i % 4 for i, rank in enumerate(ranks)]))
+    keys = np.array(keys, dtype=np.int64)
+
+    low_keys, low = np.unique(keys % LOW_DIGITS, return_inverse=True)
+    high_keys, high = np.unique(keys // LOW_DIGITS, return_inverse=True)
+    low_index = np.zeros(LOW_DIGITS, dtype=np.int16)
+    low_index[low_keys] = np.arange(len(low_keys))
+    high_index = np.zeros(5**6, dtype=np.int16)
+    high_index[high_keys] = np.arange(len(high_keys))
+    noflush_ranks = np.zeros((len(low_keys), len(high_keys)), dtype=np.int16)
+    noflush_ranks[low.ravel(), high.ravel()] = ranks_of_keys
+
+    os.makedirs(directory, exist_ok=True)
+    for name, table in zip(TABLE_NAMES, [flush_ranks, low_index, high_index, noflush_ranks]):
+        np.save(os.path.join(directory, f"{name}.npy"), table)
+
+
+@lru_cache(maxsize=None)
+def load_rank_tables(directory=TABLE_DIRECTORY):
+    """(flush_ranks, low_index, high_index, noflush_ranks), generated on the first call."""
+    if not all(os.path.exists(os.path.join(directory, f"{name}.npy")) for name in TABLE_NAMES):
+        generate_rank_tables(directory)
+    return tuple(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in TABLE_NAMES)
+
+
+def evaluate_batch(cards) -> np.ndarray:
+    """
+    Ranks of the rows of an (N, 7) array of card ids, lower is better, like `phevaluator.evaluate_cards` on every row.
+    """
+    cards = np.asarray(cards)
+    assert cards.ndim == 2 and cards.shape[1] == 7, "evaluate_batch takes an (N, 7) array of card ids"
+    flush_ranks, low_index, high_index, noflush_ranks = load_rank_tables()
+
+    rank_keys, suit_keys = RANK_KEYS[cards[:, 0]], SUIT_KEYS[cards[:, 0]]
+    for i in range(1, 7):  # Faster than a sum over the axis of length 7
+        rank_keys += RANK_KEYS[cards[:, i]]
+        suit_keys += SUIT_KEYS[cards[:, i]]
+    result = noflush_ranks[low_index[rank_keys % LOW_DIGITS], high_index[rank_keys // LOW_DIGITS]].astype(np.int32)
+
+    flushes = np.flatnonzero((suit_keys + 0x3333) & 0x8888)  # A nibble of 5 or more
+    if len(flushes) > 0:
+        flush_cards = cards[flushes].astype(np.int64)
+        flush_suits = np.argmax(((suit_keys[flushes, None] >> np.arange(0, 16, 4)) & 15) >= 5, axis=1)
+        in_suit = (flush_cards & 3) == flush_suits[:, None]
+        masks = ((np.int64(1) << (flush_cards >> 2)) * in_suit).sum(axis=1)
+        result[flushes] = flush_ranks[masks]
+    return result
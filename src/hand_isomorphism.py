@@ -0,0 +1,269 @@
+"""
+Suit isomorphism of post-flop hands: a dense canonical index of (hole cards, board) on every street, and its inverse.
+
+Two hands are isomorphic when a permutation of the suits maps one to the other, ex: AhKh|2h7c9d and AsKs|2s7c9d. They
+have the same equity, equity distribution and cluster, so the abstraction only needs one computation per class:
+
+    street      cards per round     hands               classes
+    pre-flop    [2]                 1,326               169
+    flop        [2, 3]              25,989,600          1,286,792
+    turn        [2, 4]              305,377,800         13,960,050
+    river       [2, 5]              2,809,475,760       123,156,254
+
+The board is a single round: the order in which its cards were dealt does not change the equity, nor the cluster.
+(With the turn and river as rounds of their own, [2, 3, 1, 1], there would be 2,428,287,420 river classes.)
+
+The index follows the algorithm of Waugh (2013), "A Fast and Optimal Hand Isomorphism Algorithm":
+- The cards of a suit in every round are a set of ranks. The "configuration" of a suit is the number of its cards in
+  every round, and its "suit index" is the mixed-radix combination of the colex indices of its rank sets, each among
+  the ranks that the suit has not used in the previous rounds.
+- The suits are sorted by (configuration, suit index). The sorted configurations of the 4 suits are the
+  configuration of the hand, and the hands of a configuration are numbered from `offsets[configuration]`.
+- The suits with the same configuration can be permuted, so their sorted suit indices are a multiset, indexed with
+  the colex index of combinations with repetition. The multisets of the groups of suits are combined in mixed radix.
+`unindex` inverts every step, and returns the canonical hand of the class: the suits get the labels c, d, h, s in
+sorted order, and the cards of every round are sorted.
+
+`HandIndexer.index` and `HandIndexer.unindex` work on batches (arrays of card ids, see `fast_evaluator.card_ids`), one
+configuration at a time, so computing a table over all the classes of a street is a loop over chunks of indices.
+"""
+
+from functools import lru_cache
+from itertools import combinations, product
+from math import comb
+from typing import List
+
+import numpy as np
+
+from fast_evaluator import card_ids, RANKS, SUITS
+
+N_RANKS = 13
+N_SUITS = 4
+ROUNDS = {"preflop": [2], "flop": [2, 3], "turn": [2, 4], "river": [2, 5]}
+
+# Binomial coefficients C(n, k) for n, k <= 13
+BINOMIALS = np.array([[comb(n, k) for k in range(N_RANKS + 1)] for n in range(N_RANKS + 1)], dtype=np.int64)
+POPCOUNT = np.array([bin(mask).count("1") for mask in range(2**N_RANKS)], dtype=np.int64)
+# NTH_RANK[mask, p] = rank of the p-th (from 0) set bit of `mask`
+NTH_RANK = np.zeros((2**N_RANKS, N_RANKS), dtype=np.int64)
+for _mask in range(2**N_RANKS):
+    _ranks = [rank for rank in range(N_RANKS) if _mask >> rank & 1]
+    NTH_RANK[_mask, : len(_ranks)] = _ranks
+
+
+def binomial(n: np.ndarray, k: int) -> np.ndarray:
+    """C(n, k) of every element of `n`, exact in int64 for the small k of the indexer."""
+    result = np.ones_like(n, dtype=np.int64)
+    for i in range(k):  # Every partial product is a binomial coefficient, so the divisions are exact
+        result = result * (n - i) // (i + 1)
+    return np.where(n >= k, result, 0)
+
+
+@lru_cache(maxsize=None)
+def colex_combinations(k: int) -> np.ndarray:
+    """The k-subsets of the 13 positions, as rows of sorted positions, in colex order (row i has colex index i)."""
+    subsets = sorted(combinations(range(N_RANKS), k), key=lambda s: sum(comb(p, j + 1) for j, p in enumerate(s)))
+    return np.array(subsets, dtype=np.int64).reshape(len(subsets), k)
+
+
+@lru_cache(maxsize=None)
+def _binomial_column(n_max: int, k: int) -> np.ndarray:
+    return binomial(np.arange(n_max, dtype=np.int64), k)
+
+
+def colex_index(increasing: np.ndarray) -> np.ndarray:
+    """Colex index of the rows of strictly increasing integers of `increasing`."""
+    return sum(binomial(increasing[:, j], j + 1) for j in range(increasing.shape[1]))
+
+
+def colex_unindex(index: np.ndarray, n_max: int, k: int) -> np.ndarray:
+    """Inverse of `colex_index`, for k-subsets of the integers below `n_max`."""
+    result = np.zeros((len(index), k), dtype=np.int64)
+    remaining = index.copy()
+    for j in range(k, 0, -1):
+        values = _binomial_column(n_max, j)
+        result[:, j - 1] = np.searchsorted(values, remaining, side="right") - 1
+        remaining -= values[result[:, j - 1]]
+    return result
+
+
+class HandIndexer:
+    def __init__(self, cards_per_round: List[int]):
+        """cards_per_round: ex: [2, 3] for the hole cards and the flop"""
+        assert all(0 < n <= 7 for n in cards_per_round), "The rounds have 1 to 7 cards"
+        self.cards_per_round = list(cards_per_round)
+        self.n_rounds = len(cards_per_round)
+        self.n_cards = sum(cards_per_round)
+        self.round_of_card = np.repeat(np.arange(self.n_rounds), cards_per_round)
+        self.suit_key_base = 8**self.n_rounds  # The configuration of a hand is its 4 suit keys in this base
+
+        # All the configurations of the 4 suits, sorted in decreasing order, with their groups of equal suits
+        per_round = [
+            [split for split in product(range(n + 1), repeat=N_SUITS) if sum(split) == n] for n in cards_per_round
+        ]
+        configurations = set()
+        for splits in product(*per_round):
+            suits = [tuple(split[s] for split in splits) for s in range(N_SUITS)]
+            if all(sum(suit) <= N_RANKS for suit in suits):
+                configurations.add(tuple(sorted((self._suit_key(suit) for suit in suits), reverse=True)))
+        self.configuration_keys = np.array(sorted(self._configuration_key(c) for c in configurations), dtype=np.int64)
+        self.configurations = [self._decode_configuration(key) for key in self.configuration_keys]
+
+        self.groups = []  # For every configuration: (first suit, number of suits, number of suit indices) per group
+        sizes = []
+        for suit_keys in self.configurations:
+            groups, size, s = [], 1, 0
+            while s < N_SUITS:
+                k = 1
+                while s + k < N_SUITS and suit_keys[s + k] == suit_keys[s]:
+                    k += 1
+                m = self.suit_size(self._decode_suit(suit_keys[s]))
+                groups.append((s, k, m))
+                size *= comb(m + k - 1, k)
+                s += k
+            self.groups.append(groups)
+            sizes.append(size)
+        self.sizes = np.array(sizes, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+
+    # ---------- Configurations ----------
+    def _suit_key(self, counts) -> int:
+        """Cards of a suit in every round, in base 8."""
+        return sum(n * 8**r for r, n in enumerate(counts))
+
+    def _decode_suit(self, key: int) -> List[int]:
+        return [key // 8**r % 8 for r in range(self.n_rounds)]
+
+    def _configuration_key(self, suit_keys) -> int:
+        return sum(key * self.suit_key_base**s for s, key in enumerate(suit_keys))
+
+    def _decode_configuration(self, key: int) -> List[int]:
+        return [int(key) // self.suit_key_base**s % self.suit_key_base for s in range(N_SUITS)]
+
+    def suit_size(self, counts: List[int]) -> int:
+        size, used = 1, 0
+        for n in counts:
+            size *= comb(N_RANKS - used, n)
+            used += n
+        return size
+
+    def size(self) -> int:
+        """Number of classes."""
+        return int(self.offsets[-1])
+
+    # ---------- Index ----------
+    def index(self, cards) -> np.ndarray:
+        """
+        Canonical indices of a batch of hands: an (N, n_cards) array of card ids, the hole cards then the board in
+        the order it was dealt. A single hand can also be given as a list of cards like "Ah", and gets an int.
+        """
+        if isinstance(cards, (list, tuple)) and len(cards) > 0 and isinstance(cards[0], str):
+            return int(self.index(card_ids([cards]))[0])
+        cards = np.asarray(cards, dtype=np.int64)
+        assert cards.ndim == 2 and cards.shape[1] == self.n_cards
+        ranks, suits = cards >> 2, cards & 3
+        rank_bits = np.int64(1) << ranks
+        below = rank_bits - 1
+
+        # Rank sets of every suit in every round
+        rank_sets = np.zeros((len(cards), N_SUITS, self.n_rounds), dtype=np.int64)
+        for c, r in enumerate(self.round_of_card):
+            for s in range(N_SUITS):
+                rank_sets[:, s, r] |= np.where(suits[:, c] == s, rank_bits[:, c], 0)
+
+        # Configuration and suit index of every suit
+        suit_keys = np.zeros((len(cards), N_SUITS), dtype=np.int64)
+        suit_indices = np.zeros((len(cards), N_SUITS), dtype=np.int64)
+        multipliers = np.ones((len(cards), N_SUITS), dtype=np.int64)
+        used = np.zeros((len(cards), N_SUITS), dtype=np.int64)
+        for r in range(self.n_rounds):
+            counts = POPCOUNT[rank_sets[:, :, r]]
+            suit_keys += counts * 8**r
+            available = (2**N_RANKS - 1) & ~used
+            for c in np.flatnonzero(self.round_of_card == r):
+                for s in range(N_SUITS):
+                    in_suit = suits[:, c] == s
+                    position = POPCOUNT[available[:, s] & below[:, c]]
+                    order = POPCOUNT[rank_sets[:, s, r] & below[:, c]]
+                    suit_indices[:, s] += np.where(in_suit, multipliers[:, s] * BINOMIALS[position, order + 1], 0)
+            multipliers *= BINOMIALS[POPCOUNT[available], counts]
+            used |= rank_sets[:, :, r]
+
+        # Sort the suits by (configuration, suit index), in decreasing order
+        order = np.argsort(-(suit_keys * 2**32 + suit_indices), axis=1, kind="stable")
+        suit_keys = np.take_along_axis(suit_keys, order, axis=1)
+        suit_indices = np.take_along_axis(suit_indices, order, axis=1)
+        configuration_keys = (suit_keys * self.suit_key_base ** np.arange(N_SUITS)).sum(axis=1)
+        configurations = np.searchsorted(self.configuration_keys, configuration_keys)
+
+        result = self.offsets[configurations].copy()
+        for configuration in np.unique(configurations):
+            rows = np.flatnonzero(configurations == configuration)
+            local, multiplier = np.zeros(len(rows), dtype=np.int64), 1
+            for s, k, m in self.groups[configuration]:
+                # Multiset of k suit indices b_1 <= ... <= b_k: colex index of the strictly increasing b_j + j - 1
+                group_index = colex_index(suit_indices[rows, s : s + k][:, ::-1] + np.arange(k))
+                local += multiplier * group_index
+                multiplier *= comb(m + k - 1, k)
+            result[rows] += local
+        return result
+
+    # ---------- Unindex ----------
+    def unindex(self, indices) -> np.ndarray:
+        """
+        Canonical hands of a batch of indices, as an (N, n_cards) array of card ids. A single index gives a list of
+        cards like "Ah".
+        """
+        if np.isscalar(indices):
+            hand = self.unindex(np.array([indices]))[0]
+            return [RANKS[card >> 2] + SUITS[card & 3] for card in hand]
+        indices = np.asarray(indices, dtype=np.int64)
+        assert ((0 <= indices) & (indices < self.size())).all()
+        configurations = np.searchsorted(self.offsets, indices, side="right") - 1
+        hands = np.zeros((len(indices), self.n_cards), dtype=np.uint8)
+
+        for configuration in np.unique(configurations):
+            rows = np.flatnonzero(configurations == configuration)
+            local = indices[rows] - self.offsets[configuration]
+            suit_indices = np.zeros((len(rows), N_SUITS), dtype=np.int64)
+            for s, k, m in self.groups[configuration]:
+                size = comb(m + k - 1, k)
+                group_index, local = local % size, local // size
+                suit_indices[:, s : s + k] = (colex_unindex(group_index, m + k - 1, k) - np.arange(k))[:, ::-1]
+
+            # Rank sets of every suit, round by round, dealt in the order of the suits
+            slots = np.cumsum([0] + self.cards_per_round)
+            filled = np.zeros(self.n_rounds, dtype=np.int64)
+            for s, suit_key in enumerate(self.configurations[configuration]):
+                used, n_used = np.zeros(len(rows), dtype=np.int64), 0
+                remaining = suit_indices[:, s]
+                for r, n in enumerate(self._decode_suit(suit_key)):
+                    available = (2**N_RANKS - 1) & ~used
+                    size = comb(N_RANKS - n_used, n)
+                    colex, remaining = remaining % size, remaining // size
+                    for position in colex_combinations(n)[colex].T:
+                        rank = NTH_RANK[available, position]
+                        hands[rows, slots[r] + filled[r]] = 4 * rank + s
+                        used |= np.int64(1) << rank
+                        filled[r] += 1
+                    n_used += n
+
+        for r in range(self.n_rounds):  # Sort the cards of every round
+            start, end = sum(self.cards_per_round[:r]), sum(self.cards_per_round[: r + 1])
+            hands[:, start:end] = np.sort(hands[:, start:end], axis=1)
+        return hands
+
+    def canonicalize(self, cards) -> List[str]:
+        """The canonical hand of the class of `cards`, a list of cards like "Ah"."""
+        return self.unindex(self.index(cards))
+
+
+@lru_cache(maxsize=None)
+def get_indexer(street: str) -> HandIndexer:
+    """The indexer of "preflop", "flop", "turn" or "river"."""
+    return HandIndexer(ROUNDS[street])
+
+
+def street_of(cards) -> str:
+    """The street of a hand of hole cards and board, from its number of cards (2, 5, 6 or 7)."""
+    return {2: "preflop", 5: "flop", 6: "turn", 7: "river"}[len(cards)]
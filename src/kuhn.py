@@ -15,27 +15,27 @@ class KuhnHistory(base.History):
     """
 
     def __init__(self, history: List[Action] = []):
-        super().__init__(history)
+        # Derived state, carried forward by `advance`
+        self.terminal = False
+        self.infoSet_keys = ((), ())  # infoset key of each player, with the card of the opponent hidden
+        self.replay(history)
 
-    def is_terminal(self):
+    def advance(self, action: Action):
         plays = len(self.history)
-
-        if plays > 3:
-            player_card = self.history[0]
-            opponent_card = self.history[1]
-
-            assert player_card in ["1", "2", "3"]
-            assert opponent_card in ["1", "2", "3"]
-            assert player_card != opponent_card
-
-            terminalPass = self.history[-1] == "p"
+        key_0, key_1 = self.infoSet_keys
+        if plays == 1:
+            self.infoSet_keys = (key_0 + (action,), key_1 + ("?",))
+        elif plays == 2:
+            assert action in ["1", "2", "3"] and action != self.history[0]
+            self.infoSet_keys = (key_0 + ("?",), key_1 + (action,))
+        else:
+            self.infoSet_keys = (key_0 + (action,), key_1 + (action,))
+            terminalPass = action == "p"
             doubleBet = self.history[-2:] == ["b", "b"]
+            self.terminal = plays > 3 and (terminalPass or doubleBet)
 
-            if terminalPass or doubleBet:
-                return True
-
-            else:
-                return False
+    def is_terminal(self):
+        return self.terminal
 
     def actions(self):
         if self.is_chance():
@@ -90,23 +90,14 @@ class KuhnHistory(base.History):
         else:
             return 2 if is_player_winner else -2
 
-    def __add__(self, action: Action):
-        new_history = KuhnHistory(self.history + [action])
-        return new_history
-
     def get_infoSet_key(self) -> List[Action]:
         assert not self.is_chance()  # chance history should not be infosets
         assert not self.is_terminal()  # terminal history is not an infoset
 
-        player = self.player()
-        if player == 0:
-            history = copy.deepcopy(self.history)
-            history[1] = "?"  # Unknown card
-            return history
-        else:
-            history = copy.deepcopy(self.history)
-            history[0] = "?"  # Unknown card
-            return history
+        return list(self.infoSet_keys[self.player()])
+
+    def get_infoSet_id(self):
+        return self.infoSet_keys[self.player()]
 
 
 class KuhnInfoSet(base.InfoSet):
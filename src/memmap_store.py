@@ -0,0 +1,401 @@
+"""
+An `ArrayInfoSetStore` on disk, for abstractions that do not fit in RAM, see
+`CFR(backend="array", spill_directory=...)`.
+
+Nothing that grows with the number of infosets stays in the memory of the process:
+- The regrets, strategies, cumulative strategies, the per-infoset arrays and the id index (`id_rows`) are `np.memmap`s
+  of files in `spill_directory`, so all the code written for the array backend (the traversals, `batched_cfr.py`,
+  checkpoints, exports) runs unchanged.
+- The key index is an SQLite table of (row, key) in `spill_directory`, indexed both ways, that `ids` and
+  `infoSet_keys` read and write. SQLite keeps at most `KEY_CACHE_MB` of it in memory. With integer infoset ids (ex:
+  `create_compiled_history`), the traversals find the infosets with `id_rows`, and the keys are only read when an
+  infoset is created or exported. Tuple ids (ex: `create_history`) are not indexed, so their infosets are found by
+  their key every time.
+- The actions of an infoset are the number of its action set in `action_set_ids`. Only the distinct action sets are
+  kept in memory.
+
+The pages of the files are a cache of infosets, evicted by recency:
+- The rows are grouped in blocks of `BLOCK_ROWS` infosets (and the id index in blocks of `BLOCK_IDS` ids). Every time
+  an infoset is found or created, its blocks are marked as used at the current `clock`.
+- `flush` writes the modified pages back to the files (ex: every `tracker_interval`), and increments the clock. With
+  `resident_limit_mb`, it also keeps the pages of the most recently used blocks that fit in the limit, and releases
+  all the other pages of the files from the process (`madvise(MADV_DONTNEED)`). So right after a flush, at most
+  `resident_limit_mb` of the files are resident. The pages stay in the page cache until the kernel needs the memory,
+  and the infosets that are used again are read back from there or from the disk.
+"""
+
+import mmap
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from base import Action, ArrayInfoSetStore
+
+# Arrays with an entry per infoset (besides `offsets`), and their dtype. The ones with an entry per action have the
+# dtype of the store.
+INFOSET_ARRAYS = {"players": np.int8, "last_update": np.int32, "dirty": bool, "action_set_ids": np.int32}
+ACTION_ARRAYS = ["regret", "strategy", "cumulative_strategy"]
+MAPPED_ARRAYS = ["offsets", *INFOSET_ARRAYS, *ACTION_ARRAYS, "id_rows"]
+
+BLOCK_ROWS = 4096
+BLOCK_IDS = 16384
+KEY_CACHE_MB = 16
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def _array_store_from_state(state: dict) -> ArrayInfoSetStore:
+    store = ArrayInfoSetStore.__new__(ArrayInfoSetStore)
+    store.__dict__.update(state)
+    return store
+
+
+def _grown(used: np.ndarray, length: int) -> np.ndarray:
+    """`used` with at least `length` entries, the new ones never used (-1)."""
+    if length <= len(used):
+        return used
+    return np.concatenate((used, np.full(max(length - len(used), len(used)), -1, dtype=np.int64)))
+
+
+def _page_spans(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Bytes of the pages of the byte ranges `starts` to `ends`."""
+    return (-(-ends // PAGE_SIZE) - starts // PAGE_SIZE) * PAGE_SIZE
+
+
+def _released_runs(kept: np.ndarray):
+    """
+    Starts and ends (excluded) of the runs of consecutive blocks that are not kept. The last run ends at
+    len(kept) + 1, for the rest of the file after the blocks.
+    """
+    edges = np.diff(np.concatenate(([1], kept.astype(np.int8), [0, 1])))
+    return np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
+
+
+class KeyIndex:
+    """
+    The `ids` of a `MemmapInfoSetStore`: a dict of infoset key -> row, in an SQLite table on disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # The table is rebuilt from scratch if the process stops, so it does not need a journal
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute(f"PRAGMA cache_size = -{KEY_CACHE_MB * 1024}")
+        self.connection.execute("DROP TABLE IF EXISTS keys")
+        self.connection.execute("CREATE TABLE keys (row INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE)")
+        self.length = 0
+
+    def get(self, infoSet_key: str, default=None):
+        result = self.connection.execute("SELECT row FROM keys WHERE key = ?", (infoSet_key,)).fetchone()
+        return default if result is None else result[0]
+
+    def key(self, row: int) -> str:
+        result = self.connection.execute("SELECT key FROM keys WHERE row = ?", (int(row),)).fetchone()
+        if result is None:
+            raise IndexError(row)
+        return result[0]
+
+    def __getitem__(self, infoSet_key: str) -> int:
+        row = self.get(infoSet_key)
+        if row is None:
+            raise KeyError(infoSet_key)
+        return row
+
+    def __setitem__(self, infoSet_key: str, row: int):
+        self.connection.execute("INSERT INTO keys VALUES (?, ?)", (int(row), infoSet_key))
+        self.length += 1
+
+    def __contains__(self, infoSet_key) -> bool:
+        return self.get(infoSet_key) is not None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def items(self):
+        """(key, row) pairs in the order of the rows, read by pages so they are never all in memory."""
+        row = -1
+        while True:
+            page = self.connection.execute(
+                "SELECT key, row FROM keys WHERE row > ? ORDER BY row LIMIT 4096", (row,)
+            ).fetchall()
+            if not page:
+                return
+            yield from page
+            row = page[-1][1]
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class KeyList:
+    """The `infoSet_keys` of a `MemmapInfoSetStore`: the keys of `KeyIndex` by row."""
+
+    def __init__(self, index: KeyIndex):
+        self.index = index
+
+    def __getitem__(self, row: int) -> str:
+        return self.index.key(row)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+class ActionSetList:
+    """The `action_sets` of a `MemmapInfoSetStore`: the distinct action set of `action_set_ids` of every row."""
+
+    def __init__(self, store: "MemmapInfoSetStore"):
+        self.store = store
+
+    def __getitem__(self, row: int) -> List[Action]:
+        return self.store.distinct_action_sets[self.store.action_set_ids[row]]
+
+    def __len__(self) -> int:
+        return self.store.n_infoSets
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class MemmapInfoSetStore(ArrayInfoSetStore):
+    def __init__(
+        self, directory: str, dtype=np.float64, capacity: int = 1024, resident_limit_mb: Optional[float] = None
+    ):
+        self.directory = directory
+        self.resident_limit_mb = resident_limit_mb
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(dtype=dtype, capacity=capacity)
+        self.action_set_ids = np.zeros(capacity, dtype=np.int32)
+        self.id_rows = np.zeros(BLOCK_IDS, dtype=np.int32)  # Row + 1 of every id, 0 if not indexed yet
+        self._map_arrays(capacity)
+
+        self.ids = KeyIndex(self._path("keys", "sqlite"))
+        self.infoSet_keys = KeyList(self.ids)
+        self.action_sets = ActionSetList(self)
+        self.distinct_action_sets: List[List[Action]] = []
+        self.action_set_numbers: Dict[tuple, int] = {}
+
+        # Last value of `clock` at which every block of rows / ids was used, and the first action of every block
+        self.clock = 0
+        self.rows_used = np.full(0, -1, dtype=np.int64)
+        self.ids_used = np.full(0, -1, dtype=np.int64)
+        self.block_action_starts = np.zeros(0, dtype=np.int64)
+
+    def _path(self, name: str, extension: str = "dat") -> str:
+        return os.path.join(self.directory, f"{name}_{os.getpid()}_{id(self)}.{extension}")
+
+    def _resize(self, name: str, dtype, length: int) -> np.memmap:
+        """Memory-maps the file of `name` with `length` entries, keeping its content."""
+        path = self._path(name)
+        old = getattr(self, name, None)
+        if isinstance(old, np.memmap):
+            old.flush()
+        nbytes = max(length, 1) * np.dtype(dtype).itemsize
+        # A new store starts from an empty file, even if a store that was dropped had the same path
+        with open(path, "ab" if isinstance(old, np.memmap) else "wb") as f:
+            f.truncate(nbytes)
+        array = np.memmap(path, dtype=dtype, mode="r+", shape=(length,))
+        if old is not None and not isinstance(old, np.memmap):  # The arrays of `ArrayInfoSetStore.__init__`
+            array[: len(old)] = old
+        return array
+
+    def _map_arrays(self, capacity: int):
+        self.offsets = self._resize("offsets", np.int64, capacity + 1)
+        for name, dtype in INFOSET_ARRAYS.items():
+            setattr(self, name, self._resize(name, dtype, capacity))
+        for name in ACTION_ARRAYS:
+            setattr(self, name, self._resize(name, self.dtype, 4 * capacity))
+        self.id_rows = self._resize("id_rows", np.int32, len(self.id_rows))
+
+    def _grow(self, n_actions: int):
+        # Same policy as `ArrayInfoSetStore._grow`, the new entries of the files are zeros
+        if self.n_infoSets >= len(self.players):
+            capacity = len(self.players) + max(len(self.players), 1024)
+            self.offsets = self._resize("offsets", np.int64, capacity + 1)
+            for name, dtype in INFOSET_ARRAYS.items():
+                setattr(self, name, self._resize(name, dtype, capacity))
+
+        if self.n_actions + n_actions > len(self.regret):
+            length = len(self.regret) + max(len(self.regret), n_actions)
+            for name in ACTION_ARRAYS:
+                setattr(self, name, self._resize(name, self.dtype, length))
+
+    def _add_key(self, infoSet_key: str, infoSet_id: int, actions: List[Action]):
+        number = self.action_set_numbers.get(tuple(actions))
+        if number is None:
+            number = self.action_set_numbers[tuple(actions)] = len(self.distinct_action_sets)
+            self.distinct_action_sets.append(self._interned_actions.setdefault(tuple(actions), list(actions)))
+        self.action_set_ids[infoSet_id] = number
+        self.ids[infoSet_key] = infoSet_id
+
+        block = infoSet_id // BLOCK_ROWS
+        if block >= len(self.block_action_starts):
+            self.block_action_starts = np.append(self.block_action_starts, self.offsets[infoSet_id])
+        self._use_row(infoSet_id)
+
+    # ----- Recency of the blocks -----
+    def _use_row(self, row: int):
+        block = row // BLOCK_ROWS
+        if block >= len(self.rows_used):
+            self.rows_used = _grown(self.rows_used, block + 1)
+        self.rows_used[block] = self.clock
+
+    def _use_id(self, infoSet_id: int):
+        block = infoSet_id // BLOCK_IDS
+        if block >= len(self.ids_used):
+            self.ids_used = _grown(self.ids_used, block + 1)
+        self.ids_used[block] = self.clock
+
+    def get_infoSet(self, infoSet_key: str, actions: List[Action], player):
+        infoSet = super().get_infoSet(infoSet_key, actions, player)
+        self._use_row(infoSet._id)
+        return infoSet
+
+    def find(self, infoSet_id) -> int:
+        if isinstance(infoSet_id, tuple) or infoSet_id >= len(self.id_rows):
+            return -1
+        self._use_id(infoSet_id)
+        row = int(self.id_rows[infoSet_id]) - 1
+        if row >= 0:
+            self._use_row(row)
+        return row
+
+    def find_rows(self, infoSet_ids: np.ndarray) -> np.ndarray:
+        rows = np.full(len(infoSet_ids), -1, dtype=np.int64)
+        indexed = infoSet_ids < len(self.id_rows)
+        rows[indexed] = self.id_rows[infoSet_ids[indexed]].astype(np.int64) - 1
+        if len(infoSet_ids):
+            self.ids_used = _grown(self.ids_used, int(infoSet_ids.max()) // BLOCK_IDS + 1)
+            self.ids_used[infoSet_ids // BLOCK_IDS] = self.clock
+            self.rows_used[rows[rows >= 0] // BLOCK_ROWS] = self.clock
+        return rows
+
+    def index(self, infoSet_id, row: int):
+        if isinstance(infoSet_id, tuple):  # Found by key, see the module
+            return
+        if infoSet_id >= len(self.id_rows):
+            length = max(2 * len(self.id_rows), -(-(infoSet_id + 1) // BLOCK_IDS) * BLOCK_IDS)
+            self.id_rows = self._resize("id_rows", np.int32, length)
+        self.id_rows[infoSet_id] = row + 1
+        self._use_id(infoSet_id)
+        self._use_row(row)
+
+    # ----- Files -----
+    def mapped_bytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in MAPPED_ARRAYS)
+
+    def _block_bytes(self):
+        """Bytes of the pages of every block of rows, and of every block of ids."""
+        n_blocks = len(self.block_action_starts)
+        starts = np.arange(n_blocks, dtype=np.int64) * BLOCK_ROWS
+        ends = np.minimum(starts + BLOCK_ROWS, self.n_infoSets)
+        action_starts = self.block_action_starts
+        action_ends = np.append(action_starts[1:], self.n_actions)
+
+        row_bytes = _page_spans(8 * starts, 8 * (ends + 1))  # offsets
+        for dtype in INFOSET_ARRAYS.values():
+            itemsize = np.dtype(dtype).itemsize
+            row_bytes += _page_spans(itemsize * starts, itemsize * ends)
+        row_bytes += len(ACTION_ARRAYS) * _page_spans(
+            self.dtype.itemsize * action_starts, self.dtype.itemsize * action_ends
+        )
+        id_bytes = np.full(len(self.ids_used), _page_spans(0, 4 * BLOCK_IDS), dtype=np.int64)
+        return row_bytes, id_bytes
+
+    def _kept_blocks(self):
+        """The most recently used blocks of rows and ids whose pages fit in `resident_limit_mb`."""
+        row_bytes, id_bytes = self._block_bytes()
+        used = np.concatenate((self.rows_used[: len(row_bytes)], self.ids_used))
+        nbytes = np.concatenate((row_bytes, id_bytes))
+        order = np.argsort(-used, kind="stable")
+        order = order[used[order] >= 0]
+        order = order[np.cumsum(nbytes[order]) <= self.resident_limit_mb * 2**20]
+        kept = np.zeros(len(used), dtype=bool)
+        kept[order] = True
+        return kept[: len(row_bytes)], kept[len(row_bytes) :]
+
+    @staticmethod
+    def _release(array: np.memmap, starts: np.ndarray, ends: np.ndarray):
+        """Releases the pages of the byte ranges `starts` to `ends` of `array`, rounded out to whole pages."""
+        length = len(array._mmap)
+        for start, end in zip(starts // PAGE_SIZE * PAGE_SIZE, np.minimum(-(-ends // PAGE_SIZE) * PAGE_SIZE, length)):
+            if end > start:
+                array._mmap.madvise(mmap.MADV_DONTNEED, int(start), int(end - start))
+
+    def _release_blocks(self, kept_rows: np.ndarray, kept_ids: np.ndarray):
+        """Releases all the pages of the files, but the ones of the blocks that are kept."""
+        starts, ends = _released_runs(kept_rows)
+        row_starts = starts * BLOCK_ROWS
+        row_ends = np.where(ends > len(kept_rows), len(self.players), ends * BLOCK_ROWS)
+        self._release(self.offsets, 8 * row_starts, 8 * (row_ends + 1))
+        for name in INFOSET_ARRAYS:
+            array = getattr(self, name)
+            self._release(array, array.itemsize * row_starts, array.itemsize * row_ends)
+        action_bounds = np.append(self.block_action_starts, self.n_actions)
+        for name in ACTION_ARRAYS:
+            array = getattr(self, name)
+            action_ends = np.where(ends > len(kept_rows), len(array), action_bounds[np.minimum(ends, len(kept_rows))])
+            self._release(array, array.itemsize * action_bounds[starts], array.itemsize * action_ends)
+
+        starts, ends = _released_runs(kept_ids)
+        id_ends = np.where(ends > len(kept_ids), len(self.id_rows), ends * BLOCK_IDS)
+        self._release(self.id_rows, 4 * starts * BLOCK_IDS, 4 * id_ends)
+
+    def flush(self):
+        """
+        Writes the modified pages back to the files, and starts a new period of `clock`. With `resident_limit_mb`,
+        also releases the pages of all the blocks but the most recently used ones that fit in the limit.
+        """
+        for name in MAPPED_ARRAYS:
+            getattr(self, name).flush()
+        self.ids.commit()
+        if self.resident_limit_mb is not None and hasattr(mmap, "MADV_DONTNEED"):
+            self._release_blocks(*self._kept_blocks())
+        self.clock += 1
+
+    def empty(self) -> "MemmapInfoSetStore":
+        return MemmapInfoSetStore(self.directory, self.dtype, resident_limit_mb=self.resident_limit_mb)
+
+    def close(self):
+        """Deletes the files of the store. The store cannot be used afterwards."""
+        for name in MAPPED_ARRAYS:
+            path = getattr(self, name).filename
+            setattr(self, name, None)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        self.ids.close()
+
+    def __reduce__(self):
+        # Exported like an `ArrayInfoSetStore` in memory, so the files are not needed to load it
+        state = ArrayInfoSetStore.__getstate__(self)
+        for name in ["offsets", "players", "last_update", "dirty", *ACTION_ARRAYS]:
+            state[name] = np.array(state[name])
+        state["ids"] = {key: row for key, row in self.ids.items()}
+        state["infoSet_keys"] = list(self.infoSet_keys)
+        state["action_sets"] = list(self.action_sets)
+        for name in [
+            "directory",
+            "resident_limit_mb",
+            "action_set_ids",
+            "distinct_action_sets",
+            "action_set_numbers",
+            "clock",
+            "rows_used",
+            "ids_used",
+            "block_action_starts",
+        ]:
+            del state[name]
+        return (_array_store_from_state, (state,))
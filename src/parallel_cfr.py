@@ -0,0 +1,217 @@
+"""
+Multi-process CFR training, see `base.CFR.solve` with `n_workers > 1`.
+
+The sampled deals are split across worker processes, in rounds of `round_size` deals per worker. The arrays of the
+`ArrayInfoSetStore` that training updates are moved to `multiprocessing.shared_memory` once for the whole run (see
+`SharedStore`), and the workers of every round are forked from the main process, so they map the same memory.
+
+- Infosets that already exist are updated in place in the shared arrays, lock-free (Hogwild). Two workers can update
+  the same infoset at the same time, so a few updates can be lost, but CFR does not mind this kind of noise, and
+  all the workers always see the latest regrets.
+- Infosets discovered during the round are stored in a local `ArrayInfoSetStore` of the worker (a worker cannot
+  give ids in the shared arrays without coordinating with the others). At the end of the round, they are sent back
+  to the main process and merged by summing their regrets and cumulative strategies.
+
+As the number of new infosets goes down, almost all the work happens in the shared arrays, without any
+synchronization between the workers. The speed-up with several cores has not been measured yet, see
+`testing/parallel_performance.py`. Only works on platforms that can fork (Linux, macOS).
+"""
+
+import multiprocessing
+import queue
+import random
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+from tqdm import tqdm
+
+from base import CFR, ArrayInfoSet, ArrayInfoSetStore, History
+
+SHARED_ARRAYS = ["last_update", "dirty", "regret", "strategy", "cumulative_strategy"]
+
+
+class HogwildInfoSetStore:
+    """
+    Store of a worker: infosets of the shared store are read and written in place, new infosets go to `overflow`.
+    """
+
+    def __init__(self, shared: ArrayInfoSetStore):
+        self.shared = shared
+        self.overflow = ArrayInfoSetStore(dtype=shared.dtype)
+
+    def get_indexed_infoSet(self, infoSet_id, history: History) -> ArrayInfoSet:
+        row = self.shared.find(infoSet_id)
+        if row < 0:
+            row = self.shared.ids.get("".join(history.get_infoSet_key()), -1)
+            if row < 0:
+                return self.overflow.get_indexed_infoSet(infoSet_id, history)
+            self.shared.index(infoSet_id, row)  # The index is private to the worker, only the tables are shared
+        self.shared.dirty[row] = True
+        return ArrayInfoSet(self.shared, row)
+
+    def __len__(self) -> int:
+        return len(self.shared) + len(self.overflow)
+
+
+class SharedStore:
+    """
+    Keeps the arrays of `SHARED_ARRAYS` of a store in shared memory blocks for the whole run. The arrays are only
+    copied to new blocks when the store reallocated them to grow, which at least doubles their size, so the copies
+    cost O(size of the store) over the whole run instead of every round.
+    """
+
+    def __init__(self, store: ArrayInfoSetStore):
+        self.store = store
+        self.arrays = {}
+        self.blocks = {}
+        self.bytes_copied = 0
+
+    def share(self):
+        """Moves the arrays that are not in shared memory yet (new, or reallocated by `_grow`) to shared memory."""
+        for name in SHARED_ARRAYS:
+            array = getattr(self.store, name)
+            if self.arrays.get(name) is array:
+                continue
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared_array[:] = array
+            self.bytes_copied += array.nbytes
+            self._free(name)
+            setattr(self.store, name, shared_array)
+            self.arrays[name], self.blocks[name] = shared_array, block
+
+    def _free(self, name: str):
+        block = self.blocks.pop(name, None)
+        self.arrays.pop(name, None)
+        if block is not None:
+            block.close()
+            block.unlink()
+
+    def release(self):
+        """Copies the shared arrays back to private memory, and frees the memory blocks."""
+        for name in SHARED_ARRAYS:
+            if self.arrays.get(name) is getattr(self.store, name):
+                setattr(self.store, name, np.array(getattr(self.store, name)))
+            self._free(name)
+
+
+def merge_store(store: ArrayInfoSetStore, overflow: ArrayInfoSetStore):
+    """Adds the infosets found by a worker during a round to the main store."""
+    for key, overflow_id in overflow.ids.items():
+        infoSet_id = store.ids.get(key)
+        if infoSet_id is None:
+            infoSet_id = store.add_infoSet(key, overflow.action_sets[overflow_id], overflow.players[overflow_id])
+
+        start, end = store.offsets[infoSet_id], store.offsets[infoSet_id + 1]
+        overflow_start, overflow_end = overflow.offsets[overflow_id], overflow.offsets[overflow_id + 1]
+        store.regret[start:end] += overflow.regret[overflow_start:overflow_end]
+        store.cumulative_strategy[start:end] += overflow.cumulative_strategy[overflow_start:overflow_end]
+        store.strategy[start:end] = overflow.strategy[overflow_start:overflow_end]
+        store.last_update[infoSet_id] = max(store.last_update[infoSet_id], overflow.last_update[overflow_id])
+
+
+def _worker(cfr: CFR, worker: int, method: str, samples: range, iteration_offset: int, seed: int, results, debug):
+    # The workers are forked, so they would all draw the same random numbers without reseeding
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    cfr.infoSets = HogwildInfoSetStore(cfr.infoSets)
+    cfr.nodes_visited = 0
+    cfr.nodes_pruned = 0
+    if cfr.profiler is not None:  # The fork copied the timers of the main process, only send the ones of this worker
+        cfr.profiler.reset()
+    util_0 = 0
+    util_1 = 0
+    for t in samples:
+        # Same iteration number as `t` would get in `CFR.solve`
+        u_0, u_1 = cfr.iterate(method, t, t + iteration_offset, debug=debug)
+        util_0 += u_0
+        util_1 += u_1
+
+    profile = cfr.profiler.counts() if cfr.profiler is not None else None
+    results.put((worker, util_0, util_1, cfr.infoSets.overflow, cfr.nodes_visited, cfr.nodes_pruned, profile))
+
+
+def _get_results(results, processes, n_results: int):
+    collected = []
+    while len(collected) < n_results:
+        try:
+            collected.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(process.exitcode not in [None, 0] for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError("A CFR worker process crashed")
+    return sorted(collected, key=lambda result: result[0])
+
+
+def parallel_solve(
+    cfr: CFR, method: str, n_workers: int, round_size: int = 1000, debug=False, start: int = 0, checkpointer=None
+):
+    """
+    start: first sampled deal to train on, when resuming from a checkpoint
+    checkpointer: see `CFR.solve`. Checkpoints are written between rounds.
+    """
+    assert cfr.backend == "array", "Parallel training needs the array backend"
+    assert method != "manim"
+
+    context = multiprocessing.get_context("fork")
+    store = cfr.infoSets
+    shared = SharedStore(store)
+    util_0 = 0
+    util_1 = 0
+    progress = tqdm(total=cfr.iterations, initial=start, desc=f"CFR Training Loop ({n_workers} workers)")
+
+    try:
+        for round_start in range(start, cfr.iterations, n_workers * round_size):
+            round_end = min(round_start + n_workers * round_size, cfr.iterations)
+            shared.share()  # Only copies the arrays that grew during the last merge
+            results = context.Queue()
+            processes = []
+            for worker in range(n_workers):
+                # Worker w gets the deals round_start + w, round_start + w + n_workers, ...
+                samples = range(round_start + worker, round_end, n_workers)
+                process = context.Process(
+                    target=_worker,
+                    args=(
+                        cfr,
+                        worker,
+                        method,
+                        samples,
+                        cfr.iteration + 1 - round_start,
+                        random.getrandbits(64),
+                        results,
+                        debug,
+                    ),
+                )
+                process.start()
+                processes.append(process)
+
+            # Read the results before joining, the workers only exit once their results have been sent
+            worker_results = _get_results(results, processes, n_workers)
+            for process in processes:
+                process.join()
+
+            for _, worker_util_0, worker_util_1, overflow, nodes_visited, nodes_pruned, profile in worker_results:
+                util_0 += worker_util_0
+                util_1 += worker_util_1
+                cfr.nodes_visited += nodes_visited
+                cfr.nodes_pruned += nodes_pruned
+                if profile is not None:
+                    cfr.profiler.merge(profile)
+                merge_store(store, overflow)
+
+            cfr.iteration += round_end - round_start
+            progress.update(round_end - round_start)
+            if round_end // cfr.tracker_interval > round_start // cfr.tracker_interval:
+                cfr.track(util_0 / (round_end - start), util_1 / (round_end - start))
+
+            if checkpointer is not None and checkpointer.due(cfr.iteration):
+                checkpointer.save(cfr, round_end)
+    finally:
+        shared.release()
+
+    progress.close()
+    if checkpointer is not None:
+        checkpointer.save(cfr, cfr.iterations)
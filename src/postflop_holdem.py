@@ -43,12 +43,21 @@ This keeps it manageable for training.
 
 import base
 from base import Player, Action
-from typing import List
+from checkpoint import Checkpointer
+from telemetry import Telemetry
+from typing import Dict, List
 from abstraction import predict_cluster
 import abstraction
+import numpy as np
 
 DISCRETE_ACTIONS = ["k", "bMIN", "bMAX", "c", "f"]
 
+# Boards for public chance sampling, see `abstraction.generate_public_dataset` and `public_chance_cfr.py`
+public_boards = None
+public_hands = None
+public_clusters = None
+public_scores = None
+
 
 class PostflopHoldemHistory(base.History):
     """
@@ -81,9 +90,34 @@ class PostflopHoldemHistory(base.History):
     """
 
     def __init__(self, history: List[Action] = [], sample_id=0):
-        super().__init__(history)
         self.sample_id = sample_id
-        self.stage_i = history.count("/")
+        # Derived state, carried forward by `advance`
+        self.stage_i = 0
+        self.stage_start = -1  # index of the last "/"
+        self.acting_player = -1
+        # (total, stage_total, latest_bet) after the last 3 prefixes of the history, newest first,
+        # see `_get_total_pot_size`. The fold payoff needs the pot before the bet that was folded to.
+        self.pots = ((0, 4, 0),) * 3
+        # Infoset key without the card clusters: the betting actions, and the street (0 for the flop, 1 for the
+        # turn, 2 for the river) in place of the cards, see `get_infoSet_key_from_clusters`
+        self.key_template = ()
+        self.replay(history)
+
+    def advance(self, action: Action):
+        if action == "/":
+            self.stage_i += 1
+            self.stage_start = len(self.history) - 1
+        elif action in DISCRETE_ACTIONS:
+            self.key_template += (action,)
+        elif self.stage_i > 0:  # community cards
+            self.key_template += (self.stage_i - 1,)
+        self.pots = (self._add_to_pot_size(self.pots[0], action), self.pots[0], self.pots[1])
+
+        if len(self.history) <= 3 or self._game_stage_ended() or action == "/":
+            self.acting_player = -1
+        else:
+            # latest game stage
+            self.acting_player = (len(self.history) - self.stage_start) % 2
 
     def is_terminal(self):
         if len(self.history) == 0:
@@ -153,16 +187,7 @@ class PostflopHoldemHistory(base.History):
         # non dealer, dealer
         1. ['AkTh', 'QdKd', '/', 'Qh', 'b2', 'c', '/', '2d', b2', 'f']
         """
-        if len(self.history) <= 3:
-            return -1
-        elif self._game_stage_ended():
-            return -1
-        elif self.history[-1] == "/":
-            return -1
-        else:
-            last_game_stage = self.get_last_game_stage()
-            # latest game stage
-            return (len(last_game_stage) + 1) % 2
+        return self.acting_player
 
     def _game_stage_ended(self):
         return self.history[-1] == "c" or self.history[-1] == "f" or self.history[-2:] == ["k", "k"]
@@ -187,31 +212,18 @@ class PostflopHoldemHistory(base.History):
             return boards[self.sample_id][4]
 
     def get_last_game_stage(self):
-        last_game_stage_start_idx = max(loc for loc, val in enumerate(self.history) if val == "/")
-        last_game_stage = self.history[last_game_stage_start_idx + 1 :]
-        return last_game_stage
+        assert self.stage_start >= 0
+        return self.history[self.stage_start + 1 :]
 
     def terminal_utility(self, i: Player) -> int:
         assert self.is_terminal()  # We can only call the utility for a terminal history
         assert i in [0, 1]  # Only works for 2 player games for now
 
-        winner = winners[self.sample_id]
-
-        pot_size, _ = self._get_total_pot_size(self.history)
-
-        last_game_stage = self.get_last_game_stage()
-
         if self.history[-1] == "f":
-            pot_size, latest_bet = self._get_total_pot_size(self.history[:-2])
-            if self.history[-3] == "bMIN":
-                pot_size += latest_bet  # This is needed to calculate the correct profit
-
-            if (
-                len(last_game_stage) % 2 == i
-            ):  # this isn't perfectly exact, but it's an approximation
-                return -pot_size / 2
-            else:
-                return pot_size / 2
+            return self.fold_utility(i)
+
+        winner = winners[self.sample_id]
+        pot_size = self.showdown_pot_size()
 
         # showdown
         if winner == 0:  # tie
@@ -222,32 +234,51 @@ class PostflopHoldemHistory(base.History):
         else:
             return -pot_size / 2
 
+    def fold_utility(self, i: Player):
+        """Utility of a history that ends with a fold, which does not depend on the cards."""
+        assert self.history[-1] == "f"
+        last_game_stage_length = len(self.history) - self.stage_start - 1
+
+        total, stage_total, latest_bet = self.pots[2]  # pot of self.history[:-2]
+        pot_size = total + stage_total
+        if self.history[-3] == "bMIN":
+            pot_size += latest_bet  # This is needed to calculate the correct profit
+
+        if last_game_stage_length % 2 == i:  # this isn't perfectly exact, but it's an approximation
+            return -pot_size / 2
+        else:
+            return pot_size / 2
+
+    def showdown_pot_size(self):
+        total, stage_total, _ = self.pots[0]
+        return total + stage_total
+
     def _get_total_pot_size(self, history):
-        total = 0
-        stage_total = 4  # assume preflop is a check + call, so 4 in pot (1 BB = 2 chips)
-        latest_bet = 0
+        pot = (0, 4, 0)  # assume preflop is a check + call, so 4 in pot (1 BB = 2 chips)
+        for action in history:
+            pot = self._add_to_pot_size(pot, action)
 
-        # note that this logic works, because I don't allow multiple raises
-        for idx, action in enumerate(history):
-            if action == "/":
-                total += stage_total
-                stage_total = 0
-                latest_bet = 0  # reset latest bet in new stage
-            elif action == "bMIN":
-                latest_bet = max(2, int(total / 3))  # bet 1/3 pot
-                stage_total += latest_bet
-            elif action == "bMAX":
-                latest_bet = total  # bet the pot
-                stage_total += latest_bet
-            elif action == "c":
-                stage_total = 2 * latest_bet
-
-        total += stage_total
-        return total, latest_bet
+        total, stage_total, latest_bet = pot
+        return total + stage_total, latest_bet
 
-    def __add__(self, action: Action):
-        new_history = PostflopHoldemHistory(self.history + [action], self.sample_id)
-        return new_history
+    @staticmethod
+    def _add_to_pot_size(pot, action):
+        total, stage_total, latest_bet = pot
+        # note that this logic works, because I don't allow multiple raises
+        if action == "/":
+            total += stage_total
+            stage_total = 0
+            latest_bet = 0  # reset latest bet in new stage
+        elif action == "bMIN":
+            latest_bet = max(2, int(total / 3))  # bet 1/3 pot
+            stage_total += latest_bet
+        elif action == "bMAX":
+            latest_bet = total  # bet the pot
+            stage_total += latest_bet
+        elif action == "c":
+            stage_total = 2 * latest_bet
+
+        return total, stage_total, latest_bet
 
     def get_infoSet_key_online(self) -> List[Action]:
         history = self.history
@@ -291,38 +322,259 @@ class PostflopHoldemHistory(base.History):
         assert not self.is_chance()
         assert not self.is_terminal()
 
-        player = self.player()
-        infoset = []
+        return self.get_infoSet_key_from_clusters(self._player_clusters())
+
+    def get_infoSet_id(self):
+        return (self.key_template, self._player_clusters())
+
+    def _player_clusters(self):
+        if self.player() == 0:
+            clusters = [player_flop_clusters, player_turn_clusters, player_river_clusters]
+        else:
+            clusters = [opp_flop_clusters, opp_turn_clusters, opp_river_clusters]
+
+        return tuple(stage_clusters[self.sample_id] for stage_clusters in clusters[: self.stage_i])
+
+    def get_infoSet_key_from_clusters(self, clusters: List[int]) -> List[Action]:
+        """
+        clusters: cluster ids of the player for the flop, turn and river (up to the current stage)
+        """
         # ------- CARD ABSTRACTION -------
         # Assign cluster ID for FLOP/TURN/RIVER
+        return [str(clusters[item]) if isinstance(item, int) else item for item in self.key_template]
+
+
+def placeholder_chance_outcome(history: PostflopHoldemHistory) -> Action:
+    """
+    Same as `PostflopHoldemHistory.sample_chance_outcome`, but with placeholder cards. Used to walk the betting
+    tree without a dataset, since the cards are never looked at by the betting actions, the pot sizes
+    and the fold payoffs.
+    """
+    if len(history.history) <= 1:
+        return "XxXx"
+    elif history.history[-1] != "/":
+        return "/"
+    elif history.stage_i == 1:
+        return "XxXxXx"
+    else:
+        return "Xx"
+
+
+class CompiledPostflopTree:
+    """
+    Flat node table of the abstract post-flop betting tree, compiled once from `PostflopHoldemHistory`.
+
+    Node `n` is a decision node or a terminal node. The chance nodes are compiled away: the cards only depend on
+    the `sample_id`, so the child of a betting action that ends a street is directly the first decision node of
+    the next street. The root (node 0) is the first decision node of the flop.
+
+    The infosets of a decision node on street s are the cluster sequences of the acting player up to street s, so
+    they get the dense ids infoSet_offsets[n] + (flop cluster, turn cluster, river cluster) in mixed radix
+    `n_clusters`. The clusters must be smaller than `n_clusters`.
+    """
+
+    def __init__(self, n_clusters=None):
+        if n_clusters is None:
+            n_clusters = [
+                abstraction.NUM_FLOP_CLUSTERS,
+                abstraction.NUM_TURN_CLUSTERS,
+                abstraction.NUM_RIVER_CLUSTERS,
+            ]
+        self.n_clusters = n_clusters
+        self.children: List[Dict[Action, int]] = []
+        self.actions: List[List[Action]] = []
+        self.players: List[Player] = []  # -1 for terminal nodes
+        self.terminal: List[bool] = []
+        self.folded: List[bool] = []
+        self.streets: List[int] = []  # 1 for the flop, 2 for the turn, 3 for the river
+        self.pot_sizes: List[int] = []
+        self.fold_utilities: List[float] = []  # utility of player 0 at a fold, 0 otherwise
+        # Betting actions of each street, to build the infoset keys
+        self.betting: List[List[List[Action]]] = []
+        self.parents: List[int] = []
+        self.parent_actions: List[Action] = []
+
+        self._compile(PostflopHoldemHistory(), -1, None)
+
+        self.infoSet_offsets: List[int] = []
+        self.n_infoSet_ids = 0
+        for node in range(len(self)):
+            self.infoSet_offsets.append(self.n_infoSet_ids)
+            if not self.terminal[node]:
+                size = 1
+                for n in self.n_clusters[: self.streets[node]]:
+                    size *= n
+                self.n_infoSet_ids += size
+
+    def _compile(self, history: PostflopHoldemHistory, parent: int, parent_action: Action) -> int:
+        while not history.is_terminal() and history.is_chance():
+            history = history + placeholder_chance_outcome(history)
+
+        node = len(self.players)
+        terminal = history.is_terminal()
+        folded = terminal and history.history[-1] == "f"
+        self.children.append({})
+        self.actions.append([] if terminal else history.actions())
+        self.players.append(-1 if terminal else history.player())
+        self.terminal.append(terminal)
+        self.folded.append(folded)
+        self.streets.append(history.stage_i)
+        self.pot_sizes.append(history.showdown_pot_size())
+        self.fold_utilities.append(history.fold_utility(0) if folded else 0)
+        self.parents.append(parent)
+        self.parent_actions.append(parent_action)
+
+        betting = [[] for _ in range(history.stage_i)]
         stage_i = 0
-        for i, action in enumerate(self.history):
-            if action not in DISCRETE_ACTIONS:
-                if action == "/":
-                    stage_i += 1
-                    continue
-                if stage_i == 1:
-                    if player == 0:
-                        infoset.append(str(player_flop_clusters[self.sample_id]))
-                    else:
-                        infoset.append(str(opp_flop_clusters[self.sample_id]))
-                elif stage_i == 2:
-                    assert len(action) == 2
-                    if player == 0:
-                        infoset.append(str(player_turn_clusters[self.sample_id]))
-                    else:
-                        infoset.append(str(opp_turn_clusters[self.sample_id]))
-                elif stage_i == 3:
-                    assert len(action) == 2
-                    if player == 0:
-                        infoset.append(str(player_river_clusters[self.sample_id]))
-                    else:
-                        infoset.append(str(opp_river_clusters[self.sample_id]))
-            else:
-                infoset.append(action)
+        for action in history.history:
+            if action == "/":
+                stage_i += 1
+            elif action in DISCRETE_ACTIONS:
+                betting[stage_i - 1].append(action)
+        self.betting.append(betting)
+
+        for action in self.actions[node]:
+            self.children[node][action] = self._compile(history + action, node, action)
+        return node
+
+    def __len__(self) -> int:
+        return len(self.players)
 
+    def get_infoSet_key(self, node: int, clusters: List[int]) -> List[Action]:
+        """Same as `PostflopHoldemHistory.get_infoSet_key`, with the clusters of the acting player up to the street."""
+        infoset = []
+        for cluster, actions in zip(clusters, self.betting[node]):
+            infoset.append(str(cluster))
+            infoset += actions
         return infoset
 
+    def decode_clusters(self, street: int, code: int) -> List[int]:
+        """Inverse of the mixed radix code of the clusters, see `CompiledPostflopHoldemHistory.get_infoSet_id`."""
+        clusters = []
+        for n in reversed(self.n_clusters[:street]):
+            clusters.append(int(code % n))
+            code //= n
+        clusters.reverse()
+        return clusters
+
+
+_compiled_tree = None
+
+
+def get_compiled_tree() -> CompiledPostflopTree:
+    global _compiled_tree
+    if _compiled_tree is None:
+        _compiled_tree = CompiledPostflopTree()
+    return _compiled_tree
+
+
+class CompiledPostflopHoldemHistory(base.History):
+    """
+    Same game as `PostflopHoldemHistory`, but the history is a node of `CompiledPostflopTree` and a `sample_id`,
+    so the traversal does not copy lists or scan the history.
+    """
+
+    def __init__(self, node: int = 0, sample_id: int = 0, tree: CompiledPostflopTree = None):
+        self.tree = tree if tree is not None else get_compiled_tree()
+        self.node = node
+        self.sample_id = sample_id
+
+    @property
+    def history(self) -> List[Action]:
+        """The equivalent `PostflopHoldemHistory` list, for debugging."""
+        actions = []
+        node = self.node
+        while self.tree.parents[node] != -1:
+            actions.append(self.tree.parent_actions[node])
+            node = self.tree.parents[node]
+        actions.reverse()
+
+        board = boards[self.sample_id]
+        history = ["".join(player_hands[self.sample_id]), "".join(opponent_hands[self.sample_id]), "/", "".join(board[:3])]
+        street = 1
+        for action in actions:
+            history.append(action)
+            if self.tree.streets[self.tree.children[node][action]] > street:
+                history += ["/", board[street + 2]]
+                street += 1
+            node = self.tree.children[node][action]
+        return history
+
+    def is_terminal(self):
+        return self.tree.terminal[self.node]
+
+    def actions(self):
+        return self.tree.actions[self.node]
+
+    def player(self):
+        return self.tree.players[self.node]
+
+    def is_chance(self):
+        return False
+
+    def terminal_utility(self, i: Player) -> int:
+        tree = self.tree
+        if tree.folded[self.node]:
+            utility = tree.fold_utilities[self.node]
+        else:
+            utility = winners[self.sample_id] * tree.pot_sizes[self.node] / 2
+        return utility if i == 0 else -utility
+
+    def __add__(self, action: Action):
+        return CompiledPostflopHoldemHistory(self.tree.children[self.node][action], self.sample_id, self.tree)
+
+    def get_infoSet_key(self) -> List[Action]:
+        if self.tree.players[self.node] == 0:
+            clusters = [player_flop_clusters, player_turn_clusters, player_river_clusters]
+        else:
+            clusters = [opp_flop_clusters, opp_turn_clusters, opp_river_clusters]
+
+        street = self.tree.streets[self.node]
+        return self.tree.get_infoSet_key(self.node, [stage_clusters[self.sample_id] for stage_clusters in clusters[:street]])
+
+    def get_infoSet_id(self) -> int:
+        tree = self.tree
+        node = self.node
+        sample_id = self.sample_id
+        street = tree.streets[node]
+        if tree.players[node] == 0:
+            infoSet_id = player_flop_clusters[sample_id]
+            if street >= 2:
+                infoSet_id = infoSet_id * tree.n_clusters[1] + player_turn_clusters[sample_id]
+            if street == 3:
+                infoSet_id = infoSet_id * tree.n_clusters[2] + player_river_clusters[sample_id]
+        else:
+            infoSet_id = opp_flop_clusters[sample_id]
+            if street >= 2:
+                infoSet_id = infoSet_id * tree.n_clusters[1] + opp_turn_clusters[sample_id]
+            if street == 3:
+                infoSet_id = infoSet_id * tree.n_clusters[2] + opp_river_clusters[sample_id]
+        return tree.infoSet_offsets[node] + infoSet_id
+
+    def get_batched_dataset(self):
+        """
+        The dataset as arrays, for `batched_cfr.py`. Returns (codes, winners), where codes[i][street - 1] are the
+        clusters of player i up to `street` of every sample, in the mixed radix of `get_infoSet_id` (without the
+        offset of the node).
+        """
+        n_clusters = self.tree.n_clusters
+        codes = []
+        for clusters in [
+            [player_flop_clusters, player_turn_clusters, player_river_clusters],
+            [opp_flop_clusters, opp_turn_clusters, opp_river_clusters],
+        ]:
+            code = np.asarray(clusters[0], dtype=np.int64)
+            player_codes = [code]
+            for street in [1, 2]:
+                code = code * n_clusters[street] + np.asarray(clusters[street], dtype=np.int64)
+                player_codes.append(code)
+            codes.append(player_codes)
+        return codes, np.asarray(winners, dtype=np.float64)
+
+    def get_public_dataset(self):
+        """The boards for public chance sampling, see `public_chance_cfr.py`."""
+        return public_hands, public_clusters, public_scores
+
 
 class PostflopHoldemInfoSet(base.InfoSet):
     """
@@ -356,6 +608,10 @@ def create_history(sample_id):
     return PostflopHoldemHistory(sample_id=sample_id)
 
 
+def create_compiled_history(sample_id):
+    return CompiledPostflopHoldemHistory(sample_id=sample_id)
+
+
 class PostflopHoldemCFR(base.CFR):
     def __init__(
         self,
@@ -363,15 +619,32 @@ class PostflopHoldemCFR(base.CFR):
         create_history,
         n_players: int = 2,
         iterations: int = 1000000,
+        **kwargs,
     ):
-        super().__init__(create_infoSet, create_history, n_players, iterations)
+        super().__init__(create_infoSet, create_history, n_players, iterations, **kwargs)
+
+    def exploitability(self, n_samples: int = None) -> float:
+        """
+        Exact over the loaded dataset (or `n_samples` random deals of it), with `create_compiled_history` and the
+        "array" backend. See `best_response.py`.
+        """
+        import best_response
+
+        samples = best_response.sample_deals(len(winners), n_samples, self.iteration)
+        return best_response.postflop_best_response(self, samples).exploitability()
 
 
 if __name__ == "__main__":
     # Train in batches of 50,000 hands
     ITERATIONS = 50000
-    cfr = PostflopHoldemCFR(create_infoSet, create_history, iterations=ITERATIONS)
-    for i in range(20):
+    cfr = PostflopHoldemCFR(create_infoSet, create_compiled_history, iterations=ITERATIONS, backend="array")
+    # Resume from the latest checkpoint if training was interrupted
+    checkpointer = Checkpointer("postflop_checkpoints", every_seconds=600)
+    # Training metrics, one JSON line every `tracker_interval` iterations
+    telemetry = Telemetry("postflop_telemetry.jsonl")
+    manifest = checkpointer.latest()
+    first_batch = manifest["iteration"] // ITERATIONS if manifest else 0
+    for i in range(first_batch, 20):
         try:
             abstraction.load_dataset(i)
         except Exception as e:
@@ -392,5 +665,5 @@ if __name__ == "__main__":
         winners = abstraction.winners
 
         print(boards[0])
-        cfr.solve(debug=False, method="vanilla")
+        cfr.solve(debug=False, method="vanilla", checkpointer=checkpointer, resume=True, telemetry=telemetry)
         cfr.export_infoSets(f"postflop_infoSets_batch_{i}.joblib")
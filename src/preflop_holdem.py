@@ -11,12 +11,15 @@ Preflop is weird because the dealer calls, but the round isn't over...
 
 import base
 from base import Player, Action
+from checkpoint import Checkpointer
+from telemetry import Telemetry
 import abstraction
 from typing import List
 from abstraction import (
     get_preflop_cluster_id,
 )
-from fast_evaluator import evaluate_cards
+from fast_evaluator import evaluate_cards, phEvaluatorSetup
+import random
 
 DISCRETE_ACTIONS = ["k", "bMIN", "bMID", "bMAX", "c", "f"]
 
@@ -24,6 +27,9 @@ player_hands = None
 opponent_hands = None
 boards = None
 winners = None
+# Optional 169 x 169 all-in equity table, see `abstraction.generate_preflop_equity_table`. When it is set, a showdown
+# pays the expected value of the two hands instead of the result on `boards[sample_id]`, and `winners` is not used.
+equity_table = None
 
 
 class PreflopHoldemHistory(base.History):
@@ -47,8 +53,29 @@ class PreflopHoldemHistory(base.History):
     """
 
     def __init__(self, history: List[Action] = [], sample_id=0):
-        super().__init__(history)
         self.sample_id = sample_id
+        # Derived state, carried forward by `advance`
+        self.acting_player = -1
+        self.pot = (3, 2)  # (stage_total, latest_bet), see `_get_total_pot_size`
+        self.previous_pot = self.pot  # pot before the last action
+        self.fold_pot = None  # pot before the bet that was folded to
+        self.betting = ()  # betting actions, the infoset key without the card cluster
+        # Cluster id of each hand, computed on first use. Shared by all the histories of the deal.
+        self.hand_clusters = [None, None]
+        self.replay(history)
+
+    def advance(self, action: Action):
+        if action == "f":
+            self.fold_pot = self.previous_pot
+        self.previous_pot = self.pot
+        self.pot = self._add_to_pot_size(self.pot, action)
+        if action in DISCRETE_ACTIONS:
+            self.betting += (action,)
+
+        if len(self.history) < 2 or self._game_stage_ended() or action == "/":
+            self.acting_player = -1
+        else:
+            self.acting_player = (len(self.history) + 1) % 2
 
     def is_terminal(self):
         if len(self.history) == 0:
@@ -127,14 +154,7 @@ class PreflopHoldemHistory(base.History):
         """
         1. ['AkTh', 'QdKd', 'bMID', 'c', '/', 'Qh2d3s4h5s']
         """
-        if len(self.history) < 2:
-            return -1
-        elif self._game_stage_ended():
-            return -1
-        elif self.history[-1] == "/":
-            return -1
-        else:
-            return (len(self.history) + 1) % 2
+        return self.acting_player
 
     def _game_stage_ended(self):
         return (
@@ -162,13 +182,10 @@ class PreflopHoldemHistory(base.History):
         assert self.is_terminal()  # We can only call the utility for a terminal history
         assert i in [0, 1]  # Only works for 2 player games for now
 
-        winner = winners[self.sample_id]
-
-        pot_size, _ = self._get_total_pot_size(self.history)
+        pot_size, _ = self.pot
 
-        if "f" in self.history:
-            fold_idx = self.history.index("f")
-            pot_size, latest_bet = self._get_total_pot_size(self.history[: fold_idx - 1])
+        if self.fold_pot is not None:
+            pot_size, latest_bet = self.fold_pot
             if self.history[-3] in ["bMIN", "bMID"]:  # this is part of the profit
                 pot_size += latest_bet
 
@@ -178,6 +195,12 @@ class PreflopHoldemHistory(base.History):
                 return pot_size / 2
 
         # showdown
+        if equity_table is not None:
+            equity = equity_table[self._hand_cluster(0) - 1][self._hand_cluster(1) - 1]
+            utility = (2 * equity - 1) * pot_size / 2
+            return utility if i == 0 else -utility
+
+        winner = winners[self.sample_id]
         if winner == 0:  # tie
             return 0
 
@@ -187,31 +210,30 @@ class PreflopHoldemHistory(base.History):
             return -pot_size / 2
 
     def _get_total_pot_size(self, history):
-        stage_total = 3  # initially 3 chips in the pot (1 SB and 1 BB)
-        latest_bet = 2
-
-        # since I am allowing
-        for idx, action in enumerate(history):
-            if action == "bMIN":
-                old_stage_total = stage_total
-                stage_total = latest_bet + stage_total  # bet ~ 1x pot
-                latest_bet = old_stage_total
-            elif action == "bMID":
-                old_stage_total = stage_total
-                stage_total = latest_bet + 2 * stage_total  # bet 2x pot
-                latest_bet = 2 * old_stage_total
-            elif action == "bMAX":
-                stage_total = latest_bet + 100  # bet all in
-                latest_bet = 100
-            elif action == "c":
-                stage_total = 2 * latest_bet  # call
+        pot = (3, 2)  # initially 3 chips in the pot (1 SB and 1 BB)
+        for action in history:
+            pot = self._add_to_pot_size(pot, action)
+        return pot
+
+    @staticmethod
+    def _add_to_pot_size(pot, action):
+        stage_total, latest_bet = pot
+        if action == "bMIN":
+            old_stage_total = stage_total
+            stage_total = latest_bet + stage_total  # bet ~ 1x pot
+            latest_bet = old_stage_total
+        elif action == "bMID":
+            old_stage_total = stage_total
+            stage_total = latest_bet + 2 * stage_total  # bet 2x pot
+            latest_bet = 2 * old_stage_total
+        elif action == "bMAX":
+            stage_total = latest_bet + 100  # bet all in
+            latest_bet = 100
+        elif action == "c":
+            stage_total = 2 * latest_bet  # call
 
         return stage_total, latest_bet
 
-    def __add__(self, action: Action):
-        new_history = PreflopHoldemHistory(self.history + [action], self.sample_id)
-        return new_history
-
     def get_infoSet_key(self) -> List[Action]:
         """
         This is where we abstract away cards and bet sizes.
@@ -219,15 +241,17 @@ class PreflopHoldemHistory(base.History):
         assert not self.is_chance()
         assert not self.is_terminal()
 
-        player = self.player()
-        infoset = []
+        return list(self.get_infoSet_id())
+
+    def get_infoSet_id(self):
         # ------- CARD ABSTRACTION -------
-        infoset.append(str(get_preflop_cluster_id(self.history[player])))
-        for i, action in enumerate(self.history):
-            if action in DISCRETE_ACTIONS:
-                infoset.append(action)
+        return (str(self._hand_cluster(self.player())),) + self.betting
 
-        return infoset
+    def _hand_cluster(self, player: Player) -> int:
+        cluster = self.hand_clusters[player]
+        if cluster is None:
+            cluster = self.hand_clusters[player] = get_preflop_cluster_id(self.history[player])
+        return cluster
 
 
 class PreflopHoldemInfoSet(base.InfoSet):
@@ -269,8 +293,21 @@ class PreflopHoldemCFR(base.CFR):
         create_history,
         n_players: int = 2,
         iterations: int = 1000000,
+        **kwargs,
     ):
-        super().__init__(create_infoSet, create_history, n_players, iterations)
+        super().__init__(create_infoSet, create_history, n_players, iterations, **kwargs)
+
+    def exploitability(self, n_samples: int = None) -> float:
+        """
+        Exact, over all the pairs of clusters with `equity_table`, else over the loaded dataset (or `n_samples` random
+        deals of it). See `best_response.py`.
+        """
+        import best_response
+
+        samples = None
+        if equity_table is None:
+            samples = best_response.sample_deals(len(player_hands), n_samples, self.iteration)
+        return best_response.preflop_best_response(self, samples).exploitability()
 
 
 def evaluate_winner(board, player_hand, opponent_hand):
@@ -289,19 +326,40 @@ if __name__ == "__main__":
     # Train in batches of 50,000 hands
     ITERATIONS = 50000
     cfr = PreflopHoldemCFR(create_infoSet, create_history, iterations=ITERATIONS)
-    for i in range(20):
+    # Resume from the latest checkpoint if training was interrupted
+    checkpointer = Checkpointer("preflop_checkpoints", every_seconds=600)
+    # Training metrics, one JSON line every `tracker_interval` iterations
+    telemetry = Telemetry("preflop_telemetry.jsonl")
+    manifest = checkpointer.latest()
+    first_batch = manifest["iteration"] // ITERATIONS if manifest else 0
+    # Resolve the showdowns with the all-in equity of the hands, instead of one sampled board per deal
+    USE_EQUITY_TABLE = True
+    if USE_EQUITY_TABLE:
         try:
-            abstraction.load_dataset(i)
-        except Exception as e:
-            print("Got error loading dataset: ", e)
-            print("Generating new dataset")
-            abstraction.generate_dataset(batch=i)
-
-        # ----- Load the variables locally -----
-        boards = abstraction.boards
-        player_hands = abstraction.player_hands
-        opponent_hands = abstraction.opponent_hands
-        winners = abstraction.winners
-
-        cfr.solve(debug=False, method="vanilla")
+            equity_table = abstraction.load_preflop_equity_table()
+        except FileNotFoundError:
+            print("Generating the pre-flop equity table")
+            equity_table = abstraction.generate_preflop_equity_table()
+
+    for i in range(first_batch, 20):
+        if USE_EQUITY_TABLE:
+            # Only the hands are needed, no need for the post-flop clusters of `generate_dataset`.
+            # Seeded by batch, so that resuming from a checkpoint deals the same hands.
+            random.seed(i)
+            boards, player_hands, opponent_hands = phEvaluatorSetup(ITERATIONS)
+        else:
+            try:
+                abstraction.load_dataset(i)
+            except Exception as e:
+                print("Got error loading dataset: ", e)
+                print("Generating new dataset")
+                abstraction.generate_dataset(batch=i)
+
+            # ----- Load the variables locally -----
+            boards = abstraction.boards
+            player_hands = abstraction.player_hands
+            opponent_hands = abstraction.opponent_hands
+            winners = abstraction.winners
+
+        cfr.solve(debug=False, method="vanilla", checkpointer=checkpointer, resume=True, telemetry=telemetry)
         cfr.export_infoSets(f"preflop_infoSets_batch_{i}.joblib")
@@ -0,0 +1,198 @@
+"""
+Opt-in profiling of `CFR.solve`, with `solve(profile=True)` or the environment variable `CFR_PROFILE=1`.
+
+When it is on, for the duration of the call to `solve`:
+- The methods of the `History` class of the game (`__add__`, `advance`, `actions`, `get_infoSet_key`,
+  `terminal_utility`, ...), `CFR.get_infoSet`, the updates of the regret policy and `abstraction.predict_cluster` are
+  wrapped with timers, which count the calls and the time spent in them. The times include the nested calls, ex:
+  `__add__` includes `advance`.
+- `CFR.get_infoSet` also counts the infosets created and the ones that were found (hits).
+- `cProfile` runs on the whole call, or only on one of every `cprofile_every` iterations of the sequential methods,
+  to keep the overhead down on long runs.
+At the end of `solve`, a report with the timers and the top `top_n` functions of `cProfile` is printed and appended
+to `report_path`.
+
+With several workers (see `parallel_cfr.py`), every worker sends its timers and counters back to the main process
+with its results, so they cover the whole run. Their times are summed over the processes, so they can add up to more
+than the time of `solve`. `cProfile` only covers the main process.
+
+Nothing is wrapped when profiling is off, so the overhead is zero.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+from collections import defaultdict
+from typing import Optional
+
+HISTORY_METHODS = [
+    "__add__",
+    "advance",
+    "is_terminal",
+    "is_chance",
+    "actions",
+    "player",
+    "sample_chance_outcome",
+    "terminal_utility",
+    "get_infoSet_key",
+    "get_infoSet_id",
+]
+POLICY_METHODS = ["update_regret", "update_regret_table", "update_regret_rows"]
+ENVIRONMENT_VARIABLE = "CFR_PROFILE"
+
+
+def profiling_requested(profile: bool) -> bool:
+    return profile or os.environ.get(ENVIRONMENT_VARIABLE, "0") not in ["", "0"]
+
+
+class Profiler:
+    def __init__(self, report_path: Optional[str] = "profile_report.txt", top_n: int = 25, cprofile_every: int = None):
+        """
+        report_path: file the reports are appended to, None to only print them
+        cprofile_every: run `cProfile` on one of every `cprofile_every` calls to `CFR.iterate`, instead of the whole call
+                to `solve`. The methods that do not use `CFR.iterate` in the main process ("batched", "public_chance",
+                several workers) are then not covered by `cProfile`, only by the timers.
+        """
+        self.report_path = report_path
+        self.top_n = top_n
+        self.cprofile_every = cprofile_every
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.cprofile = cProfile.Profile()
+        self._restore = []
+
+    # ---------- Timers of the workers ----------
+    def reset(self):
+        """Clears the timers and counters, ex: in a forked worker, before it counts its own."""
+        self.calls.clear()
+        self.seconds.clear()
+        self.counters.clear()
+
+    def counts(self):
+        return dict(self.calls), dict(self.seconds), dict(self.counters)
+
+    def merge(self, counts):
+        """Adds the `counts` of a worker to the timers and counters."""
+        calls, seconds, counters = counts
+        for name, value in calls.items():
+            self.calls[name] += value
+        for name, value in seconds.items():
+            self.seconds[name] += value
+        for name, value in counters.items():
+            self.counters[name] += value
+
+    # ---------- Wrapping ----------
+    def _timed(self, name: str, function):
+        calls, seconds = self.calls, self.seconds
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds[name] += time.perf_counter() - start
+                calls[name] += 1
+
+        return timed
+
+    def _patch(self, owner, attribute: str, wrapper):
+        """Replaces `owner.attribute`, and remembers how to put it back."""
+        if attribute in vars(owner):
+            original = vars(owner)[attribute]
+            self._restore.append(lambda: setattr(owner, attribute, original))
+        else:  # Inherited from the class or a base class
+            self._restore.append(lambda: delattr(owner, attribute))
+        setattr(owner, attribute, wrapper)
+
+    def attach(self, cfr):
+        history_class = type(cfr.create_history(0))
+        for name in HISTORY_METHODS:
+            method = getattr(history_class, name, None)
+            if method is not None:
+                self._patch(history_class, name, self._timed(f"{history_class.__name__}.{name}", method))
+
+        for name in POLICY_METHODS:
+            method = getattr(cfr.policy, name, None)
+            if method is not None:
+                self._patch(cfr.policy, name, self._timed(f"{type(cfr.policy).__name__}.{name}", method))
+
+        get_infoSet = self._timed("CFR.get_infoSet", cfr.get_infoSet)
+        counters = self.counters
+
+        def counting_get_infoSet(history):
+            n_infoSets = len(cfr.infoSets)
+            infoSet = get_infoSet(history)
+            counters["infoSet creations" if len(cfr.infoSets) > n_infoSets else "infoSet hits"] += 1
+            return infoSet
+
+        self._patch(cfr, "get_infoSet", counting_get_infoSet)
+
+        # `predict_cluster` is also imported by name in the game modules
+        abstraction = sys.modules.get("abstraction")
+        if abstraction is not None:
+            predict_cluster = abstraction.predict_cluster
+            timed = self._timed("abstraction.predict_cluster", predict_cluster)
+            for module in list(sys.modules.values()):
+                if getattr(module, "predict_cluster", None) is predict_cluster:
+                    self._patch(module, "predict_cluster", timed)
+
+        if self.cprofile_every is None:
+            self.cprofile.enable()
+        else:
+            iterate = cfr.iterate
+
+            def sampled_iterate(*args, **kwargs):
+                counters["iterations"] += 1
+                if (counters["iterations"] - 1) % self.cprofile_every != 0:
+                    return iterate(*args, **kwargs)
+                self.cprofile.enable()
+                try:
+                    return iterate(*args, **kwargs)
+                finally:
+                    self.cprofile.disable()
+
+            self._patch(cfr, "iterate", sampled_iterate)
+        self.start_time = time.perf_counter()
+
+    def detach(self):
+        self.cprofile.disable()
+        self.elapsed = time.perf_counter() - self.start_time
+        for restore in reversed(self._restore):
+            restore()
+        self._restore = []
+
+    # ---------- Report ----------
+    def report(self, cfr) -> str:
+        lines = [f"===== Profile of CFR.solve, iteration {cfr.iteration}, {self.elapsed:.2f}s =====", ""]
+        lines.append(f"{'timer':<50}{'calls':>12}{'total (s)':>12}{'per call (us)':>16}{'% of solve':>12}")
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            calls, seconds = self.calls[name], self.seconds[name]
+            lines.append(
+                f"{name:<50}{calls:>12}{seconds:>12.3f}{1e6 * seconds / calls:>16.2f}"
+                f"{100 * seconds / max(self.elapsed, 1e-9):>12.1f}"
+            )
+        lines.append("")
+        for name, count in sorted(self.counters.items()):
+            lines.append(f"{name:<50}{count:>12}")
+        lines.append(f"{'nodes visited':<50}{cfr.nodes_visited:>12}")
+        lines.append(f"{'nodes pruned':<50}{cfr.nodes_pruned:>12}")
+
+        stream = io.StringIO()
+        try:
+            pstats.Stats(self.cprofile, stream=stream).sort_stats("cumulative").print_stats(self.top_n)
+        except TypeError:  # No function was profiled
+            stream.write("cProfile: no samples\n")
+        lines += ["", f"----- cProfile, top {self.top_n} by cumulative time -----", stream.getvalue()]
+        return "\n".join(lines)
+
+    def write_report(self, cfr) -> str:
+        report = self.report(cfr)
+        print(report)
+        if self.report_path is not None:
+            with open(self.report_path, "a") as f:
+                f.write(report + "\n")
+        return report
@@ -0,0 +1,202 @@
+"""
+Public chance sampling CFR for the post-flop abstraction, see `base.CFR.solve` with `method="public_chance"`.
+
+With `abstraction.generate_dataset`, every sample deals a board and two hands, so an iteration trains on a single
+pair of hands. Here, an iteration only samples the public cards: one board of `abstraction.generate_public_dataset`.
+The betting tree is then traversed once with the reach probabilities of every hand of both players on that board
+(the 1081 hands that do not use a card of the board), so one iteration covers all the ~1M pairs of hands.
+
+- At a decision node, the infoset of a hand is the node and the clusters of the hand, which are precomputed for every
+  board. The strategies are gathered from the `ArrayInfoSetStore` and the updates summed per infoset, like in
+  `batched_cfr.py`.
+- At a fold, the value of a hand is the total reach of the opponent hands that do not share a card with it.
+- At a showdown, the value of a hand is the reach of the weaker opponent hands minus the reach of the stronger ones,
+  again without the hands that share a card. The hands are sorted by strength once per board, then every showdown
+  is a few prefix sums: O(n log n) per board and O(n) per showdown, instead of O(n^2).
+
+The pairs of hands are weighted by 1 / (number of pairs of hands that do not share a card), so an iteration has
+the same scale as one sampled deal of the other methods.
+"""
+
+from typing import List
+
+import numpy as np
+from tqdm import tqdm
+
+from base import CFR
+from batched_cfr import get_infoSet_rows, regret_matching
+
+CARDS = {rank + suit: i for i, (rank, suit) in enumerate((r, s) for r in "23456789TJQKA" for s in "hdsc")}
+
+
+class PublicBoard:
+    """
+    The hands of both players on one board, with the sorted orders needed to evaluate folds and showdowns with card
+    removal in O(n).
+    """
+
+    def __init__(self, hands: List[List[str]], scores: np.ndarray):
+        """
+        scores: score of every hand on the river, lower is better (see `phevaluator.evaluate_cards`)
+        """
+        self.cards = np.array([[CARDS[card] for card in hand] for hand in hands], dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.int64)
+
+        # Hands sorted by score. The stronger hands of hand h are order[:n_stronger[h]], the weaker ones
+        # order[n_not_weaker[h]:]. Hands with the same score are neither.
+        self.order = np.argsort(scores, kind="stable")
+        sorted_scores = scores[self.order]
+        self.n_stronger = np.searchsorted(sorted_scores, scores, side="left")
+        self.n_not_weaker = np.searchsorted(sorted_scores, scores, side="right")
+
+        # Same for the hands that hold a given card: the (card, hand) pairs are sorted by card, then score
+        n_scores = scores.max() + 1
+        pair_hands = np.repeat(np.arange(len(hands)), 2)
+        pair_keys = self.cards.ravel() * n_scores + scores[pair_hands]
+        pair_order = np.argsort(pair_keys, kind="stable")
+        sorted_keys = pair_keys[pair_order]
+        self.pair_hands = pair_hands[pair_order]
+        hand_keys = self.cards * n_scores + scores[:, None]
+        self.card_start = np.searchsorted(sorted_keys, self.cards * n_scores, side="left")
+        self.card_end = np.searchsorted(sorted_keys, (self.cards + 1) * n_scores, side="left")
+        self.card_stronger = np.searchsorted(sorted_keys, hand_keys, side="left")
+        self.card_not_weaker = np.searchsorted(sorted_keys, hand_keys, side="right")
+
+        self.n_pairs = self.compatible_reach(np.ones(len(hands))).sum()
+
+    def compatible_reach(self, reach: np.ndarray) -> np.ndarray:
+        """
+        For every hand, the total reach of the opponent hands that do not share a card with it. Only hand h itself
+        holds both of its cards, so by inclusion-exclusion, this is total - reach[card 1] - reach[card 2] + reach[h].
+        """
+        card_reach = np.bincount(self.cards.ravel(), weights=np.repeat(reach, 2), minlength=len(CARDS))
+        return reach.sum() - card_reach[self.cards[:, 0]] - card_reach[self.cards[:, 1]] + reach
+
+    def showdown_reach(self, reach: np.ndarray) -> np.ndarray:
+        """
+        For every hand, the reach of the weaker opponent hands minus the reach of the stronger ones, without the
+        opponent hands that share a card with it.
+        """
+        cumulative = np.concatenate(([0.0], np.cumsum(reach[self.order])))
+        stronger = cumulative[self.n_stronger]
+        weaker = cumulative[-1] - cumulative[self.n_not_weaker]
+
+        pair_cumulative = np.concatenate(([0.0], np.cumsum(reach[self.pair_hands])))
+        card_stronger = pair_cumulative[self.card_stronger] - pair_cumulative[self.card_start]
+        card_weaker = pair_cumulative[self.card_end] - pair_cumulative[self.card_not_weaker]
+        return (weaker - card_weaker.sum(axis=1)) - (stronger - card_stronger.sum(axis=1))
+
+
+class PublicChanceTraversal:
+    def __init__(self, cfr: CFR):
+        root = cfr.create_history(0)
+        assert hasattr(root, "get_public_dataset"), "Public chance sampling needs `create_compiled_history`"
+        self.cfr = cfr
+        self.tree = root.tree
+        self.hands, self.clusters, self.scores = root.get_public_dataset()
+        assert self.hands is not None, "Set the boards of `abstraction.generate_public_dataset` on the game module"
+
+    def set_board(self, board_id: int):
+        self.board = PublicBoard(self.hands[board_id], self.scores[board_id])
+        self.weight = 1 / self.board.n_pairs
+
+        # infoSet_codes[k] are the distinct clusters of the hands up to street k + 1, in mixed radix (see
+        # `get_batched_dataset`), and hand_rows[k][h] is the position of the clusters of hand h among them
+        clusters = np.asarray(self.clusters[board_id], dtype=np.int64)
+        code = clusters[0]
+        self.infoSet_codes = []
+        self.hand_rows = []
+        for street in range(3):
+            if street > 0:
+                code = code * self.tree.n_clusters[street] + clusters[street]
+            infoSet_codes, hand_rows = np.unique(code, return_inverse=True)
+            self.infoSet_codes.append(infoSet_codes)
+            self.hand_rows.append(hand_rows.ravel())
+
+    def traverse(self, node: int, reach: List[np.ndarray], t: int) -> List[np.ndarray]:
+        """
+        Returns the counterfactual values of both players at this node, as vectors over their hands.
+        """
+        tree = self.tree
+        if tree.terminal[node]:
+            if tree.folded[node]:
+                utility = tree.fold_utilities[node] * self.weight
+                return [
+                    utility * self.board.compatible_reach(reach[1]),
+                    -utility * self.board.compatible_reach(reach[0]),
+                ]
+            stake = tree.pot_sizes[node] / 2 * self.weight
+            return [stake * self.board.showdown_reach(reach[1]), stake * self.board.showdown_reach(reach[0])]
+
+        cfr = self.cfr
+        n_hands = len(reach[0])
+        if not reach[0].any() and not reach[1].any():
+            # All the updates below this node would be multiplied by 0
+            cfr.nodes_pruned += 1
+            return [np.zeros(n_hands), np.zeros(n_hands)]
+
+        cfr.nodes_visited += 1
+        store = cfr.infoSets
+        i = tree.players[node]
+        n_actions = len(tree.actions[node])
+
+        # ----- Gather the strategies of the infosets of the hands -----
+        hand_rows = self.hand_rows[tree.streets[node] - 1]
+        rows = get_infoSet_rows(store, tree, node, self.infoSet_codes[tree.streets[node] - 1])
+        index = store.offsets[rows][:, None] + np.arange(n_actions)
+        infoSet_strategy = store.strategy[index]
+        strategy = infoSet_strategy[hand_rows]
+
+        # ----- Counterfactual values -----
+        values = [np.zeros(n_hands), np.zeros(n_hands)]
+        action_values = np.empty((n_hands, n_actions))
+        for a, action in enumerate(tree.actions[node]):
+            child_reach = list(reach)
+            child_reach[i] = reach[i] * strategy[:, a]
+            child_values = self.traverse(tree.children[node][action], child_reach, t)
+            action_values[:, a] = child_values[i]
+            values[i] += strategy[:, a] * child_values[i]
+            values[1 - i] += child_values[1 - i]
+
+        # ----- Sum the updates of the hands that share an infoset -----
+        hand_regret = action_values - values[i][:, None]
+        regret = np.stack(
+            [np.bincount(hand_rows, weights=hand_regret[:, a], minlength=len(rows)) for a in range(n_actions)],
+            axis=1,
+        )
+        infoSet_reach = np.bincount(hand_rows, weights=reach[i], minlength=len(rows))
+
+        cfr.policy.update_regret_rows(store, rows, index, regret, t)
+        store.cumulative_strategy[index] += cfr.policy.strategy_weight(t) * infoSet_reach[:, None] * infoSet_strategy
+        store.strategy[index] = regret_matching(store.regret[index])
+        return values
+
+
+def public_chance_solve(cfr: CFR, debug=False, start: int = 0, checkpointer=None):
+    """
+    Iteration t trains on board t of the public dataset.
+
+    start: first board to train on, when resuming from a checkpoint
+    checkpointer: see `CFR.solve`
+    """
+    assert cfr.backend == "array", "Public chance sampling needs the array backend"
+    traversal = PublicChanceTraversal(cfr)
+    util_0 = 0
+
+    for t in tqdm(range(start, cfr.iterations), desc="Public Chance Sampling CFR Training Loop"):
+        cfr.iteration += 1
+        traversal.set_board(t)
+        n_hands = len(traversal.board.cards)
+        values = traversal.traverse(0, [np.ones(n_hands), np.ones(n_hands)], cfr.iteration)
+        util_0 += values[0].sum()
+        if debug:
+            print(f"Board {t}: game value of the current strategies is {values[0].sum()}")
+
+        if (t + 1) % cfr.tracker_interval == 0:
+            cfr.track(util_0 / (t + 1 - start), -util_0 / (t + 1 - start))
+
+        if checkpointer is not None and checkpointer.due(cfr.iteration):
+            checkpointer.save(cfr, t + 1)
+
+    if checkpointer is not None:
+        checkpointer.save(cfr, cfr.iterations)
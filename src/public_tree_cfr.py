@@ -0,0 +1,272 @@
+"""
+Vectorized public-tree ("range vs range") CFR for the post-flop abstraction of `postflop_holdem.py`.
+
+`PostflopHoldemCFR` sends one sampled deal at a time through the betting tree, so every node of the tree is
+visited once per sample. Here, we walk the public betting tree once per iteration, and carry for each player a
+vector of reach probabilities over all of their private states. A private state is the sequence of
+(flop, turn, river) clusters of a player, and the chance distribution over pairs of private states is
+given by the samples of the dataset.
+
+At a decision node, the strategy of the acting player is computed for all of its infosets at once with regret
+matching, and the regrets and the average strategy are updated with vector operations.
+
+At a terminal node, the counterfactual values are "bucket vs bucket" matrix-vector products. The matrices are
+stored in sparse (COO) form, with one entry per distinct pair of private states in the dataset:
+    - fold:     u_0 * M @ reach_1, where M[s_0, s_1] = P(s_0, s_1)
+    - showdown: stake * W @ reach_1, where W[s_0, s_1] = sum of winners / number of samples
+
+The betting tree, the pot sizes and the infoset keys all come from `PostflopHoldemHistory`, so the exported
+infosets can be used in place of the ones trained by `PostflopHoldemCFR`.
+"""
+
+import numpy as np
+import joblib
+from tqdm import tqdm
+from typing import List
+
+import base
+from base import Player, Action
+from postflop_holdem import PostflopHoldemHistory, placeholder_chance_outcome
+
+
+class PublicNode:
+    """
+    A node of the public betting tree (chance nodes are skipped, since the cards are private).
+    """
+
+    def __init__(self, history: PostflopHoldemHistory, node_id: int):
+        self.history = history
+        self.node_id = node_id
+        self.children: List[PublicNode] = []
+        self.is_terminal = history.is_terminal()
+        if self.is_terminal:
+            self.player = -1
+            self.actions = []
+            self.folded = history.history[-1] == "f"
+            if self.folded:
+                self.utility = history.fold_utility(0)
+            else:
+                self.utility = history.showdown_pot_size() / 2  # stake of a showdown
+        else:
+            self.player = history.player()
+            self.actions = history.actions()
+            self.stage_i = history.stage_i
+
+
+def build_public_tree(history: PostflopHoldemHistory = None) -> List[PublicNode]:
+    """
+    Returns the nodes of the public tree in depth-first order, the root being the first node.
+    """
+    if history is None:
+        history = PostflopHoldemHistory()
+    nodes = []
+
+    def build(history):
+        while not history.is_terminal() and history.is_chance():
+            history = history + placeholder_chance_outcome(history)
+        node = PublicNode(history, len(nodes))
+        nodes.append(node)
+        for action in node.actions:
+            node.children.append(build(history + action))
+        return node
+
+    build(history)
+    return nodes
+
+
+class PublicTreeCFR:
+    def __init__(
+        self,
+        player_clusters: List[List[int]],
+        opp_clusters: List[List[int]],
+        winners: List[int],
+        iterations: int = 1000,
+        policy="vanilla",
+    ):
+        """
+        player_clusters: the flop, turn and river clusters of player 0, one entry per sample
+        opp_clusters: the flop, turn and river clusters of player 1, one entry per sample
+        winners: 1 if player 0 wins the showdown, -1 if player 1 wins, 0 for a tie
+        """
+        self.iterations = iterations
+        self.iteration = 0
+        self.policy = base.REGRET_POLICIES[policy]() if isinstance(policy, str) else policy
+
+        player_clusters = np.asarray(player_clusters, dtype=np.int64)
+        opp_clusters = np.asarray(opp_clusters, dtype=np.int64)
+        winners = np.asarray(winners, dtype=np.float64)
+        n_samples = len(winners)
+
+        # ----- Private states -----
+        # cluster_sizes[k] = number of clusters on stage k, so that we can encode the cluster sequences as integers
+        self.cluster_sizes = np.maximum(player_clusters.max(axis=1), opp_clusters.max(axis=1)) + 1
+        self.states = []  # states[i][j] = clusters of the j-th private state of player i
+        self.prefixes = []  # prefixes[i][k][j] = infoset row of state j of player i on stage k + 1
+        self.prefix_clusters = []  # prefix_clusters[i][k][row] = clusters of this infoset row
+        sample_states = []
+        for clusters in [player_clusters, opp_clusters]:
+            codes = self._encode(clusters)
+            codes, sample_state = np.unique(codes, return_inverse=True)
+            states = self._decode(codes)
+            self.states.append(states)
+            sample_states.append(sample_state.ravel())
+
+            prefixes, prefix_clusters = [], []
+            for k in range(3):
+                prefix_codes, prefix = np.unique(self._encode(states[: k + 1]), return_inverse=True)
+                prefixes.append(prefix.ravel())
+                prefix_clusters.append(self._decode(prefix_codes, k + 1).T)
+            self.prefixes.append(prefixes)
+            self.prefix_clusters.append(prefix_clusters)
+
+        self.n_states = [states.shape[1] for states in self.states]
+
+        # ----- Bucket vs bucket matrices, in COO form -----
+        pairs, pair_index = np.unique(
+            sample_states[0] * self.n_states[1] + sample_states[1], return_inverse=True
+        )
+        pair_index = pair_index.ravel()
+        self.rows = pairs // self.n_states[1]
+        self.cols = pairs % self.n_states[1]
+        self.probabilities = np.bincount(pair_index, minlength=len(pairs)) / n_samples
+        self.showdowns = np.bincount(pair_index, weights=winners, minlength=len(pairs)) / n_samples
+
+        # ----- Public tree -----
+        self.nodes = build_public_tree()
+        self.regret = {}
+        self.cumulative_strategy = {}
+        for node in self.nodes:
+            if not node.is_terminal:
+                n_rows = len(self.prefix_clusters[node.player][node.stage_i - 1])
+                self.regret[node.node_id] = np.zeros((n_rows, len(node.actions)))
+                self.cumulative_strategy[node.node_id] = np.zeros((n_rows, len(node.actions)))
+
+    def _encode(self, clusters: np.ndarray) -> np.ndarray:
+        code = np.zeros(clusters.shape[1], dtype=np.int64)
+        for k in range(len(clusters)):
+            code = code * self.cluster_sizes[k] + clusters[k]
+        return code
+
+    def _decode(self, codes: np.ndarray, n_stages: int = 3) -> np.ndarray:
+        clusters = np.zeros((n_stages, len(codes)), dtype=np.int64)
+        for k in reversed(range(n_stages)):
+            clusters[k] = codes % self.cluster_sizes[k]
+            codes = codes // self.cluster_sizes[k]
+        return clusters
+
+    def _matvec(self, weights: np.ndarray, reach: List[np.ndarray], i: Player) -> np.ndarray:
+        """Product of the (n_states[i] x n_states[1 - i]) matrix given by `weights` with the reach of the opponent."""
+        if i == 0:
+            return np.bincount(self.rows, weights=weights * reach[1][self.cols], minlength=self.n_states[0])
+        else:
+            return np.bincount(self.cols, weights=weights * reach[0][self.rows], minlength=self.n_states[1])
+
+    def terminal_values(self, node: PublicNode, reach: List[np.ndarray]) -> List[np.ndarray]:
+        if node.folded:
+            return [
+                node.utility * self._matvec(self.probabilities, reach, 0),
+                -node.utility * self._matvec(self.probabilities, reach, 1),
+            ]
+        else:
+            return [
+                node.utility * self._matvec(self.showdowns, reach, 0),
+                -node.utility * self._matvec(self.showdowns, reach, 1),
+            ]
+
+    @staticmethod
+    def regret_matching(regret: np.ndarray) -> np.ndarray:
+        positive_regret = np.maximum(regret, 0)
+        total = positive_regret.sum(axis=1, keepdims=True)
+        uniform = np.full_like(regret, 1 / regret.shape[1])
+        return np.divide(positive_regret, total, out=uniform, where=total > 0)
+
+    def vectorized_cfr(self, node: PublicNode, reach: List[np.ndarray], t: int) -> List[np.ndarray]:
+        """
+        Returns the counterfactual values of both players at this node, as vectors over their private states.
+        The regrets of both players are updated in the same traversal (simultaneous updates).
+        """
+        if node.is_terminal:
+            return self.terminal_values(node, reach)
+
+        i = node.player
+        prefix = self.prefixes[i][node.stage_i - 1]
+        n_rows = len(self.regret[node.node_id])
+
+        strategy = self.regret_matching(self.regret[node.node_id])
+        state_strategy = strategy[prefix]  # strategy of every private state of player i
+
+        values = [np.zeros(self.n_states[0]), np.zeros(self.n_states[1])]
+        action_values = np.zeros((self.n_states[i], len(node.actions)))
+        for a, child in enumerate(node.children):
+            child_reach = list(reach)
+            child_reach[i] = reach[i] * state_strategy[:, a]
+            child_values = self.vectorized_cfr(child, child_reach, t)
+            action_values[:, a] = child_values[i]
+            values[i] += state_strategy[:, a] * child_values[i]
+            values[1 - i] += child_values[1 - i]
+
+        # Sum the regrets and the reach of the private states that share the same infoset
+        regret = action_values - values[i][:, None]
+        infoSet_regret = np.stack(
+            [np.bincount(prefix, weights=regret[:, a], minlength=n_rows) for a in range(len(node.actions))],
+            axis=1,
+        )
+        self.policy.update_regret_table(self.regret[node.node_id], infoSet_regret, t)
+        infoSet_reach = np.bincount(prefix, weights=reach[i], minlength=n_rows)
+        self.cumulative_strategy[node.node_id] += self.policy.strategy_weight(t) * infoSet_reach[:, None] * strategy
+
+        return values
+
+    def solve(self, debug=False):
+        util_0 = 0
+        for _ in tqdm(range(self.iterations), desc="Vectorized CFR iterations"):
+            self.iteration += 1
+            values = self.vectorized_cfr(self.nodes[0], [np.ones(self.n_states[0]), np.ones(self.n_states[1])], self.iteration)
+            util_0 = values[0].sum()
+            if debug:
+                print(f"Iteration {self.iteration}: game value of the current strategies is {util_0}")
+        return util_0
+
+    def get_average_strategy(self, node: PublicNode) -> np.ndarray:
+        """Average strategy of every infoset of this node, one row per infoset."""
+        return self.regret_matching(self.cumulative_strategy[node.node_id])
+
+    def get_infoSet_key(self, node: PublicNode, row: int) -> List[Action]:
+        clusters = self.prefix_clusters[node.player][node.stage_i - 1][row]
+        return node.history.get_infoSet_key_from_clusters(clusters.tolist())
+
+    def to_infoSets(self) -> base.ArrayInfoSetStore:
+        """
+        Exports the infosets to an `ArrayInfoSetStore`, with the same keys as the ones used by `PostflopHoldemCFR`.
+        """
+        infoSets = base.ArrayInfoSetStore()
+        for node in self.nodes:
+            if node.is_terminal:
+                continue
+            strategy = self.regret_matching(self.regret[node.node_id])
+            for row in range(len(strategy)):
+                key = "".join(self.get_infoSet_key(node, row))
+                infoSet_id = infoSets.add_infoSet(key, node.actions, node.player)
+                start, end = infoSets.offsets[infoSet_id], infoSets.offsets[infoSet_id + 1]
+                infoSets.regret[start:end] = self.regret[node.node_id][row]
+                infoSets.strategy[start:end] = strategy[row]
+                infoSets.cumulative_strategy[start:end] = self.cumulative_strategy[node.node_id][row]
+        return infoSets
+
+    def export_infoSets(self, filename="infoSets.joblib"):
+        joblib.dump(self.to_infoSets(), filename)
+
+
+if __name__ == "__main__":
+    import abstraction
+
+    abstraction.load_dataset(0)
+    cfr = PublicTreeCFR(
+        [abstraction.player_flop_clusters, abstraction.player_turn_clusters, abstraction.player_river_clusters],
+        [abstraction.opp_flop_clusters, abstraction.opp_turn_clusters, abstraction.opp_river_clusters],
+        abstraction.winners,
+        iterations=1000,
+        policy="dcfr",
+    )
+    cfr.solve()
+    cfr.export_infoSets("postflop_infoSets_vectorized.joblib")
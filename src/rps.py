@@ -6,7 +6,11 @@ import copy
 
 class RPSHistory(base.History):
     def __init__(self, history: List[Action] = []):
-        self.history = history
+        self.infoSet_key = ()  # the choice of player 0 is hidden from player 1
+        self.replay(history)
+
+    def advance(self, action: Action):
+        self.infoSet_key += ("?",) if len(self.history) == 1 else (action,)
 
     def is_terminal(self):
         return len(self.history) == 2
@@ -33,14 +37,11 @@ class RPSHistory(base.History):
         else:
             return 1 if i == 0 else -1
 
-    def __add__(self, action: Action):
-        return RPSHistory(self.history + [action])
-
     def get_infoSet_key(self) -> List[Action]:
-        history = copy.deepcopy(self.history)
-        if len(history) >= 1:
-            history[0] = "?"
-        return history
+        return list(self.infoSet_key)
+
+    def get_infoSet_id(self):
+        return self.infoSet_key
 
 
 class RPSInfoSet(base.InfoSet):
@@ -70,4 +71,4 @@ if __name__ == "__main__":
     cfr = base.CFR(create_infoSet, create_history, iterations=1_00_000)
     # cfr.solve()
     # print(cfr.get_expected_value(RPSHistory([]), 0, player_strategy=[1,0,0], opp_strategy=[0.5,0.5,0]))
-    print(cfr.get_best_response(RPSHistory([]), 0, player_strategy=[0.8, 0.2, 0]))
+    print(cfr.get_best_response(RPSHistory([]), 1, opp_strategy=[0.8, 0.2, 0]))
@@ -0,0 +1,190 @@
+"""
+Compact export of the average strategy, for playing. See `export_average_strategy` and `load_strategy`.
+
+`CFR.export_infoSets` pickles the whole infosets: regrets, current and cumulative strategies, as Python floats for the
+dict backend. Playing only needs the average strategy, so this writes a `.npz` file with:
+- keys: the infoset keys, joined with "\\n" (the key index, rebuilt into a dict when loading)
+- action_sets / action_set_ids: the distinct lists of actions (JSON), and the one of every infoset
+- offsets: the probabilities of infoset i are probabilities[offsets[i]:offsets[i + 1]]
+- probabilities: the average strategy, quantized to "uint8" (probability * 255, rounded so that every infoset sums
+  to exactly 255) or stored as "float16"
+
+With uint8, every probability is within 1/255 of the exact one, usually much closer.
+
+Usage: python strategy_export.py preflop_infoSets_batch_19.joblib [uint8|float16]
+"""
+
+import json
+import os
+import pickle
+import sys
+from typing import Dict, List
+
+import joblib
+import numpy as np
+
+from base import ArrayInfoSetStore
+
+QUANTIZATION_LEVELS = 255
+
+
+def average_strategy_table(infoSets):
+    """
+    Returns (keys, action_sets, offsets, probabilities) of the average strategies of a dict of infosets or of an
+    `ArrayInfoSetStore`, with the probabilities as float64.
+    """
+    if isinstance(infoSets, ArrayInfoSetStore):
+        n, m = infoSets.n_infoSets, infoSets.n_actions
+        offsets = np.asarray(infoSets.offsets[: n + 1], dtype=np.int64)
+        cumulative = np.asarray(infoSets.cumulative_strategy[:m], dtype=np.float64)
+        lengths = np.diff(offsets)
+        totals = np.repeat(np.add.reduceat(cumulative, offsets[:-1]) if n > 0 else np.zeros(0), lengths)
+        uniform = np.repeat(1 / lengths, lengths)
+        probabilities = np.divide(cumulative, totals, out=uniform, where=totals > 0)
+        return list(infoSets.infoSet_keys), list(infoSets.action_sets), offsets, probabilities
+
+    keys, action_sets, probabilities = [], [], []
+    offsets = [0]
+    for key, infoSet in infoSets.items():
+        average_strategy = infoSet.get_average_strategy()
+        keys.append(key)
+        action_sets.append(infoSet.actions())
+        probabilities += [average_strategy[a] for a in infoSet.actions()]
+        offsets.append(len(probabilities))
+    return keys, action_sets, np.array(offsets, dtype=np.int64), np.array(probabilities, dtype=np.float64)
+
+
+def quantize(probabilities: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    uint8 probabilities out of 255. Every infoset is rounded down, then the units that are missing to sum to 255 go
+    to the actions with the largest remainders, so the quantized strategies are still probability distributions.
+    """
+    scaled = probabilities * QUANTIZATION_LEVELS
+    quantized = np.floor(scaled).astype(np.int64)
+    remainder = scaled - quantized
+    infoSet_ids = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    missing = QUANTIZATION_LEVELS - np.add.reduceat(quantized, offsets[:-1]) if len(quantized) else np.zeros(0, int)
+
+    # Rank of every action by decreasing remainder within its infoset
+    order = np.lexsort((-remainder, infoSet_ids))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(offsets[:-1], np.diff(offsets))
+    quantized += rank < missing[infoSet_ids]
+    return quantized.astype(np.uint8)
+
+
+def export_average_strategy(infoSets, filename: str, dtype: str = "uint8") -> dict:
+    """
+    infoSets: `CFR.infoSets`, with either backend, or a file of `CFR.export_infoSets`
+    dtype: "uint8" or "float16"
+
+    Returns a report with the number of infosets and actions, the size of the file, the compression ratio against
+    the pickled infosets, and the largest difference between an exported probability and the exact one.
+    """
+    assert dtype in ["uint8", "float16"]
+    if isinstance(infoSets, str):
+        original_bytes = os.path.getsize(infoSets)
+        infoSets = joblib.load(infoSets)
+    else:
+        original_bytes = len(pickle.dumps(infoSets, protocol=pickle.HIGHEST_PROTOCOL))
+
+    keys, action_sets, offsets, probabilities = average_strategy_table(infoSets)
+    if dtype == "uint8":
+        stored = quantize(probabilities, offsets)
+        restored = stored / QUANTIZATION_LEVELS
+    else:
+        stored = probabilities.astype(np.float16)
+        restored = stored.astype(np.float64)
+
+    distinct_action_sets: Dict[tuple, int] = {}
+    action_set_ids = np.array(
+        [distinct_action_sets.setdefault(tuple(actions), len(distinct_action_sets)) for actions in action_sets],
+        dtype=np.uint16,
+    )
+    offsets_dtype = np.uint32 if offsets[-1] < 2**32 else np.int64
+    with open(filename, "wb") as f:
+        np.savez_compressed(
+            f,
+            keys=np.frombuffer("\n".join(keys).encode("utf-8"), dtype=np.uint8),
+            action_sets=np.array(json.dumps([list(actions) for actions in distinct_action_sets])),
+            action_set_ids=action_set_ids,
+            offsets=offsets.astype(offsets_dtype),
+            probabilities=stored,
+        )
+
+    size = os.path.getsize(filename)
+    return {
+        "infosets": len(keys),
+        "actions": len(probabilities),
+        "bytes": size,
+        "original_bytes": original_bytes,
+        "compression_ratio": original_bytes / size,
+        "max_error": float(np.abs(restored - probabilities).max()) if len(probabilities) else 0.0,
+    }
+
+
+class CompactInfoSet:
+    """The average strategy of one infoset of a `CompactStrategy`, with the interface `aiplayer.CFRAIPlayer` uses."""
+
+    def __init__(self, actions: List[str], probabilities: np.ndarray):
+        self._actions = actions
+        self._probabilities = probabilities
+
+    def actions(self) -> List[str]:
+        return self._actions
+
+    def get_average_strategy(self) -> Dict[str, float]:
+        return dict(zip(self._actions, (self._probabilities / self._probabilities.sum()).tolist()))
+
+
+class CompactStrategy:
+    """A read-only dict of infoset key -> `CompactInfoSet`, loaded from a file of `export_average_strategy`."""
+
+    def __init__(self, filename: str):
+        with np.load(filename) as columns:
+            keys = columns["keys"].tobytes().decode("utf-8").split("\n") if len(columns["keys"]) else []
+            self.action_sets = json.loads(str(columns["action_sets"]))
+            self.action_set_ids = columns["action_set_ids"]
+            self.offsets = columns["offsets"].astype(np.int64)
+            # Kept as stored. They are normalized in float64 on lookup, so that the strategies sum to 1 for
+            # `np.random.choice`: float16 probabilities do not sum to exactly 1.
+            self.probabilities = columns["probabilities"]
+        self.ids = {key: i for i, key in enumerate(keys)}
+
+    def __getitem__(self, infoSet_key: str) -> CompactInfoSet:
+        i = self.ids[infoSet_key]
+        probabilities = self.probabilities[self.offsets[i] : self.offsets[i + 1]].astype(np.float64)
+        return CompactInfoSet(self.action_sets[self.action_set_ids[i]], probabilities)
+
+    def __contains__(self, infoSet_key) -> bool:
+        return infoSet_key in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def keys(self):
+        return list(self.ids)
+
+
+def load_strategy(filename: str):
+    """The infosets of a `.npz` file of `export_average_strategy`, or of a file of `CFR.export_infoSets`."""
+    if filename.endswith(".npz"):
+        return CompactStrategy(filename)
+    return joblib.load(filename)
+
+
+if __name__ == "__main__":
+    # The exports of the training scripts pickle their infosets as `__main__.<class>`
+    from preflop_holdem import PreflopHoldemInfoSet
+    from postflop_holdem import PostflopHoldemInfoSet
+
+    source = sys.argv[1]
+    dtype = sys.argv[2] if len(sys.argv) > 2 else "uint8"
+    target = os.path.splitext(source)[0] + f"_{dtype}.npz"
+    report = export_average_strategy(source, target, dtype)
+    print(f"Exported {report['infosets']} infosets ({report['actions']} actions) to {target}")
+    print(f"{report['original_bytes']} -> {report['bytes']} bytes, compression ratio {report['compression_ratio']:.1f}x")
+    print(f"Maximum quantization error: {report['max_error']:.2e}")
@@ -0,0 +1,127 @@
+"""
+Training metrics of `CFR.solve(telemetry=...)`, written every `tracker_interval` iterations instead of the
+`InfoSetTracker` snapshots.
+
+Every record is one line of a JSONL or CSV file (chosen by the extension of `path`), with:
+- iteration, elapsed_seconds, iterations_per_second and nodes_per_second since the previous record
+- infosets, rss_mb: number of infosets and resident memory of the process
+- game_value_0, game_value_1: average game value of each player since the start of `solve`
+- mean_positive_regret: mean of max(regret, 0) over all the actions of all the infosets
+- exploitability: see `CFR.exploitability`, only with `exploitability_samples` or `CFR(track_exploitability=True)`
+
+The file is opened in append mode for every record, so a resumed run continues the same file. The records can also
+be written to `tensorboard_dir` (ex: "../tensorboard/cfr"), which needs `torch` or `tensorboardX`.
+"""
+
+import csv
+import json
+import os
+import resource
+import time
+from typing import Optional
+
+FIELDS = [
+    "iteration",
+    "elapsed_seconds",
+    "iterations_per_second",
+    "nodes_per_second",
+    "infosets",
+    "rss_mb",
+    "game_value_0",
+    "game_value_1",
+    "mean_positive_regret",
+    "exploitability",
+]
+
+
+def resident_memory_mb() -> float:
+    """Current resident memory on Linux, else the peak resident memory."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if os.uname().sysname == "Darwin" else peak / 2**10  # bytes on macOS, KB on Linux
+
+
+class Telemetry:
+    def __init__(
+        self,
+        path: str,
+        tensorboard_dir: Optional[str] = None,
+        exploitability_samples: Optional[int] = None,
+    ):
+        """
+        exploitability_samples: compute the exploitability at every record, on this many deals of the dataset for the
+                games that are evaluated on a dataset (see `CFR.exploitability`). 0 uses all of them.
+        """
+        assert path.endswith(".jsonl") or path.endswith(".csv"), "The telemetry is written to a .jsonl or .csv file"
+        self.path = path
+        self.exploitability_samples = exploitability_samples
+        self.writer = None
+        if tensorboard_dir is not None:
+            try:
+                from torch.utils.tensorboard import SummaryWriter
+            except ImportError:
+                from tensorboardX import SummaryWriter
+            self.writer = SummaryWriter(tensorboard_dir)
+        self.start()
+
+    def start(self, cfr=None):
+        """Called at the start of `CFR.solve`, the rates are measured from here."""
+        self.start_time = self.last_time = time.time()
+        self.last_iteration = cfr.iteration if cfr is not None else 0
+        self.last_nodes = cfr.nodes_visited if cfr is not None else 0
+
+    def record(self, cfr, game_value_0: float, game_value_1: float) -> dict:
+        now = time.time()
+        elapsed = max(now - self.last_time, 1e-9)
+        exploitability = cfr.tracker.exploitability.get(cfr.iteration)
+        if exploitability is None and self.exploitability_samples is not None:
+            exploitability = cfr.exploitability(n_samples=self.exploitability_samples or None)
+
+        record = {
+            "iteration": cfr.iteration,
+            "elapsed_seconds": now - self.start_time,
+            "iterations_per_second": (cfr.iteration - self.last_iteration) / elapsed,
+            "nodes_per_second": (cfr.nodes_visited - self.last_nodes) / elapsed,
+            "infosets": len(cfr.infoSets),
+            "rss_mb": resident_memory_mb(),
+            "game_value_0": float(game_value_0),
+            "game_value_1": float(game_value_1),
+            "mean_positive_regret": cfr.mean_positive_regret(),
+            "exploitability": exploitability,
+        }
+        self.write(record)
+        self.last_time = now
+        self.last_iteration = cfr.iteration
+        self.last_nodes = cfr.nodes_visited
+        return record
+
+    def write(self, record: dict):
+        if self.path.endswith(".jsonl"):
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        else:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(record)
+
+        if self.writer is not None:
+            for name, value in record.items():
+                if name != "iteration" and value is not None:
+                    self.writer.add_scalar(f"cfr/{name}", value, record["iteration"])
+            self.writer.flush()
+
+
+def load(path: str) -> list:
+    """The records of a telemetry file, ex: to plot them."""
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return [
+            {name: (float(value) if value != "" else None) for name, value in row.items()} for row in csv.DictReader(f)
+        ]
@@ -0,0 +1,39 @@
+"""
+Training throughput of the batched post-flop solver (`method="batched"`) against `vanilla_cfr`.
+
+Usage: python batched_performance.py [vanilla_iterations] [batch_size]
+"""
+
+import sys
+import time
+import random
+
+sys.path.append("../src")
+import postflop_holdem
+from parallel_performance import load_postflop_dataset
+
+
+def benchmark_method(create_history, method, iterations, **kwargs):
+	random.seed(0)
+	cfr = postflop_holdem.PostflopHoldemCFR(
+		postflop_holdem.create_infoSet, create_history, iterations=iterations, backend="array"
+	)
+	cfr.tracker_interval = 10 * iterations
+	start = time.time()
+	cfr.solve(method=method, **kwargs)
+	elapsed = time.time() - start
+	print(f"{method}: {iterations / elapsed:.1f} deals/s ({len(cfr.infoSets)} infosets)")
+	return iterations / elapsed
+
+
+if __name__ == "__main__":
+	vanilla_iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+	batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+	load_postflop_dataset()
+	n_samples = len(postflop_holdem.winners)
+
+	vanilla = benchmark_method(postflop_holdem.create_history, "vanilla", vanilla_iterations)
+	batched = benchmark_method(
+		postflop_holdem.create_compiled_history, "batched", n_samples, batch_size=min(batch_size, n_samples)
+	)
+	print(f"Speedup: {batched / vanilla:.1f}x")
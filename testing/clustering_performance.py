@@ -0,0 +1,72 @@
+"""
+`emd_kmeans.EMDKMeans` against `sklearn.cluster.KMeans`, on the equity distributions of `kmeans_data/`: fitting time,
+and mean EMD of the histograms to their centroid (the within-cluster EMD).
+
+Usage: python clustering_performance.py [flop|turn] [n_clusters] [n_samples]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+sys.path.append("../src")
+from emd_kmeans import EMDKMeans, to_cdfs
+from utils import get_filenames
+
+
+def within_cluster_emd(kmeans, histograms):
+	centroids = np.clip(kmeans.cluster_centers_, 0, None)  # The Euclidean centroids are means, already >= 0
+	return float(np.abs(to_cdfs(histograms) - to_cdfs(centroids)[kmeans.predict(histograms)]).sum(axis=1).mean())
+
+
+def benchmark(histograms, n_clusters):
+	classifiers = [
+		("sklearn KMeans", KMeans(n_clusters, random_state=0)),
+		("EMDKMeans", EMDKMeans(n_clusters, random_state=0)),
+		("sklearn MiniBatchKMeans", MiniBatchKMeans(n_clusters, batch_size=4096, random_state=0, n_init=1)),
+		("EMDKMeans, mini-batch", EMDKMeans(n_clusters, batch_size=4096, random_state=0)),
+	]
+	for name, kmeans in classifiers:
+		start = time.time()
+		kmeans.fit(histograms)
+		elapsed = time.time() - start
+		print(f"{name:<28}{elapsed:>10.2f}s   within-cluster EMD {within_cluster_emd(kmeans, histograms):.4f}")
+
+
+if __name__ == "__main__":
+	stage = sys.argv[1] if len(sys.argv) > 1 else "flop"
+	n_clusters = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+	n_samples = int(sys.argv[3]) if len(sys.argv) > 3 else 1_000_000
+
+	filename = sorted(get_filenames(f"../kmeans_data/distributions/{stage}"))[-1]
+	histograms = np.load(f"../kmeans_data/distributions/{stage}/{filename}")
+	print(f"{stage}, {len(histograms)} histograms of {filename}, {n_clusters} clusters")
+	benchmark(histograms, n_clusters)
+
+	# Millions of histograms: resampled from the dataset, with some noise so that they are not all duplicates
+	rng = np.random.default_rng(0)
+	histograms = histograms[rng.integers(len(histograms), size=n_samples)]
+	histograms = histograms + 0.02 * rng.random(histograms.shape)
+	histograms /= histograms.sum(axis=1, keepdims=True)
+	print(f"\n{n_samples} resampled histograms")
+	benchmark(histograms, n_clusters)
+
+	"""
+	Results (flop, 50 clusters, 1 core)
+	10000 histograms of 1719903872_samples=10000_bins=10.npy
+	sklearn KMeans                    0.07s   within-cluster EMD 0.2008
+	EMDKMeans                         1.06s   within-cluster EMD 0.1614
+	sklearn MiniBatchKMeans           0.06s   within-cluster EMD 0.2024
+	EMDKMeans, mini-batch             0.18s   within-cluster EMD 0.1674
+
+	1000000 resampled histograms
+	sklearn KMeans                   17.58s   within-cluster EMD 0.2005
+	EMDKMeans                       210.80s   within-cluster EMD 0.1682
+	sklearn MiniBatchKMeans           0.80s   within-cluster EMD 0.2028
+	EMDKMeans, mini-batch             5.93s   within-cluster EMD 0.1709
+
+	The EMD clusters are about 20% tighter in EMD (also on the turn: 0.238 against 0.298). There is no BLAS for the L1
+	distance, so EMDKMeans is about 10x slower: use the mini-batches for millions of distributions.
+	"""
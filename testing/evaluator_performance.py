@@ -135,3 +135,38 @@ avg = float(cumtime / n)
 print("7 card evaluation:")
 print("[*] Custom Evaluator: Average time per evaluation: %f" % avg)
 print("[*] Custom Evaluator: Evaluations per second = %f" % (1.0 / avg))
+
+
+import numpy as np
+from fast_evaluator import card_ids, evaluate_batch, load_rank_tables
+
+load_rank_tables()  # Generated on the first run, memory-mapped afterwards
+n = 100000
+boards, player_hands, opponent_hands = phEvaluatorSetup(n)
+start = time.time()
+board_ids = card_ids(boards)
+player_cards = np.concatenate((board_ids, card_ids(player_hands)), axis=1)
+opponent_cards = np.concatenate((board_ids, card_ids(opponent_hands)), axis=1)
+conversion_time = time.time() - start
+
+start = time.time()
+p1_scores = evaluate_batch(player_cards)
+p2_scores = evaluate_batch(opponent_cards)
+wins = np.count_nonzero(p1_scores > p2_scores)
+losses = np.count_nonzero(p1_scores < p2_scores)
+ties = n - wins - losses
+cumtime = time.time() - start
+
+avg = float(cumtime / n)
+print("7 card evaluation:")
+print("[*] Vectorized NumPy: Average time per evaluation: %e" % avg)
+print("[*] Vectorized NumPy: Evaluations per second = %f" % (1.0 / avg))
+print("[*] Vectorized NumPy: Converting the string cards to ids takes %es per evaluation" % (conversion_time / n))
+
+# Batches of a single river: the 990 opponent hands of a board, see `equity.river_equities`
+n = 1000
+start = time.time()
+for i in range(n):
+    evaluate_batch(player_cards[:991])
+cumtime = time.time() - start
+print("[*] Vectorized NumPy, batches of 991 hands: Evaluations per second = %f" % (991 * n / cumtime))
@@ -13,6 +13,10 @@ from environment import *
 from evaluator import *
 from abstraction import *
 
+# The unit tests of the solvers, and of the card abstraction
+from test_cfr import *
+from test_abstraction import *
+
 
 
 
@@ -1,10 +1,18 @@
 
 import unittest
 import sys
+import random
 
 sys.path.append("../src")
 
 from abstraction import *
+import equity as equity_engine
+import hand_isomorphism
+import cluster_tables
+import emd_kmeans
+import os
+import tempfile
+from phevaluator import evaluate_cards
 
 
 class AbstractionUnitTest(unittest.TestCase):
@@ -13,11 +21,215 @@ class AbstractionUnitTest(unittest.TestCase):
 		self.assertEqual(get_preflop_cluster_id("AhAd") + 1, get_preflop_cluster_id("2s2c"))
 		self.assertEqual(get_preflop_cluster_id("Ah3d"), 15)
 	
+	def test_preflop_equity(self):
+		random.seed(0)
+		cluster_hands = get_preflop_cluster_hands()
+		self.assertEqual(sum(len(hands) for hands in cluster_hands.values()), 1326)
+		# AA against 72o is about 87%, AKs against AA about 12% (AKs blocks two of the aces)
+		self.assertAlmostEqual(calculate_preflop_matchup_equity(1, get_preflop_cluster_id("7h2d"), 2000, cluster_hands), 0.87, delta=0.03)
+		self.assertAlmostEqual(calculate_preflop_matchup_equity(get_preflop_cluster_id("AhKh"), 1, 2000, cluster_hands), 0.12, delta=0.03)
+
 	def test_flop(self):
-		kmeans_flop, kmeans_turn, kmeans_river = load_kmeans_classifiers()
-		self.assertEqual(get_flop_cluster_id(kmeans_flop, "AhAd2s2d3h"), get_flop_cluster_id(kmeans_flop, "AsAd2s2d3h"))
-		get_turn_cluster_id(kmeans_turn, "AhAd2s2d3h4d")
+		kmeans_flop, kmeans_turn = load_kmeans_classifiers()
+		self.assertEqual(predict_cluster_kmeans(kmeans_flop, ["Ah", "Ad", "2s", "2d", "3h"]), predict_cluster_kmeans(kmeans_flop, ["As", "Ad", "2s", "2d", "3h"]))
+		self.assertIn(predict_cluster_kmeans(kmeans_turn, ["Ah", "Ad", "2s", "2d", "3h", "4d"]), range(NUM_TURN_CLUSTERS))
 		# self.assertEqual(get_turn_cluster_id(kmeans_turn, "AhAd3s3d3h"), get_turn_cluster_id(kmeans_turn, "AsAd3s3d3h"))
 
+
+class EquityUnitTest(unittest.TestCase):
+	def test_evaluate_batch(self):
+		# Same ranks as phevaluator, on random hands and on hands with 5 to 7 cards of a suit
+		rng = np.random.default_rng(0)
+		hands = np.argsort(rng.random((20000, 52)), axis=1)[:, :7]
+		suited = np.array([[4 * rank + 2 for rank in rng.choice(13, 7, replace=False)] for _ in range(2000)])
+		suited[:, 5:] -= rng.integers(0, 3, size=(2000, 2))
+		for cards in [hands, suited]:
+			expected = [evaluate_cards(*hand) for hand in cards.tolist()]
+			self.assertEqual(fast_evaluator.evaluate_batch(cards.astype(np.uint8)).tolist(), expected)
+
+		boards, player_hands, opponent_hands = phEvaluatorSetup(2000)
+		winners = [evaluate_winner(*deal) for deal in zip(boards, player_hands, opponent_hands)]
+		self.assertEqual(evaluate_winners(boards, player_hands, opponent_hands).tolist(), winners)
+
+	def test_river(self):
+		# Exact against every opponent hand, with phevaluator on the strings
+		player_cards, board = ["Ah", "Kh"], ["2c", "7d", "9s", "Jh", "Qd"]
+		deck = [card for card in fast_evaluator.Deck() if card not in player_cards + board]
+		score = evaluate_cards(*(player_cards + board))
+		results = []
+		for i in range(len(deck)):
+			for j in range(i + 1, len(deck)):
+				opponent_score = evaluate_cards(*(board + [deck[i], deck[j]]))
+				results.append(1 if opponent_score > score else 0.5 if opponent_score == score else 0)
+		self.assertEqual(len(results), 990)
+		self.assertAlmostEqual(equity_engine.equity(player_cards, board), sum(results) / len(results))
+
+	def test_turn(self):
+		# The turn is the average of the 46 rivers, and a stratified sample with one runout per river is exact
+		player_cards, board = ["9c", "9d"], ["Ts", "8s", "2h", "Ks"]
+		deck = [card for card in fast_evaluator.Deck() if card not in player_cards + board]
+		rivers = [equity_engine.equity(player_cards, board + [card]) for card in deck]
+		self.assertAlmostEqual(equity_engine.equity(player_cards, board), sum(rivers) / 46)
+		self.assertAlmostEqual(
+			equity_engine.equity(player_cards, board, mode="stratified", n_runouts=46), sum(rivers) / 46
+		)
+
+		# Also with the equity of the abstraction, exact from the flop on, with ties counted as wins
+		rivers = [equity_engine.equity(player_cards, board + [card], tie_value=1.0) for card in deck]
+		self.assertAlmostEqual(calculate_equity(player_cards, board), sum(rivers) / 46)
+		self.assertAlmostEqual(calculate_equity(player_cards, board, n=100), sum(rivers) / 46)
+
+	def test_stratified(self):
+		# Seeded, so the same cards always get the same equity (and the same cluster). AA is about 85% pre-flop.
+		self.assertEqual(equity_engine.equity(["Ah", "Ad"], []), equity_engine.equity(["As", "Ac"], []))
+		self.assertAlmostEqual(equity_engine.equity(["Ah", "Ad"], [], n_runouts=500), 0.85, delta=0.03)
+		self.assertEqual(calculate_equity(["Ah", "Kd"], ["2c", "7d", "9s"]), calculate_equity(["Ah", "Kd"], ["2c", "7d", "9s"]))
+
+	def test_calculate_equity_flop(self):
+		# Exact on the flop: the average of the exact equities of the 47 turns
+		player_cards, board = ["Ah", "Kd"], ["2c", "7d", "9s"]
+		deck = [card for card in fast_evaluator.Deck() if card not in player_cards + board]
+		turns = [equity_engine.equity(player_cards, board + [card], tie_value=1.0) for card in deck]
+		self.assertAlmostEqual(calculate_equity(player_cards, board), sum(turns) / 47)
+		# Pre-flop, at least DEFAULT_RUNOUTS runouts
+		self.assertAlmostEqual(calculate_equity(["Ah", "Ad"], [], n=0), 0.85, delta=0.03)
+		self.assertAlmostEqual(calculate_equity(["Ah", "Ad"], []), 0.85, delta=0.02)
+
+	def test_equity_player_ties(self):
+		# Every hand plays the broadway straight on this board. Ties count as wins, so the equity is 1 like with
+		# `calculate_equity`, and the player always checks when it is not the dealer and there is no bet.
+		import aiplayer
+		board = ["Ts", "Jh", "Qd", "Kc", "Ac"]
+		self.assertEqual(calculate_equity(["2c", "3d"], board), 1.0)
+		for _ in range(20):
+			self.assertEqual(aiplayer.EquityAIPlayer.get_action(None, ["2c", "3d"], board, 100, 0, 2, 1000, False, True), "k")
+
+class HandIsomorphismUnitTest(unittest.TestCase):
+	def test_sizes(self):
+		sizes = {street: hand_isomorphism.get_indexer(street).size() for street in hand_isomorphism.ROUNDS}
+		self.assertEqual(sizes, {"preflop": 169, "flop": 1286792, "turn": 13960050, "river": 123156254})
+
+	def test_index(self):
+		rng = np.random.default_rng(0)
+		for street in ["flop", "turn", "river"]:
+			indexer = hand_isomorphism.get_indexer(street)
+			# unindex is the inverse of index, and gives hands of distinct cards
+			indices = rng.integers(0, indexer.size(), 20000)
+			hands = indexer.unindex(indices)
+			self.assertEqual(indexer.index(hands).tolist(), indices.tolist())
+			self.assertTrue((np.diff(np.sort(hands.astype(int), axis=1), axis=1) > 0).all())
+
+			# Same index after a permutation of the suits and of the board
+			hands = np.argsort(rng.random((5000, 52)), axis=1)[:, : indexer.n_cards]
+			suits = np.array([rng.permutation(4) for _ in range(5000)])
+			permuted = (hands >> 2) * 4 + np.take_along_axis(suits, hands & 3, axis=1)
+			permuted[:, 2:] = permuted[:, :1:-1]
+			self.assertEqual(indexer.index(hands).tolist(), indexer.index(permuted).tolist())
+
+		flop = hand_isomorphism.get_indexer("flop")
+		self.assertEqual(flop.index(["Ah", "Kh", "2h", "7c", "9d"]), flop.index(["As", "Ks", "9d", "2s", "7c"]))
+		self.assertEqual(flop.canonicalize(["As", "Ks", "9d", "2s", "7c"]), ["Kc", "Ac", "2c", "7h", "9d"])
+		self.assertEqual(predict_cluster(["Ah", "Kh", "2h", "7c", "9d", "Jh", "Js"]), predict_cluster(["As", "Ks", "2s", "7c", "9d", "Js", "Jh"]))
+
+
+class ClusterTableUnitTest(unittest.TestCase):
+	def test_build_table(self):
+		indexer = hand_isomorphism.get_indexer("river")
+		with tempfile.TemporaryDirectory() as directory:
+			path = cluster_tables.build_table("river", shard_size=1000, n_jobs=1, directory=directory, n_classes=3000)
+			table = np.load(path)
+			self.assertEqual((len(table), table.dtype), (3000, np.uint8))
+			for index in range(0, 3000, 300):
+				self.assertEqual(table[index], predict_hand_cluster(indexer.unindex(index)))
+
+			# Only the shards that are missing are computed again
+			shards = os.path.join(directory, "river", "shards")
+			os.remove(os.path.join(shards, "1000_2000.npy"))
+			modified = os.path.getmtime(os.path.join(shards, "0_1000.npy"))
+			self.assertEqual(np.load(cluster_tables.build_table("river", 1000, 1, directory, 3000)).tolist(), table.tolist())
+			self.assertEqual(os.path.getmtime(os.path.join(shards, "0_1000.npy")), modified)
+
+			# Not loaded, since it does not cover the whole street
+			self.assertNotIn("river", load_cluster_tables(directory))
+
+	def test_turn_buckets(self):
+		# Without KMeans, the turn table is made of equity buckets: a lookup gives the same cluster as computing it
+		import abstraction
+		indexer = hand_isomorphism.get_indexer("turn")
+		abstraction.USE_KMEANS = False
+		try:
+			with tempfile.TemporaryDirectory() as directory:
+				path = cluster_tables.build_table("turn", shard_size=50, n_jobs=1, directory=directory, n_classes=100)
+				table = np.zeros(indexer.size(), dtype=np.uint8)
+				table[:100] = np.load(path)
+			abstraction.cluster_tables["turn"] = table
+			rng = np.random.default_rng(0)
+			for index in range(100):
+				# A random suit permutation of the canonical hand
+				hand = indexer.unindex(np.array([index]))[0].astype(np.int64)
+				hand = (hand >> 2) * 4 + rng.permutation(4)[hand & 3]
+				cards = [fast_evaluator.RANKS[card >> 2] + fast_evaluator.SUITS[card & 3] for card in hand]
+				self.assertEqual(predict_cluster(cards), predict_cluster_fast(cards, total_clusters=NUM_TURN_CLUSTERS))
+		finally:
+			abstraction.USE_KMEANS = True
+			load_cluster_tables()
+
+	def test_lookup(self):
+		hand = ["Ah", "Ad", "2s", "2d", "3h"]
+		tables = load_cluster_tables(tempfile.gettempdir())
+		tables["flop"] = np.full(hand_isomorphism.get_indexer("flop").size(), 7, dtype=np.uint8)
+		try:
+			self.assertEqual(predict_cluster(hand), 7)
+		finally:
+			load_cluster_tables()
+
+	def test_lazy_loading(self):
+		# Importing the module does not load the tables, the first prediction does
+		import subprocess
+		code = "import abstraction; loaded = abstraction.cluster_tables_loaded; abstraction.predict_cluster(['Ah', 'Ad', '2s', '2d', '3h', '4c', '9h']); print(loaded, abstraction.cluster_tables_loaded)"
+		output = subprocess.run([sys.executable, "-c", code], cwd="../src", capture_output=True, text=True, check=True).stdout
+		self.assertEqual(output.splitlines()[-1], "False True")
+
+
+class EMDKMeansUnitTest(unittest.TestCase):
+	def test_emd(self):
+		rng = np.random.default_rng(0)
+		histograms = rng.random((20, 10))
+		histograms /= histograms.sum(axis=1, keepdims=True)
+		# Same as the optimal transport between the bins, with scipy
+		from scipy.stats import wasserstein_distance
+		for a, b in zip(histograms[:10], histograms[10:]):
+			self.assertAlmostEqual(emd_kmeans.emd(a, b), wasserstein_distance(np.arange(10), np.arange(10), a, b))
+		distances = emd_kmeans.emd_distances(emd_kmeans.to_cdfs(histograms[:10]), emd_kmeans.to_cdfs(histograms[10:]))
+		self.assertAlmostEqual(distances[3, 7], emd_kmeans.emd(histograms[3], histograms[17]))
+		self.assertEqual(emd_kmeans.emd([1, 0, 0, 0], [0, 0, 0, 1]), 3)
+
+	def test_fit(self):
+		# Histograms around 3 peaks, the clusters are the peaks
+		rng = np.random.default_rng(0)
+		peaks = rng.integers(3, size=3000)
+		histograms = np.eye(10)[[1, 5, 8]][peaks] + 0.05 * rng.random((3000, 10))
+		for batch_size in [None, 256]:
+			kmeans = emd_kmeans.EMDKMeans(3, batch_size=batch_size, random_state=1).fit(histograms)
+			self.assertEqual(len(set(zip(peaks.tolist(), kmeans.labels_.tolist()))), 3)
+			self.assertEqual(kmeans.predict(histograms).tolist(), kmeans.labels_.tolist())
+			self.assertTrue(np.allclose(kmeans.cluster_centers_.sum(axis=1), 1))
+
+		# Same seed, same clusters, with any number of processes
+		histograms = rng.random((6000, 10))
+		kmeans = emd_kmeans.EMDKMeans(8, random_state=2).fit(histograms)
+		parallel = emd_kmeans.EMDKMeans(8, random_state=2, n_jobs=2).fit(histograms)
+		self.assertEqual(kmeans.labels_.tolist(), parallel.labels_.tolist())
+		self.assertEqual(kmeans.inertia_, parallel.inertia_)
+
+	def test_init(self):
+		# Started from the peaks in another order, the cluster k should be the peak of init[k]
+		rng = np.random.default_rng(0)
+		peaks = rng.integers(3, size=3000)
+		histograms = np.eye(10)[[1, 5, 8]][peaks] + 0.05 * rng.random((3000, 10))
+		kmeans = emd_kmeans.EMDKMeans(3, init=np.eye(10)[[8, 1, 5]]).fit(histograms)
+		self.assertEqual(kmeans.labels_.tolist(), [[1, 2, 0][peak] for peak in peaks.tolist()])
+
+
 if __name__ == '__main__':
 	unittest.main()
\ No newline at end of file
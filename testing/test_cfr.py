@@ -0,0 +1,856 @@
+import unittest
+import os
+import sys
+import random
+import tempfile
+import joblib
+
+sys.path.append("../src")
+
+import numpy as np
+
+import base
+import checkpoint
+import kuhn
+import rps
+import postflop_holdem
+import preflop_holdem
+import abstraction
+from phevaluator import evaluate_cards
+import public_tree_cfr
+import public_chance_cfr
+import best_response
+import telemetry
+import profiling
+import strategy_export
+import parallel_cfr
+from fast_evaluator import phEvaluatorSetup
+
+
+def train_kuhn(iterations=2000, seed=0, method="vanilla", **kwargs):
+	random.seed(seed)
+	cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=iterations, **kwargs)
+	cfr.tracker_interval = iterations
+	cfr.solve(method=method)
+	return cfr
+
+
+def kuhn_expected_value(cfr, history):
+	# Expected value for player 0 when both players play the average strategy
+	if history.is_terminal():
+		return history.terminal_utility(0)
+	strategy = cfr.infoSets["".join(history.get_infoSet_key())].get_average_strategy()
+	return sum(p * kuhn_expected_value(cfr, history + a) for a, p in strategy.items())
+
+
+def kuhn_game_value(cfr):
+	deals = [[p, o] for p in "123" for o in "123" if p != o]
+	return sum(kuhn_expected_value(cfr, kuhn.KuhnHistory(deal)) for deal in deals) / len(deals)
+
+
+class InfoSetStoreUnitTests(unittest.TestCase):
+	def test_array_backend_parity(self):
+		# Both backends should give the same results for the same sequence of samples
+		dict_cfr = train_kuhn(backend="dict")
+		array_cfr = train_kuhn(backend="array")
+
+		self.assertEqual(len(dict_cfr.infoSets), len(array_cfr.infoSets))
+		for key, infoSet in dict_cfr.infoSets.items():
+			array_strategy = array_cfr.infoSets[key].get_average_strategy()
+			for a, p in infoSet.get_average_strategy().items():
+				self.assertAlmostEqual(p, array_strategy[a], places=9)
+
+	def test_array_store_growth(self):
+		store = base.ArrayInfoSetStore(capacity=2)
+		for i in range(100):
+			infoSet = store.get_infoSet(str(i), ["k", "bMIN", "bMAX"][: 2 + i % 2], i % 2)
+			infoSet.add_regret([1.0] * len(infoSet.actions()))
+
+		self.assertEqual(len(store), 100)
+		self.assertEqual(store["7"].actions(), ["k", "bMIN", "bMAX"])
+		self.assertEqual(store["8"].player(), 0)
+		self.assertEqual(store["8"].regret, {"k": 1.0, "bMIN": 1.0})
+		self.assertEqual(store.get_infoSet("8", ["k", "bMIN"], 0).regret_vector(), [1.0, 1.0])
+
+	def test_array_store_export(self):
+		cfr = train_kuhn(backend="array")
+		with tempfile.TemporaryDirectory() as folder:
+			filename = os.path.join(folder, "infoSets.joblib")
+			cfr.export_infoSets(filename)
+			infoSets = joblib.load(filename)
+
+		self.assertEqual(len(infoSets), len(cfr.infoSets))
+		for key, infoSet in cfr.infoSets.items():
+			self.assertEqual(infoSets[key].get_average_strategy(), infoSet.get_average_strategy())
+
+		dict_infoSets = infoSets.to_infoSets(kuhn.create_infoSet)
+		self.assertEqual(dict_infoSets["?1b"].cumulative_strategy, infoSets["?1b"].cumulative_strategy)
+
+	def test_memmap_store_parity(self):
+		# The memory-mapped store should train exactly like the array in memory, through several resizes of its files
+		set_postflop_dataset(*random_postflop_dataset(n_samples=100))
+		with tempfile.TemporaryDirectory() as directory:
+			cfrs = []
+			for spill_directory in [None, directory]:
+				cfr = base.CFR(
+					postflop_holdem.create_infoSet, postflop_holdem.create_compiled_history, iterations=100,
+					backend="array", spill_directory=spill_directory, resident_limit_mb=0,
+				)
+				cfr.tracker_interval = 25  # `track` flushes the store, and releases its pages with this limit
+				metrics = telemetry.Telemetry(os.path.join(directory, "metrics.jsonl"))
+				cfr.solve(method="batched", batch_size=25, telemetry=metrics)
+				cfrs.append(cfr)
+
+			store = cfrs[1].infoSets
+			self.assertIsInstance(store.regret, np.memmap)
+			self.assertGreater(len(store), 1024)
+			self.assertEqual(store.keys(), cfrs[0].infoSets.keys())
+			for name in ["regret", "strategy", "cumulative_strategy"]:
+				np.testing.assert_array_equal(
+					getattr(store, name)[: store.n_actions], getattr(cfrs[0].infoSets, name)[: store.n_actions]
+				)
+
+			# Exported as an array store in memory, that does not need the files
+			filename = os.path.join(directory, "infoSets.joblib")
+			cfrs[1].export_infoSets(filename)
+			exported = joblib.load(filename)
+			store.close()
+			self.assertEqual(sorted(os.listdir(directory)), ["infoSets.joblib", "metrics.jsonl"])
+		self.assertIs(type(exported), base.ArrayInfoSetStore)
+		self.assertEqual(exported.keys(), cfrs[0].infoSets.keys())
+		np.testing.assert_array_equal(exported.regret, cfrs[0].infoSets.regret[: exported.n_actions])
+
+
+	@unittest.skipUnless(os.path.exists("/proc/self/smaps"), "needs /proc/self/smaps")
+	def test_memmap_store_resident_size(self):
+		import memmap_store
+
+		def resident_bytes(directory):
+			# Resident pages of the mappings of the files of `directory`
+			total, mapped = 0, False
+			with open("/proc/self/smaps") as f:
+				for line in f:
+					fields = line.split()
+					if "-" in fields[0] and not fields[0].endswith(":"):
+						mapped = len(fields) >= 6 and fields[5].startswith(directory)
+					elif fields[0] == "Rss:" and mapped:
+						total += int(fields[1]) * 1024
+			return total
+
+		with tempfile.TemporaryDirectory() as directory:
+			store = memmap_store.MemmapInfoSetStore(directory, resident_limit_mb=1)
+			for i in range(100000):
+				store.index(2 * i, store.add_infoSet(f"key{i}", ["f", "c", "r"], i % 2))
+			store.regret[: store.n_actions] = np.arange(store.n_actions)
+			self.assertGreater(store.mapped_bytes(), 10 * 2**20)
+			self.assertGreater(resident_bytes(directory), 2**20)
+
+			# The key index is on disk too
+			self.assertIsInstance(store.ids, memmap_store.KeyIndex)
+			store.flush()
+			self.assertLessEqual(resident_bytes(directory), 2**20)
+
+			# Only the most recently used blocks are kept, and the released infosets are read back from the files
+			last = store.n_infoSets - 1
+			self.assertEqual(store.find(2 * last), last)
+			store.flush()
+			kept_rows, _ = store._kept_blocks()
+			used = store.rows_used[: len(kept_rows)]
+			self.assertTrue(kept_rows[last // memmap_store.BLOCK_ROWS])
+			self.assertFalse(kept_rows.all())
+			self.assertGreaterEqual(used[kept_rows].min(), used[~kept_rows].max())
+			self.assertLessEqual(resident_bytes(directory), 2**20)
+			self.assertEqual(store.find(2 * 7), 7)
+			self.assertEqual(store.ids["key7"], 7)
+			self.assertEqual(store.infoSet_keys[7], "key7")
+			self.assertEqual(store[f"key{last}"].actions(), ["f", "c", "r"])
+			self.assertEqual(store[f"key{last}"].regret, {"f": 3 * last, "c": 3 * last + 1, "r": 3 * last + 2})
+			store.close()
+			self.assertEqual(os.listdir(directory), [])
+
+
+class SolverUnitTests(unittest.TestCase):
+	# The game value of Kuhn poker is -1/18 for player 0
+	def test_vanilla(self):
+		cfr = train_kuhn(iterations=10000, method="vanilla")
+		self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.005)
+
+	def test_external_sampling(self):
+		cfr = train_kuhn(iterations=20000, method="external")
+		self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.01)
+
+	def test_simultaneous_updates(self):
+		add = kuhn.KuhnHistory.__add__
+		visits = {}
+
+		def counting_add(self, action):
+			visits[method] = visits.get(method, 0) + 1
+			return add(self, action)
+
+		cfrs = {}
+		kuhn.KuhnHistory.__add__ = counting_add
+		try:
+			for method in ["vanilla", "vanilla_speedup"]:
+				cfrs[method] = train_kuhn(iterations=10000, method=method)
+		finally:
+			kuhn.KuhnHistory.__add__ = add
+
+		self.assertEqual(visits["vanilla"], 2 * visits["vanilla_speedup"])
+		for cfr in cfrs.values():
+			self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.005)
+
+	def test_outcome_sampling(self):
+		cfr = train_kuhn(iterations=20000, method="outcome")
+		self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.01)
+
+	def test_regret_based_pruning(self):
+		for method in ["vanilla", "vanilla_speedup", "external"]:
+			cfr = train_kuhn(iterations=10000, method=method, prune_threshold=-50)
+			self.assertGreater(cfr.pruned_fraction(), 0.1, msg=method)
+			self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.01, msg=method)
+
+		# Without pruning, nothing is skipped
+		cfr = train_kuhn(iterations=1000, method="vanilla")
+		self.assertEqual(cfr.nodes_pruned, 0)
+		self.assertGreater(cfr.nodes_visited, 0)
+
+	def test_parallel_workers(self):
+		random.seed(0)
+		cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=20000, backend="array")
+		cfr.tracker_interval = cfr.iterations
+		cfr.solve(method="external", n_workers=3, round_size=500)
+
+		self.assertEqual(cfr.iteration, 20000)
+		self.assertEqual(len(cfr.infoSets), 12)
+		self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.01)
+
+	def test_shared_store(self):
+		# The arrays stay in shared memory between rounds, and are only copied again when the store grows
+		store = base.ArrayInfoSetStore(capacity=4)
+		store.get_infoSet("a", ["p", "b"], 0)
+		store.regret[:2] = [1.0, 2.0]
+		shared = parallel_cfr.SharedStore(store)
+		shared.share()
+		copied = shared.bytes_copied
+		regret = store.regret
+		shared.share()
+		self.assertIs(store.regret, regret)
+		self.assertEqual(shared.bytes_copied, copied)
+
+		for i in range(10):
+			store.get_infoSet(str(i), ["p", "b"], 0)
+		shared.share()
+		self.assertGreater(shared.bytes_copied, copied)
+		self.assertIs(shared.arrays["regret"], store.regret)
+		shared.release()
+		self.assertEqual(shared.blocks, {})
+		self.assertEqual(store["a"].regret_vector(), [1.0, 2.0])
+
+
+class RegretPolicyUnitTests(unittest.TestCase):
+	def test_policies_converge(self):
+		for policy in ["cfr+", "linear", "dcfr"]:
+			cfr = train_kuhn(iterations=10000, method="vanilla", policy=policy)
+			self.assertAlmostEqual(kuhn_game_value(cfr), -1 / 18, delta=0.005, msg=policy)
+
+	def test_cfr_plus_regret_floor(self):
+		cfr = train_kuhn(iterations=1000, method="vanilla", policy="cfr+", backend="array")
+		for infoSet in cfr.infoSets.values():
+			self.assertGreaterEqual(min(infoSet.regret_vector()), 0)
+
+	def test_dcfr_lazy_discount(self):
+		# The lazy discounts should give the same regrets as discounting every infoset at the end of every iteration
+		alpha, beta = 1.5, 0.5
+		updates = {1: [1.0, -2.0], 2: [0.5, 0.5], 6: [-3.0, 1.0], 10: [0.0, 0.0]}
+		infoSets = [
+			kuhn.create_infoSet(["1", "?"], ["p", "b"], 0),
+			base.ArrayInfoSetStore().get_infoSet("1?", ["p", "b"], 0),
+		]
+		for infoSet in infoSets:
+			policy = base.DiscountedCFR(alpha=alpha, beta=beta)
+			regret = [0.0, 0.0]
+			for t in range(1, 11):
+				if t in updates:
+					policy.update_regret(infoSet, updates[t], t)
+					regret = [r + u for r, u in zip(regret, updates[t])]
+				if t < 10:
+					regret = [r * (t**alpha / (t**alpha + 1) if r > 0 else t**beta / (t**beta + 1)) for r in regret]
+
+			for r, expected in zip(infoSet.regret_vector(), regret):
+				self.assertAlmostEqual(r, expected, places=9)
+
+	def test_dcfr_old_infoSets(self):
+		# Infosets pickled before `last_update` existed can still be trained with DCFR
+		infoSet = kuhn.create_infoSet(["1", "?"], ["p", "b"], 0)
+		del infoSet.__dict__["last_update"]
+		infoSet = joblib.load(joblib.dump(infoSet, os.path.join(tempfile.mkdtemp(), "infoSet.joblib"))[0])
+		base.DiscountedCFR().update_regret(infoSet, [1.0, -1.0], 3)
+		self.assertEqual(infoSet.regret_vector(), [1.0, -1.0])
+		self.assertEqual(infoSet.last_update, 3)
+
+
+class CheckpointUnitTests(unittest.TestCase):
+	def test_resume(self):
+		def crashing_create_history(t):
+			if t == 650:
+				raise RuntimeError("crash")
+			return kuhn.create_history(t)
+
+		for backend in ["dict", "array"]:
+			reference = train_kuhn(iterations=1000, method="external", backend=backend)
+			with tempfile.TemporaryDirectory() as folder:
+				random.seed(0)
+				cfr = base.CFR(kuhn.create_infoSet, crashing_create_history, iterations=1000, backend=backend)
+				cfr.tracker_interval = cfr.iterations
+				with self.assertRaises(RuntimeError):
+					cfr.solve(method="external", checkpointer=checkpoint.Checkpointer(folder, every_iterations=100))
+
+				random.seed(1)  # The random state should come from the checkpoint
+				cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=1000, backend=backend)
+				cfr.tracker_interval = cfr.iterations
+				cfr.solve(method="external", checkpointer=checkpoint.Checkpointer(folder), resume=True)
+
+			self.assertEqual(cfr.iteration, reference.iteration)
+			self.assertEqual(sorted(cfr.infoSets.keys()), sorted(reference.infoSets.keys()))
+			for key, infoSet in reference.infoSets.items():
+				self.assertEqual(cfr.infoSets[key].regret_vector(), infoSet.regret_vector(), msg=backend)
+				self.assertEqual(cfr.infoSets[key].cumulative_strategy, infoSet.cumulative_strategy, msg=backend)
+
+	def test_resumed_game_value(self):
+		# The average game values are over the iterations of the call, also after a resume
+		def crashing_iterate(method, t, T, debug=False):
+			if t == 650:
+				raise RuntimeError("crash")
+			return 1.0, -2.0
+
+		with tempfile.TemporaryDirectory() as folder:
+			cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=1000)
+			cfr.tracker_interval = 100
+			cfr.iterate = crashing_iterate
+			tracked = []
+			cfr.track = lambda game_value_0, game_value_1: tracked.append((game_value_0, game_value_1))
+			with self.assertRaises(RuntimeError):
+				cfr.solve(checkpointer=checkpoint.Checkpointer(folder, every_iterations=100))
+
+			resumed = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=1000)
+			resumed.tracker_interval = 100
+			resumed.iterate = lambda method, t, T, debug=False: (1.0, -2.0)
+			resumed.track = cfr.track
+			resumed.solve(checkpointer=checkpoint.Checkpointer(folder), resume=True)
+		self.assertEqual(len(tracked), 10)
+		for game_value_0, game_value_1 in tracked:
+			self.assertAlmostEqual(game_value_0, 1.0)
+			self.assertAlmostEqual(game_value_1, -2.0)
+
+	def test_incremental_segments(self):
+		cfr = train_kuhn(iterations=100, method="vanilla", backend="array")
+		with tempfile.TemporaryDirectory() as folder:
+			checkpointer = checkpoint.Checkpointer(folder)
+			checkpointer.save(cfr, cfr.iterations)
+			cfr.get_infoSet(kuhn.KuhnHistory(["1", "2"])).add_regret([1.0, 0.0])
+			checkpointer.save(cfr, cfr.iterations)
+
+			manifest = checkpointer.latest()
+			self.assertEqual(len(manifest["segments"]), 2)
+			self.assertEqual(manifest["rows"], len(cfr.infoSets) + 1)
+
+			resumed = base.CFR(kuhn.create_infoSet, kuhn.create_history, backend="array")
+			checkpointer.load(resumed)
+			self.assertEqual(resumed.infoSets["1?"].regret_vector(), cfr.infoSets["1?"].regret_vector())
+
+
+def random_postflop_dataset(n_samples=200, n_clusters=3, seed=0):
+	rng = np.random.default_rng(seed)
+	player_clusters = rng.integers(n_clusters, size=(3, n_samples))
+	opp_clusters = rng.integers(n_clusters, size=(3, n_samples))
+	winners = rng.integers(-1, 2, size=n_samples)
+	return player_clusters, opp_clusters, winners
+
+
+def set_postflop_dataset(player_clusters, opp_clusters, winners):
+	# Same variables as the `__main__` of `postflop_holdem.py` sets, with the same cards for every sample
+	n_samples = len(winners)
+	postflop_holdem.boards = [["2c", "7d", "9h", "Js", "Kc"]] * n_samples
+	postflop_holdem.player_hands = [["Ah", "Ad"]] * n_samples
+	postflop_holdem.opponent_hands = [["3s", "4s"]] * n_samples
+	for name, player_stage_clusters, opp_stage_clusters in zip(["flop", "turn", "river"], player_clusters, opp_clusters):
+		setattr(postflop_holdem, f"player_{name}_clusters", player_stage_clusters)
+		setattr(postflop_holdem, f"opp_{name}_clusters", opp_stage_clusters)
+	postflop_holdem.winners = winners
+
+
+def uniform_expected_value(history):
+	# Expected value for player 0 when both players play uniformly at random
+	if history.is_terminal():
+		return history.terminal_utility(0)
+	if history.is_chance():
+		return uniform_expected_value(history + postflop_holdem.placeholder_chance_outcome(history))
+	actions = history.actions()
+	return sum(uniform_expected_value(history + a) for a in actions) / len(actions)
+
+
+class PublicTreeUnitTests(unittest.TestCase):
+	def test_terminal_values(self):
+		# The first iteration plays uniformly, so the root value is the average over the samples of the uniform value
+		player_clusters, opp_clusters, winners = random_postflop_dataset()
+		cfr = public_tree_cfr.PublicTreeCFR(player_clusters, opp_clusters, winners, iterations=1)
+		value = cfr.solve()
+
+		set_postflop_dataset(player_clusters, opp_clusters, winners)
+		expected = np.mean(
+			[uniform_expected_value(postflop_holdem.PostflopHoldemHistory(sample_id=i)) for i in range(len(winners))]
+		)
+		self.assertAlmostEqual(value, expected, places=9)
+
+	def test_infoSet_keys(self):
+		player_clusters, opp_clusters, winners = random_postflop_dataset()
+		cfr = public_tree_cfr.PublicTreeCFR(player_clusters, opp_clusters, winners, iterations=1)
+		infoSets = cfr.to_infoSets()
+
+		set_postflop_dataset(player_clusters, opp_clusters, winners)
+		history = postflop_holdem.PostflopHoldemHistory(["XxXx", "XxXx", "/", "XxXxXx", "k"], sample_id=7)
+		for action in ["bMIN", "c", "bMAX"]:
+			key = "".join(history.get_infoSet_key())
+			self.assertIn(key, infoSets)
+			self.assertEqual(infoSets[key].actions(), history.actions())
+			self.assertEqual(infoSets[key].player(), history.player())
+			history = history + action
+			while not history.is_terminal() and history.is_chance():
+				history = history + postflop_holdem.placeholder_chance_outcome(history)
+
+	def test_dominated_player_folds(self):
+		# Player 0 wins every showdown, so player 1 should fold against a pot sized bet on the flop
+		player_clusters, opp_clusters, winners = random_postflop_dataset()
+		cfr = public_tree_cfr.PublicTreeCFR(player_clusters, opp_clusters, np.ones_like(winners), iterations=300, policy="dcfr")
+		cfr.solve()
+		infoSets = cfr.to_infoSets()
+		for cluster in range(3):
+			self.assertGreater(infoSets[f"{cluster}bMAX"].get_average_strategy()["f"], 0.9)
+
+
+class PublicChanceUnitTests(unittest.TestCase):
+	def random_board(self, n_hands):
+		random.seed(1)
+		board = random.sample(sorted(public_chance_cfr.CARDS), 5)
+		hands = random.sample(abstraction.get_board_hands(board), n_hands)
+		scores = np.array([evaluate_cards(*(board + hand)) for hand in hands])
+		return hands, scores
+
+	def test_terminal_reach(self):
+		# The sort-based fold and showdown values should match the sums over all the pairs of hands
+		hands, scores = self.random_board(200)
+		board = public_chance_cfr.PublicBoard(hands, scores)
+		reach = np.random.default_rng(0).random(len(hands))
+		compatible_reach = board.compatible_reach(reach)
+		showdown_reach = board.showdown_reach(reach)
+		for h, hand in enumerate(hands):
+			compatible = [k for k in range(len(hands)) if not set(hands[k]) & set(hand)]
+			self.assertAlmostEqual(compatible_reach[h], reach[compatible].sum())
+			self.assertAlmostEqual(showdown_reach[h], (reach[compatible] * np.sign(scores[compatible] - scores[h])).sum())
+
+	def test_batched_parity(self):
+		# One board with all the hands should give the same regrets as "batched" on all the pairs of hands of the board,
+		# up to the 1 / (number of pairs) weight
+		hands, scores = self.random_board(30)
+		clusters = np.random.default_rng(0).integers(3, size=(3, len(hands)))
+		postflop_holdem.public_hands, postflop_holdem.public_clusters, postflop_holdem.public_scores = [hands], [clusters], [scores]
+		pairs = np.array([(a, b) for a in range(len(hands)) for b in range(len(hands)) if not set(hands[a]) & set(hands[b])])
+		set_postflop_dataset(clusters[:, pairs[:, 0]], clusters[:, pairs[:, 1]], np.sign(scores[pairs[:, 1]] - scores[pairs[:, 0]]))
+
+		cfrs = []
+		for method, iterations in [("public_chance", 1), ("batched", len(pairs))]:
+			cfr = base.CFR(postflop_holdem.create_infoSet, postflop_holdem.create_compiled_history, iterations=iterations, backend="array")
+			cfr.tracker_interval = 10 * iterations
+			cfr.solve(method=method, batch_size=len(pairs))
+			cfrs.append(cfr)
+
+		self.assertEqual(sorted(cfrs[0].infoSets.keys()), sorted(cfrs[1].infoSets.keys()))
+		for key, infoSet in cfrs[0].infoSets.items():
+			np.testing.assert_allclose(
+				len(pairs) * np.array(infoSet.regret_vector()), cfrs[1].infoSets[key].regret_vector(), atol=1e-9
+			)
+
+
+class CompiledTreeUnitTests(unittest.TestCase):
+	def test_training_parity(self):
+		# Training on the compiled tree should give exactly the same infosets as the original history
+		set_postflop_dataset(*random_postflop_dataset(n_samples=30))
+		cfrs = []
+		for create_history in [postflop_holdem.create_history, postflop_holdem.create_compiled_history]:
+			random.seed(0)
+			cfr = base.CFR(postflop_holdem.create_infoSet, create_history, iterations=30, backend="array")
+			cfr.tracker_interval = cfr.iterations
+			cfr.solve(method="vanilla_speedup")
+			cfrs.append(cfr)
+
+		self.assertEqual(sorted(cfrs[0].infoSets.keys()), sorted(cfrs[1].infoSets.keys()))
+		for key, infoSet in cfrs[0].infoSets.items():
+			self.assertEqual(cfrs[1].infoSets[key].regret_vector(), infoSet.regret_vector())
+
+	def test_batched_parity(self):
+		# With one deal per batch, batched training should do the same updates as "vanilla_speedup". The infosets
+		# that are only reached with probability 0 are not created by the batched traversal, they have no regrets.
+		set_postflop_dataset(*random_postflop_dataset(n_samples=30))
+		cfrs = []
+		for method in ["vanilla_speedup", "batched"]:
+			cfr = base.CFR(postflop_holdem.create_infoSet, postflop_holdem.create_compiled_history, iterations=30, backend="array")
+			cfr.tracker_interval = 10 * cfr.iterations
+			cfr.solve(method=method, batch_size=1)
+			cfrs.append(cfr)
+
+		for key, infoSet in cfrs[0].infoSets.items():
+			if key in cfrs[1].infoSets:
+				np.testing.assert_allclose(cfrs[1].infoSets[key].regret_vector(), infoSet.regret_vector(), atol=1e-9)
+				np.testing.assert_allclose(
+					list(cfrs[1].infoSets[key].cumulative_strategy.values()),
+					list(infoSet.cumulative_strategy.values()),
+					atol=1e-9,
+				)
+			else:
+				self.assertEqual(max(map(abs, infoSet.regret_vector())), 0)
+
+	def test_infoSet_ids(self):
+		# The integer ids of the compiled tree should be in one to one correspondence with the string keys
+		set_postflop_dataset(*random_postflop_dataset(n_samples=20))
+		keys = {}
+
+		def visit(history):
+			if history.is_terminal():
+				return
+			infoSet_id = history.get_infoSet_id()
+			self.assertLess(infoSet_id, history.tree.n_infoSet_ids)
+			keys.setdefault(infoSet_id, "".join(history.get_infoSet_key()))
+			self.assertEqual(keys[infoSet_id], "".join(history.get_infoSet_key()))
+			for action in history.actions():
+				visit(history + action)
+
+		for sample_id in range(20):
+			visit(postflop_holdem.create_compiled_history(sample_id))
+		self.assertEqual(len(set(keys.values())), len(keys))
+
+	def test_histories(self):
+		set_postflop_dataset(*random_postflop_dataset(n_samples=10))
+		history = postflop_holdem.create_history(4)
+		while history.is_chance():
+			history = history + history.sample_chance_outcome()
+		compiled = postflop_holdem.create_compiled_history(4)
+
+		for action in ["k", "bMIN", "c", "bMAX", "c", "k", "bMIN", "f"]:
+			self.assertEqual(compiled.history, history.history)
+			self.assertEqual(compiled.player(), history.player())
+			self.assertEqual(compiled.actions(), history.actions())
+			self.assertEqual(compiled.get_infoSet_key(), history.get_infoSet_key())
+			history = history + action
+			while not history.is_terminal() and history.is_chance():
+				history = history + history.sample_chance_outcome()
+			compiled = compiled + action
+
+		self.assertTrue(compiled.is_terminal())
+		self.assertEqual(compiled.history, history.history)
+		for i in [0, 1]:
+			self.assertEqual(compiled.terminal_utility(i), history.terminal_utility(i))
+
+
+class HistoryUnitTests(unittest.TestCase):
+	def tearDown(self):
+		preflop_holdem.equity_table = None
+
+	def test_preflop_equity_showdown(self):
+		# With an equity table, a pre-flop showdown pays the expected value of the hands, whatever the board
+		preflop_holdem.equity_table = np.full((169, 169), 0.5)
+		preflop_holdem.equity_table[0, preflop_holdem.get_preflop_cluster_id("AsKs") - 1] = 0.8  # AA against AKs
+		history = preflop_holdem.PreflopHoldemHistory(["AhAd", "AsKs", "bMIN", "c", "/", "2c3c4c5c6c"])
+		pot_size, _ = history.pot
+		self.assertAlmostEqual(history.terminal_utility(0), 0.6 * pot_size / 2)
+		self.assertAlmostEqual(history.terminal_utility(1), -0.6 * pot_size / 2)
+
+	def assertSameState(self, history, rebuilt):
+		self.assertEqual(rebuilt.is_terminal(), history.is_terminal())
+		if history.is_terminal():
+			for i in [0, 1]:
+				self.assertEqual(rebuilt.terminal_utility(i), history.terminal_utility(i))
+		else:
+			self.assertEqual(rebuilt.player(), history.player())
+			if not history.is_chance():
+				self.assertEqual(rebuilt.get_infoSet_key(), history.get_infoSet_key())
+
+	def test_incremental_state(self):
+		# The state carried forward by `__add__` should be the same as the one of a history built from the list, and
+		# as the one recomputed from the whole history by `check`
+		def visit(history, rebuild, check=None):
+			self.assertSameState(history, rebuild(list(history.history)))
+			if check is not None:
+				check(history)
+			if history.is_terminal():
+				return
+			if history.is_chance():
+				actions = [history.sample_chance_outcome()]
+			else:
+				actions = history.actions()
+			for action in actions:
+				visit(history + action, rebuild, check)
+
+		for cards in [["1", "2"], ["3", "1"]]:
+			visit(kuhn.KuhnHistory(cards), kuhn.KuhnHistory)
+
+		def check_rps(history):
+			# The choice of player 0 is hidden from player 1
+			if not history.is_terminal():
+				key = ["?" for _ in history.history[:1]] + history.history[1:]
+				self.assertEqual(history.get_infoSet_key(), key)
+
+		visit(rps.RPSHistory(), rps.RPSHistory, check_rps)
+
+		set_postflop_dataset(*random_postflop_dataset(n_samples=5))
+		for sample_id in range(5):
+			visit(
+				postflop_holdem.create_history(sample_id),
+				lambda history: postflop_holdem.PostflopHoldemHistory(history, sample_id),
+			)
+
+	def test_incremental_state_preflop(self):
+		random.seed(0)
+		preflop_holdem.boards, preflop_holdem.player_hands, preflop_holdem.opponent_hands = phEvaluatorSetup(5)
+		preflop_holdem.winners = [
+			preflop_holdem.evaluate_winner(*deal)
+			for deal in zip(preflop_holdem.boards, preflop_holdem.player_hands, preflop_holdem.opponent_hands)
+		]
+
+		def utility(history, i):
+			# Recomputed from the whole history: the pot before the bet that was folded to, or the final pot
+			actions = history.history
+			if "f" in actions:
+				pot_size, latest_bet = history._get_total_pot_size(actions[: actions.index("f") - 1])
+				if actions[-3] in ["bMIN", "bMID"]:
+					pot_size += latest_bet
+				return -pot_size / 2 if len(actions) % 2 == i else pot_size / 2
+			pot_size, _ = history._get_total_pot_size(actions)
+			winner = preflop_holdem.winners[history.sample_id]
+			return 0 if winner == 0 else (pot_size / 2 if winner == (1 if i == 0 else -1) else -pot_size / 2)
+
+		def visit(history):
+			actions = history.history
+			self.assertEqual(history.pot, history._get_total_pot_size(actions))
+			self.assertEqual(history.previous_pot, history._get_total_pot_size(actions[:-1]))
+			self.assertEqual(history.betting, tuple(a for a in actions if a in preflop_holdem.DISCRETE_ACTIONS))
+			rebuilt = preflop_holdem.PreflopHoldemHistory(list(actions), history.sample_id)
+			if history.is_terminal():
+				for i in [0, 1]:
+					self.assertEqual(history.terminal_utility(i), utility(history, i))
+					self.assertEqual(rebuilt.terminal_utility(i), utility(history, i))
+				return
+			if history.is_chance():
+				visit(history + history.sample_chance_outcome())
+				return
+			key = [str(preflop_holdem.get_preflop_cluster_id(actions[history.player()]))] + list(history.betting)
+			self.assertEqual(history.get_infoSet_key(), key)
+			self.assertEqual(rebuilt.get_infoSet_key(), key)
+			for action in history.actions():
+				visit(history + action)
+
+		for sample_id in range(5):
+			visit(preflop_holdem.create_history(sample_id))
+
+		# A fold after a raise pays the pot before the raise: 3 chips of blinds and the min bet of 2
+		history = preflop_holdem.PreflopHoldemHistory(["AhAd", "KsKc"])
+		for action in ["bMIN", "bMAX", "f", "/", "2c3c4c5c7d"]:
+			history = history + action
+		self.assertEqual(history.fold_pot, (5, 3))
+		self.assertEqual([history.terminal_utility(0), history.terminal_utility(1)], [2.5, -2.5])
+
+
+class DealChanceHistory:
+	# Wraps the histories of a game on a dataset, with a first chance node that chooses the sample uniformly, so that
+	# `CFR.get_best_response` computes the exact best response on the whole dataset
+	def __init__(self, create_history, n_samples, history=None):
+		self.create_history = create_history
+		self.n_samples = n_samples
+		self.inner = history
+
+	def __add__(self, action):
+		history = self.create_history(action) if self.inner is None else self.inner + action
+		while history.is_chance() and not history.is_terminal():
+			history = history + history.sample_chance_outcome()
+		return DealChanceHistory(self.create_history, self.n_samples, history)
+
+	def is_terminal(self):
+		return self.inner is not None and self.inner.is_terminal()
+
+	def is_chance(self):
+		return self.inner is None
+
+	def actions(self):
+		return list(range(self.n_samples)) if self.inner is None else self.inner.actions()
+
+	def __getattr__(self, name):
+		return getattr(self.inner, name)
+
+
+class BestResponseUnitTests(unittest.TestCase):
+	def tearDown(self):
+		preflop_holdem.equity_table = None
+
+	def test_kuhn_exploitability(self):
+		exploitability = [train_kuhn(iterations).exploitability() for iterations in [10, 5000]]
+		self.assertGreater(exploitability[0], exploitability[1])
+		self.assertGreaterEqual(exploitability[1], 0)
+		self.assertLess(exploitability[1], 0.02)
+
+	def test_postflop_parity(self):
+		# The vectorized best response should match the one that walks every history of the dataset
+		set_postflop_dataset(*random_postflop_dataset(n_samples=40))
+		cfr = postflop_holdem.PostflopHoldemCFR(
+			postflop_holdem.create_infoSet, postflop_holdem.create_compiled_history, iterations=40, backend="array"
+		)
+		cfr.tracker_interval = 10 * cfr.iterations
+		cfr.solve(method="batched", batch_size=10)
+
+		br = best_response.postflop_best_response(cfr)
+		root = DealChanceHistory(postflop_holdem.create_compiled_history, 40)
+		for i in [0, 1]:
+			self.assertAlmostEqual(br.value(i), cfr.get_best_response(root, i)[0])
+
+	def test_preflop_parity(self):
+		random.seed(0)
+		preflop_holdem.boards, preflop_holdem.player_hands, preflop_holdem.opponent_hands = phEvaluatorSetup(100)
+		preflop_holdem.winners = [
+			preflop_holdem.evaluate_winner(*deal)
+			for deal in zip(preflop_holdem.boards, preflop_holdem.player_hands, preflop_holdem.opponent_hands)
+		]
+		cfr = preflop_holdem.PreflopHoldemCFR(preflop_holdem.create_infoSet, preflop_holdem.create_history, iterations=100)
+		cfr.tracker_interval = 10 * cfr.iterations
+		cfr.solve(method="vanilla")
+
+		br = best_response.preflop_best_response(cfr)
+		root = DealChanceHistory(preflop_holdem.create_history, 100)
+		for i in [0, 1]:
+			self.assertAlmostEqual(br.value(i), cfr.get_best_response(root, i)[0])
+
+		# With an equity table, every pair of clusters is a deal
+		preflop_holdem.equity_table = np.full((169, 169), 0.5)
+		self.assertGreaterEqual(cfr.exploitability(), 0)
+		self.assertAlmostEqual(best_response.get_preflop_matchup_weights().sum(), 1)
+
+	def test_track_exploitability(self):
+		random.seed(0)
+		cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=100, track_exploitability=True)
+		cfr.tracker_interval = 50
+		cfr.solve()
+		self.assertEqual(sorted(cfr.tracker.exploitability), [50, 100])
+
+
+class TelemetryUnitTests(unittest.TestCase):
+	def test_records(self):
+		for extension in ["jsonl", "csv"]:
+			with tempfile.TemporaryDirectory() as directory:
+				path = os.path.join(directory, f"metrics.{extension}")
+				random.seed(0)
+				cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=100)
+				cfr.tracker_interval = 50
+				cfr.solve(telemetry=telemetry.Telemetry(path, exploitability_samples=0))
+
+				records = telemetry.load(path)
+				self.assertEqual([record["iteration"] for record in records], [50, 100])
+				self.assertEqual(set(records[-1]), set(telemetry.FIELDS))
+				self.assertEqual(records[-1]["infosets"], 12)
+				self.assertGreater(records[-1]["iterations_per_second"], 0)
+				self.assertGreater(records[-1]["rss_mb"], 0)
+				self.assertAlmostEqual(records[-1]["exploitability"], cfr.exploitability())
+				self.assertEqual(cfr.tracker.tracker_hist, [])  # No snapshots of the infosets
+
+	def test_sampled_exploitability(self):
+		set_postflop_dataset(*random_postflop_dataset(n_samples=40))
+		cfr = postflop_holdem.PostflopHoldemCFR(
+			postflop_holdem.create_infoSet, postflop_holdem.create_compiled_history, iterations=40, backend="array"
+		)
+		cfr.tracker_interval = 10 * cfr.iterations
+		cfr.solve(method="batched", batch_size=40)
+		samples = best_response.sample_deals(40, 10, cfr.iteration)
+		self.assertEqual(len(samples), 10)
+		self.assertAlmostEqual(
+			cfr.exploitability(n_samples=10), best_response.postflop_best_response(cfr, samples).exploitability()
+		)
+		self.assertEqual(cfr.exploitability(n_samples=100), cfr.exploitability())
+
+
+class ProfilingUnitTests(unittest.TestCase):
+	def test_profile(self):
+		# Profiling should not change the training, and should put every wrapped method back at the end
+		profiled = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=200)
+		profiled.tracker_interval = 10 * profiled.iterations
+		profiler = profiling.Profiler(report_path=None, cprofile_every=50)
+		add = vars(kuhn.KuhnHistory).get("__add__")
+		random.seed(0)
+		profiled.solve(profile=profiler)
+		cfr = train_kuhn(200)
+
+		for key, infoSet in cfr.infoSets.items():
+			self.assertEqual(profiled.infoSets[key].regret, infoSet.regret)
+		self.assertEqual(profiler.calls["KuhnHistory.terminal_utility"], profiler.calls["KuhnHistory.__add__"] // 2)
+		self.assertEqual(profiler.counters["infoSet creations"], 12)
+		self.assertEqual(profiler.counters["iterations"], 200)
+		self.assertIs(vars(kuhn.KuhnHistory).get("__add__"), add)
+		self.assertNotIn("get_infoSet", vars(profiled))
+		self.assertNotIn("update_regret", vars(profiled.policy))
+		self.assertIn("KuhnHistory.get_infoSet_id", profiler.report(profiled))
+
+	def test_profile_workers(self):
+		# The timers and counters of the workers should be sent back to the main process
+		cfr = base.CFR(kuhn.create_infoSet, kuhn.create_history, iterations=200, backend="array")
+		cfr.tracker_interval = 10 * cfr.iterations
+		profiler = profiling.Profiler(report_path=None, cprofile_every=50)
+		cfr.solve(method="external", n_workers=2, round_size=25, profile=profiler)
+
+		self.assertEqual(profiler.counters["iterations"], 200)
+		self.assertEqual(profiler.calls["CFR.get_infoSet"], cfr.nodes_visited)
+		self.assertEqual(profiler.counters["infoSet creations"] + profiler.counters["infoSet hits"], cfr.nodes_visited)
+		self.assertGreater(profiler.calls["KuhnHistory.terminal_utility"], 0)
+		self.assertIsNone(cfr.profiler)
+
+	def test_environment_variable(self):
+		with tempfile.TemporaryDirectory() as directory:
+			os.environ[profiling.ENVIRONMENT_VARIABLE] = "1"
+			cwd = os.getcwd()
+			os.chdir(directory)
+			try:
+				train_kuhn(20)
+			finally:
+				os.chdir(cwd)
+				del os.environ[profiling.ENVIRONMENT_VARIABLE]
+			with open(os.path.join(directory, "profile_report.txt")) as f:
+				self.assertIn("cProfile", f.read())
+
+
+class StrategyExportUnitTests(unittest.TestCase):
+	def test_export(self):
+		# The compact export should keep the average strategies within the quantization error, for both backends
+		for backend in ["dict", "array"]:
+			cfr = train_kuhn(backend=backend)
+			for dtype in ["uint8", "float16"]:
+				with tempfile.TemporaryDirectory() as directory:
+					filename = os.path.join(directory, "strategy.npz")
+					report = strategy_export.export_average_strategy(cfr.infoSets, filename, dtype)
+					strategy = strategy_export.load_strategy(filename)
+
+				self.assertEqual(report["infosets"], 12)
+				self.assertEqual(report["actions"], 24)
+				self.assertGreater(report["compression_ratio"], 1)
+				self.assertLessEqual(report["max_error"], 1 / 255)
+				self.assertEqual(sorted(strategy.keys()), sorted(cfr.infoSets.keys()))
+				for key in cfr.infoSets.keys():
+					exact = cfr.infoSets[key].get_average_strategy()
+					compact = strategy[key].get_average_strategy()
+					self.assertEqual(list(compact), cfr.infoSets[key].actions())
+					self.assertAlmostEqual(sum(compact.values()), 1)
+					for action, probability in exact.items():
+						self.assertAlmostEqual(compact[action], probability, delta=1 / 255)
+
+	def test_quantize(self):
+		probabilities = np.array([1 / 3, 1 / 3, 1 / 3, 0.5, 0.5, 0.999, 0.001])
+		quantized = strategy_export.quantize(probabilities, np.array([0, 3, 5, 7]))
+		np.testing.assert_array_equal(np.add.reduceat(quantized.astype(int), [0, 3, 5]), [255, 255, 255])
+		self.assertLessEqual(np.abs(quantized / 255 - probabilities).max(), 1 / 255)
+
+
+if __name__ == "__main__":
+	unittest.main()